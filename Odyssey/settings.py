@@ -141,5 +141,13 @@ REST_FRAMEWORK = {
 }
 
 
+# Upstream data sources. Set these in the environment to run against recorded feeds
+# served by `python manage.py replay_feeds` instead of the live networks.
+VATSIM_DATA_URL = os.environ.get('VATSIM_DATA_URL', 'https://data.vatsim.net/v3/vatsim-data.json')
+VATSIM_API_URL = os.environ.get('VATSIM_API_URL', 'https://api.vatsim.net')
+IVAO_WHAZZUP_URL = os.environ.get('IVAO_WHAZZUP_URL', 'https://api.ivao.aero/v2/tracker/whazzup')
+AVIATIONWEATHER_URL = os.environ.get('AVIATIONWEATHER_URL', 'https://aviationweather.gov')
+
+
 GDAL_LIBRARY_PATH = '/opt/homebrew/opt/gdal/lib/libgdal.dylib'
 GEOS_LIBRARY_PATH = '/opt/homebrew/opt/geos/lib/libgeos_c.dylib'
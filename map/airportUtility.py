@@ -0,0 +1,135 @@
+import math
+import threading
+import time
+
+import numpy as np
+from django.db import DatabaseError
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from map.models import AIRPORT_TIER_MAJOR, AIRPORT_TIER_MEDIUM, AIRPORT_TIER_MINOR, Airport
+
+# Seconds the in-memory airport table is used before it is read from the database again
+AIRPORT_TABLE_SECONDS = 3600
+# Size in degrees of the buckets of the spatial airport grid
+AIRPORT_GRID_DEG = 1
+# Map zoom level past which each display tier is drawn, the map shows no airports below the first
+AIRPORT_TIER_ZOOMS = (
+    (AIRPORT_TIER_MINOR, 10),
+    (AIRPORT_TIER_MEDIUM, 8.1),
+    (AIRPORT_TIER_MAJOR, 4.5),
+)
+
+airport_table_state = {
+    'index': None,
+    'loaded_at': 0,
+}
+# Only one thread at a time reads the table
+airport_table_lock = threading.Lock()
+
+
+@receiver(post_save, sender=Airport)
+@receiver(post_delete, sender=Airport)
+def airport_changed(sender, **kwargs):
+    # Read the table again on next use
+    airport_table_state['loaded_at'] = 0
+
+
+def visible_tier(zoom):
+    '''Returns the highest display tier drawn at a map zoom level, or None if no airports are drawn.'''
+    for tier, tier_zoom in AIRPORT_TIER_ZOOMS:
+        if zoom > tier_zoom:
+            return tier
+    return None
+
+
+class AirportIndex:
+    '''
+    The airport table held in memory, for position lookups and viewport queries.
+
+    Airports are sorted by display tier and then grid bucket, so the airports of one tier in
+    one bucket are a contiguous slice of the columns, found through grid {(tier, row, column): (start, stop)}.
+    '''
+
+    def __init__(self, rows):
+        rows = sorted(rows, key=lambda row: (row[6], math.floor(row[4] / AIRPORT_GRID_DEG), math.floor(row[5] / AIRPORT_GRID_DEG)))
+        self.positions = {ident: (latitude, longitude) for ident, _, _, _, latitude, longitude, _ in rows}
+        self.idents = [row[0] for row in rows]
+        self.names = [row[1] for row in rows]
+        self.types = [row[2] for row in rows]
+        self.regions = [row[3] for row in rows]
+        self.latitude = np.array([row[4] for row in rows], dtype=float)
+        self.longitude = np.array([row[5] for row in rows], dtype=float)
+
+        self.grid = {}
+        for airport, (_, _, _, _, latitude, longitude, tier) in enumerate(rows):
+            key = (tier, math.floor(latitude / AIRPORT_GRID_DEG), math.floor(longitude / AIRPORT_GRID_DEG))
+            start, _ = self.grid.get(key, (airport, airport))
+            self.grid[key] = (start, airport + 1)
+
+    def __len__(self):
+        return len(self.idents)
+
+    def in_viewport(self, viewport, max_tier):
+        '''Returns the indexes of the airports of display tier max_tier or lower inside a Viewport from parse_viewport.'''
+        if viewport.west <= viewport.east:
+            longitude_ranges = [(viewport.west, viewport.east)]
+        else:
+            # The viewport crosses the antimeridian
+            longitude_ranges = [(viewport.west, 180), (-180, viewport.east)]
+        rows = range(math.floor(viewport.south / AIRPORT_GRID_DEG), math.floor(viewport.north / AIRPORT_GRID_DEG) + 1)
+
+        slices = []
+        for west, east in longitude_ranges:
+            columns = range(math.floor(west / AIRPORT_GRID_DEG), math.floor(east / AIRPORT_GRID_DEG) + 1)
+            slices.extend(
+                self.grid[(tier, row, column)]
+                for tier in range(max_tier + 1) for row in rows for column in columns if (tier, row, column) in self.grid
+            )
+        if not slices:
+            return np.empty(0, dtype=np.int64)
+        airports = np.unique(np.concatenate([np.arange(start, stop) for start, stop in slices]))
+
+        latitude = self.latitude[airports]
+        longitude = self.longitude[airports]
+        inside = (latitude >= viewport.south) & (latitude <= viewport.north)
+        if viewport.west <= viewport.east:
+            inside &= (longitude >= viewport.west) & (longitude <= viewport.east)
+        else:
+            inside &= (longitude >= viewport.west) | (longitude <= viewport.east)
+        return airports[inside]
+
+    def marker(self, airport):
+        '''Returns one airport as the dict airports_view sends.'''
+        return {
+            'name': self.names[airport],
+            'type': self.types[airport],
+            'coordinates': f"{self.longitude[airport]}, {self.latitude[airport]}",
+            'municipality': self.regions[airport],  # iso_region is used in place of municipality
+            'ident': self.idents[airport],
+        }
+
+
+def get_airport_index():
+    '''Returns the shared AirportIndex, read from the database at most every AIRPORT_TABLE_SECONDS.'''
+    index = airport_table_state['index']
+    if index is not None and time.time() - airport_table_state['loaded_at'] < AIRPORT_TABLE_SECONDS:
+        return index
+
+    with airport_table_lock:
+        if airport_table_state['index'] is None or time.time() - airport_table_state['loaded_at'] >= AIRPORT_TABLE_SECONDS:
+            try:
+                airport_table_state['index'] = AirportIndex(Airport.objects.values_list(
+                    'ident', 'name', 'type', 'iso_region', 'latitude_deg', 'longitude_deg', 'display_tier'
+                ))
+            except DatabaseError as e:
+                # Keep what we had, an unmigrated database just means no airports yet
+                print(f"Error loading airports: {e}")
+                airport_table_state['index'] = airport_table_state['index'] or AirportIndex([])
+            airport_table_state['loaded_at'] = time.time()
+        return airport_table_state['index']
+
+
+def get_airport_positions():
+    '''Returns {ident: (latitude, longitude)} for every airport, read from the database at most every AIRPORT_TABLE_SECONDS.'''
+    return get_airport_index().positions
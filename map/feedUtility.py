@@ -0,0 +1,282 @@
+import math
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+from types import MappingProxyType
+
+# Size in degrees of the lat/lon buckets used for the spatial pilot index
+GRID_CELL_DEG = 5
+# Number of past snapshot versions a client can still ask for a delta against
+DELTA_HISTORY_SIZE = 20
+# Below this map zoom level pilot payloads are decimated to one pilot per screen-sized bucket
+DECIMATE_BELOW_ZOOM = 5
+# Decimation buckets per 256px map tile at the requested zoom
+DECIMATE_BUCKETS_PER_TILE = 4
+
+# Fields of a normalised Pilot record, shared by every network
+PILOT_FIELDS = (
+    'network', 'id', 'callsign', 'name', 'latitude', 'longitude', 'altitude', 'groundspeed', 'heading', 'transponder',
+    'has_flight_plan', 'aircraft_short', 'departure', 'arrival', 'alternate', 'cruise_tas', 'planned_altitude',
+    'deptime', 'enroute_time', 'route', 'revision_id',
+    # Derived once per snapshot by fleet_progress, None without a flight between two known airports
+    'progress',
+)
+
+# Map viewport requested by a client, longitudes normalised to [-180, 180]
+Viewport = namedtuple('Viewport', ['north', 'south', 'east', 'west', 'zoom'])
+
+
+def grid_cell(latitude, longitude):
+    '''Returns the (row, column) grid bucket containing the given position.'''
+    return int(math.floor(latitude / GRID_CELL_DEG)), int(math.floor(longitude / GRID_CELL_DEG))
+
+
+def viewport_contains(viewport, latitude, longitude):
+    '''Returns True if the position lies inside the viewport, including viewports crossing the antimeridian.'''
+    if latitude is None or longitude is None or not viewport.south <= latitude <= viewport.north:
+        return False
+    if viewport.west <= viewport.east:
+        return viewport.west <= longitude <= viewport.east
+    return longitude >= viewport.west or longitude <= viewport.east
+
+
+def normalise_longitude(longitude):
+    '''Wraps a longitude into [-180, 180).'''
+    return (longitude + 180) % 360 - 180
+
+
+def parse_viewport(request):
+    '''
+    Reads the northBound/southBound/eastBound/westBound/zoom parameters used by airports_view.
+
+    Returns None when the request has no bounds, so callers can serve the whole world.
+    '''
+    if 'northBound' not in request.GET and 'southBound' not in request.GET:
+        return None
+    try:
+        north = min(float(request.GET.get('northBound', '90')), 90)
+        south = max(float(request.GET.get('southBound', '-90')), -90)
+        east = float(request.GET.get('eastBound', '180'))
+        west = float(request.GET.get('westBound', '-180'))
+        zoom = float(request.GET.get('zoom', 10))
+    except ValueError:
+        return None
+
+    # The map reports longitudes past +/-180 once the user pans across the antimeridian
+    if east - west >= 360:
+        west, east = -180, 180
+    else:
+        west, east = normalise_longitude(west), normalise_longitude(east)
+        if east == -180:
+            east = 180
+    return Viewport(north, south, east, west, zoom)
+
+
+def decimate_pilots(pilots, zoom):
+    '''
+    Thins pilots to one per bucket sized to a fraction of a map tile at the given zoom.
+
+    Returns the kept pilots and, in the same order, the number of pilots each one stands for.
+    '''
+    cell_deg = 360 / (2 ** max(zoom, 0) * DECIMATE_BUCKETS_PER_TILE)
+    buckets = {}
+    for pilot in pilots:
+        cell = (int(math.floor(pilot.latitude / cell_deg)), int(math.floor(pilot.longitude / cell_deg)))
+        bucket = buckets.get(cell)
+        if bucket is None:
+            buckets[cell] = [pilot, 1]
+        else:
+            bucket[1] += 1
+    return [pilot for pilot, _ in buckets.values()], [count for _, count in buckets.values()]
+
+
+class Pilot:
+    '''
+    Compact pilot record normalised from any network feed.
+
+    Flight plan fields are None when the pilot has not filed one. cruise_tas and
+    planned_altitude are kept in the form the network reports them.
+    '''
+    __slots__ = PILOT_FIELDS
+
+    def __init__(self, network, pilot_id, **fields):
+        self.network = network
+        self.id = pilot_id
+        for field in PILOT_FIELDS[2:]:
+            setattr(self, field, fields.get(field))
+
+    def fingerprint(self):
+        '''Returns the fields whose change means clients need the pilot again, position first.'''
+        return (
+            self.latitude,
+            self.longitude,
+            self.callsign,
+            self.heading,
+            self.altitude,
+            self.groundspeed,
+            self.departure,
+            self.arrival,
+            self.route,
+            self.revision_id,
+        )
+
+
+class FeedSnapshot:
+    '''
+    Immutable set of Pilot records from one network feed download, together with the lookup indexes derived from it.
+
+    The indexes are built once per feed update, so every lookup made while handling
+    a request reads from the same data, identified by the snapshot version.
+    data holds whatever feed metadata the provider keeps next to the pilots.
+    '''
+    __slots__ = ('version', 'data', 'pilots', 'pilots_by_id', 'pilots_by_callsign', 'grid', 'fingerprints')
+
+    def __init__(self, version, pilots, data=None):
+        pilots = tuple(pilot for pilot in pilots if pilot is not None)
+        pilots_by_id = {}
+        pilots_by_callsign = {}
+        grid = {}
+        fingerprints = {}
+
+        for pilot in pilots:
+            if pilot.id is not None:
+                pilots_by_id[int(pilot.id)] = pilot
+                fingerprints[int(pilot.id)] = pilot.fingerprint()
+            if pilot.callsign:
+                pilots_by_callsign[pilot.callsign.upper()] = pilot
+            if pilot.latitude is not None and pilot.longitude is not None:
+                grid.setdefault(grid_cell(pilot.latitude, pilot.longitude), []).append(pilot)
+
+        object.__setattr__(self, 'version', version)
+        object.__setattr__(self, 'data', MappingProxyType(dict(data or {})))
+        object.__setattr__(self, 'pilots', pilots)
+        object.__setattr__(self, 'pilots_by_id', MappingProxyType(pilots_by_id))
+        object.__setattr__(self, 'pilots_by_callsign', MappingProxyType(pilots_by_callsign))
+        object.__setattr__(self, 'grid', MappingProxyType({cell: tuple(cell_pilots) for cell, cell_pilots in grid.items()}))
+        object.__setattr__(self, 'fingerprints', MappingProxyType(fingerprints))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('FeedSnapshot is immutable')
+
+    def find_pilot(self, pilot_id):
+        '''Returns the pilot with the given network ID, or None if they are not connected.'''
+        try:
+            return self.pilots_by_id.get(int(pilot_id))
+        except (TypeError, ValueError):
+            return None
+
+    def find_pilot_by_callsign(self, callsign):
+        '''Returns the pilot flying the given callsign, or None if it is not connected.'''
+        return self.pilots_by_callsign.get(str(callsign).upper())
+
+    def pilots_in_viewport(self, viewport):
+        '''Returns the pilots inside the viewport, reading only the grid buckets it overlaps.'''
+        first_row, last_row = grid_cell(viewport.south, 0)[0], grid_cell(viewport.north, 0)[0]
+        if viewport.west <= viewport.east:
+            column_ranges = [(grid_cell(0, viewport.west)[1], grid_cell(0, viewport.east)[1])]
+        else:
+            column_ranges = [(grid_cell(0, viewport.west)[1], grid_cell(0, 180)[1]), (grid_cell(0, -180)[1], grid_cell(0, viewport.east)[1])]
+        cells = [
+            (row, column)
+            for row in range(first_row, last_row + 1)
+            for first_column, last_column in column_ranges
+            for column in range(first_column, last_column + 1)
+        ]
+
+        pilots = []
+        for cell in cells:
+            for pilot in self.grid.get(cell, ()):
+                # Edge buckets are only partially inside the viewport
+                if viewport_contains(viewport, pilot.latitude, pilot.longitude):
+                    pilots.append(pilot)
+        return pilots
+
+
+def feed_version(update_timestamp, previous_version):
+    '''
+    Derives a snapshot version from the feed's update timestamp.
+
+    Using the publish time in epoch seconds keeps versions identical across worker
+    processes and restarts, falling back to the local clock when the feed omits it.
+    '''
+    try:
+        version = int(datetime.strptime(update_timestamp[:19], '%Y-%m-%dT%H:%M:%S').replace(tzinfo=timezone.utc).timestamp())
+    except (TypeError, ValueError):
+        version = int(time.time())
+    # Versions must only ever move forward
+    return max(version, previous_version + 1)
+
+
+def remember_snapshot(state, snapshot):
+    '''Makes snapshot the current one for a feed and keeps its fingerprints for later deltas.'''
+    history = state['history']
+    history[snapshot.version] = snapshot.fingerprints
+    while len(history) > DELTA_HISTORY_SIZE:
+        history.popitem(last=False)
+    state['snapshot'] = snapshot
+
+
+def snapshot_delta(state, snapshot, since, viewport=None):
+    '''
+    Compares snapshot against the remembered version since, optionally limited to a viewport.
+
+    Returns a (changed_pilots, removed_ids) tuple, or None when since is too old
+    to be in the history and the client needs the full payload instead.
+    '''
+    if since == snapshot.version:
+        return [], []
+    base = state['history'].get(since)
+    if base is None or since > snapshot.version:
+        return None
+
+    if viewport is None:
+        changed = [pilot for pilot_id, pilot in snapshot.pilots_by_id.items() if base.get(pilot_id) != snapshot.fingerprints[pilot_id]]
+        removed = [pilot_id for pilot_id in base if pilot_id not in snapshot.pilots_by_id]
+        return changed, removed
+
+    changed = []
+    visible_ids = set()
+    for pilot in snapshot.pilots_in_viewport(viewport):
+        if pilot.id is None:
+            continue
+        pilot_id = int(pilot.id)
+        visible_ids.add(pilot_id)
+        if base.get(pilot_id) != snapshot.fingerprints[pilot_id]:
+            changed.append(pilot)
+    # Pilots that were visible before and are not any more, either disconnected or moved out of view
+    removed = [
+        pilot_id for pilot_id, fingerprint in base.items()
+        if pilot_id not in visible_ids and viewport_contains(viewport, fingerprint[0], fingerprint[1])
+    ]
+    return changed, removed
+
+
+def parse_since(request):
+    '''Returns the snapshot version from the request's since parameter, or None if absent or invalid.'''
+    try:
+        return int(request.GET['since'])
+    except (KeyError, ValueError):
+        return None
+
+
+def delta_payload(state, snapshot, since, viewport=None):
+    '''
+    Builds the pilots payload for a client that last saw version since, falling back to the full pilot list.
+
+    With a viewport only pilots inside it are sent, and below DECIMATE_BELOW_ZOOM the
+    pilots are always sent in full, decimated to one per bucket with cluster_counts alongside.
+    The pilots are Pilot records, the network's provider turns them into its JSON shape.
+    '''
+    if viewport is not None and viewport.zoom < DECIMATE_BELOW_ZOOM:
+        pilots, cluster_counts = decimate_pilots(snapshot.pilots_in_viewport(viewport), viewport.zoom)
+        return {'version': snapshot.version, 'full': True, 'decimated': True, 'pilots': pilots, 'cluster_counts': cluster_counts}
+
+    delta = snapshot_delta(state, snapshot, since, viewport) if since is not None else None
+    if delta is None:
+        pilots = snapshot.pilots_in_viewport(viewport) if viewport is not None else list(snapshot.pilots)
+        return {'version': snapshot.version, 'full': True, 'pilots': pilots}
+
+    changed, removed = delta
+    # Viewport deltas also remove pilots that only moved out of view, offline tells the two apart
+    offline = [pilot_id for pilot_id in removed if pilot_id not in snapshot.pilots_by_id]
+    return {'version': snapshot.version, 'full': False, 'since': since, 'pilots': changed, 'removed': removed, 'offline': offline}
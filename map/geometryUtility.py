@@ -0,0 +1,132 @@
+import numpy as np
+
+from map.waypointUtility import EARTH_RADIUS_KM, mercator_y, unit_vectors
+
+KM_PER_NM = 1.852
+# Below this groundspeed in knots an aircraft is taxiing or parked and gets no ETA
+ETA_MIN_GROUNDSPEED = 50
+# Route legs are split into great-circle steps of at most this many kilometers before simplification
+DENSIFY_STEP_KM = 25
+# Simplified routes stay within this many screen pixels of the great-circle path
+SIMPLIFY_TOLERANCE_PIXELS = 0.5
+
+
+def haversine_km(latitude1, longitude1, latitude2, longitude2):
+    '''Returns great-circle distances in kilometers between positions in degrees, element-wise over arrays.'''
+    latitude1, longitude1, latitude2, longitude2 = map(np.radians, (latitude1, longitude1, latitude2, longitude2))
+    a = np.sin((latitude2 - latitude1) / 2) ** 2 + np.cos(latitude1) * np.cos(latitude2) * np.sin((longitude2 - longitude1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def fleet_progress(pilots, airports, now):
+    '''
+    Sets the progress of every pilot flying between two known airports, in one vectorized pass.
+
+    progress holds the great-circle distance left to the arrival airport in kilometers, the
+    percent of the departure to arrival distance already covered, and an ETA in epoch
+    seconds from the groundspeed at time now. Pilots without one keep progress None.
+    Returns the number of pilots that got a progress.
+    '''
+    flights = [
+        pilot for pilot in pilots
+        if pilot is not None and pilot.latitude is not None and pilot.longitude is not None
+        and pilot.departure in airports and pilot.arrival in airports
+    ]
+    if not flights:
+        return 0
+
+    departure = np.array([airports[pilot.departure] for pilot in flights], dtype=float)
+    arrival = np.array([airports[pilot.arrival] for pilot in flights], dtype=float)
+    latitude = np.array([pilot.latitude for pilot in flights], dtype=float)
+    longitude = np.array([pilot.longitude for pilot in flights], dtype=float)
+    groundspeed = np.array([pilot.groundspeed or 0 for pilot in flights], dtype=float)
+
+    total = haversine_km(departure[:, 0], departure[:, 1], arrival[:, 0], arrival[:, 1])
+    remaining = haversine_km(latitude, longitude, arrival[:, 0], arrival[:, 1])
+    percent = np.clip(np.divide(total - remaining, total, out=np.zeros(len(flights)), where=total > 0) * 100, 0, 100)
+    moving = groundspeed >= ETA_MIN_GROUNDSPEED
+    eta = now + np.divide(remaining * 3600, groundspeed * KM_PER_NM, out=np.zeros(len(flights)), where=moving)
+
+    for pilot, remaining_km, percent_complete, arrives, has_eta in zip(
+        flights, np.rint(remaining).astype(int).tolist(), np.round(percent, 1).tolist(), eta.astype(np.int64).tolist(), moving.tolist()
+    ):
+        pilot.progress = {
+            'remaining_km': remaining_km,
+            'percent_complete': percent_complete,
+            'eta': arrives if has_eta else None,
+        }
+    return len(flights)
+
+
+def densify_great_circle(latitude, longitude, step_km=DENSIFY_STEP_KM):
+    '''Returns the latitudes and longitudes of a path with points added along every leg's great circle, at most step_km apart.'''
+    latitude = np.asarray(latitude, dtype=float)
+    longitude = np.asarray(longitude, dtype=float)
+    if len(latitude) < 2:
+        return latitude, longitude
+
+    points = unit_vectors(latitude, longitude)
+    start = points[:-1]
+    end = points[1:]
+    angle = np.arctan2(np.linalg.norm(np.cross(start, end), axis=1), np.einsum('ij,ij->i', start, end))
+    steps = np.maximum(np.ceil(angle * EARTH_RADIUS_KM / step_km).astype(np.int64), 1)
+    leg = np.repeat(np.arange(len(angle)), steps)
+    fraction = (np.arange(steps.sum()) - np.repeat(np.cumsum(steps) - steps, steps)) / steps[leg]
+
+    # Spherical interpolation, falling back to linear for legs too short to have a direction
+    leg_angle = angle[leg]
+    sin_angle = np.sin(leg_angle)
+    short = sin_angle < 1e-12
+    divisor = np.where(short, 1, sin_angle)
+    weight_start = np.where(short, 1 - fraction, np.sin((1 - fraction) * leg_angle) / divisor)
+    weight_end = np.where(short, fraction, np.sin(fraction * leg_angle) / divisor)
+    vectors = np.vstack((weight_start[:, None] * start[leg] + weight_end[:, None] * end[leg], points[-1:]))
+    vectors /= np.linalg.norm(vectors, axis=1)[:, None]
+    return np.degrees(np.arcsin(np.clip(vectors[:, 2], -1, 1))), np.degrees(np.arctan2(vectors[:, 1], vectors[:, 0]))
+
+
+def simplify_path(x, y, tolerance):
+    '''Returns the indexes of the points Douglas-Peucker keeps of a planar path, for a tolerance in the units of x and y.'''
+    count = len(x)
+    if count < 3:
+        return np.arange(count)
+    keep = np.zeros(count, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, count - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        dx = x[last] - x[first]
+        dy = y[last] - y[first]
+        inner_x = x[first + 1:last] - x[first]
+        inner_y = y[first + 1:last] - y[first]
+        # Distance of every inner point to the segment, clamped to its end points
+        length = dx * dx + dy * dy
+        along = np.clip((inner_x * dx + inner_y * dy) / length, 0, 1) if length > 0 else np.zeros(len(inner_x))
+        offsets = np.hypot(inner_x - along * dx, inner_y - along * dy)
+        farthest = int(np.argmax(offsets))
+        if offsets[farthest] > tolerance:
+            middle = first + 1 + farthest
+            keep[middle] = True
+            stack.append((first, middle))
+            stack.append((middle, last))
+    return np.flatnonzero(keep)
+
+
+def display_path(latitude, longitude, zoom):
+    '''
+    Returns the [longitude, latitude] points to draw a route at a map zoom level.
+
+    Legs are densified along their great circles, then simplified with Douglas-Peucker in
+    Web Mercator, the projection the map draws in, to SIMPLIFY_TOLERANCE_PIXELS at that zoom.
+    Longitudes are unwrapped so routes crossing the antimeridian stay continuous.
+    '''
+    latitude, longitude = densify_great_circle(latitude, longitude)
+    if len(latitude) == 0:
+        return []
+    longitude = np.degrees(np.unwrap(np.radians(longitude)))
+    # One pixel of a 256 pixel tile at this zoom, in the radians Mercator x and y are measured in
+    tolerance = SIMPLIFY_TOLERANCE_PIXELS * 2 * np.pi / (256 * 2 ** zoom)
+    kept = simplify_path(np.radians(longitude), mercator_y(latitude), tolerance)
+    return np.column_stack((np.round(longitude[kept], 5), np.round(latitude[kept], 5))).tolist()
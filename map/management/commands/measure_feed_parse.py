@@ -0,0 +1,77 @@
+import io
+import json
+import statistics
+import time
+import tracemalloc
+
+import ijson
+from django.core.management.base import BaseCommand
+
+from map.networkUtility import STREAM_VATSIM_FEED, parse_vatsim_feed, vatsim_pilot
+
+
+class ArrivingStream:
+    '''Read-only file-like object handing out a body no faster than it would arrive over a link of rate bytes per second.'''
+
+    def __init__(self, body, rate):
+        self.body = body
+        self.rate = rate
+        self.position = 0
+        self.started = time.perf_counter()
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self.body) - self.position
+        chunk = self.body[self.position:self.position + size]
+        self.position += len(chunk)
+        # Bytes that arrived while the reader was busy are waiting in the socket buffer, like they would be
+        if self.rate:
+            wait = self.started + self.position / self.rate - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+        return chunk
+
+
+def parse_buffered(stream):
+    '''Parses the feed the way it was parsed before streaming, the whole body first and then json.loads.'''
+    feed = json.loads(stream.read())
+    return feed.get('general') or {}, [vatsim_pilot(pilot) for pilot in feed.get('pilots') or []]
+
+
+def parse_streamed(stream):
+    return parse_vatsim_feed(stream)
+
+
+class Command(BaseCommand):
+    help = 'Measures wall time and peak memory of parsing a saved VATSIM feed with json.loads and with parse_vatsim_feed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('feed', help='Path to a saved vatsim-data.json')
+        parser.add_argument('--runs', type=int, default=15, help='Number of timed runs of each parser')
+        parser.add_argument('--rate', type=float, default=0, help='Download rate in megabytes per second to replay the feed at, 0 for none')
+
+    def handle(self, *args, **options):
+        with open(options['feed'], 'rb') as feed:
+            body = feed.read()
+        rate = options['rate'] * 1e6
+        self.stdout.write(f"ijson backend: {ijson.backend}, parse_vatsim_feed streams: {STREAM_VATSIM_FEED}")
+        if not STREAM_VATSIM_FEED:
+            self.stderr.write('Without the yajl2_c backend parse_vatsim_feed falls back to json.loads, both rows measure the same parser.')
+
+        for name, parse in (('json.loads', parse_buffered), ('parse_vatsim_feed', parse_streamed)):
+            timings = []
+            for _ in range(options['runs']):
+                stream = ArrivingStream(body, rate)
+                start = time.perf_counter()
+                _, pilots = parse(stream)
+                timings.append((time.perf_counter() - start) * 1000)
+
+            # Traced separately, tracemalloc slows the parsers down too much to time them at once
+            tracemalloc.start()
+            parse(io.BytesIO(body))
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self.stdout.write(
+                f"{name}: {len(pilots)} pilots, median {statistics.median(timings):.1f} ms, "
+                f"best {min(timings):.1f} ms, peak {peak / 1e6:.1f} MB"
+            )
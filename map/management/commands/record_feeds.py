@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from map.replayUtility import FIXTURES_DIR, record_fixtures
+
+
+class Command(BaseCommand):
+    help = 'Records the VATSIM, IVAO and aviationweather feeds as fixtures for replay_feeds.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fixtures', default=FIXTURES_DIR, help='Directory the fixtures are written to')
+        parser.add_argument('--flightplans', type=int, default=20, help='Number of member flight plans to record')
+
+    def handle(self, *args, **options):
+        index = record_fixtures(options['fixtures'], options['flightplans'])
+        self.stdout.write(f"Recorded {len(index)} responses to {options['fixtures']}")
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from map.replayUtility import FIXTURES_DIR, IVAO_FEED_PATH, REPLAY_TICK_SECONDS, VATSIM_FEED_PATH, replay_server
+
+
+class Command(BaseCommand):
+    help = 'Serves the recorded feeds on localhost with configurable latency, jitter and error rate, moving pilots every tick.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--fixtures', default=FIXTURES_DIR, help='Directory written by record_feeds')
+        parser.add_argument('--tick', type=float, default=REPLAY_TICK_SECONDS, help='Seconds between feed updates')
+        parser.add_argument('--latency', type=float, default=0, help='Milliseconds added to every response')
+        parser.add_argument('--jitter', type=float, default=0, help='Milliseconds the latency varies by either way')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests answered with a 503')
+        parser.add_argument('--seed', type=int, default=None, help='Seed for reproducible latency and failures')
+
+    def handle(self, *args, **options):
+        server = replay_server(
+            options['port'], options['fixtures'], options['tick'],
+            latency_ms=options['latency'], jitter_ms=options['jitter'], error_rate=options['error_rate'], seed=options['seed'],
+        )
+        base = f"http://127.0.0.1:{options['port']}"
+        self.stdout.write("Replaying feeds, point the app at them with:")
+        self.stdout.write(f"  VATSIM_DATA_URL={base}{VATSIM_FEED_PATH}")
+        self.stdout.write(f"  IVAO_WHAZZUP_URL={base}{IVAO_FEED_PATH}")
+        self.stdout.write(f"  VATSIM_API_URL={base}")
+        self.stdout.write(f"  AVIATIONWEATHER_URL={base}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
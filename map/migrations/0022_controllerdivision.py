@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('map', '0021_alter_controller_division'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ControllerDivision',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('vatsim_id', models.IntegerField(unique=True)),
+                ('division', models.CharField(blank=True, max_length=10, null=True)),
+                ('updated_at', models.DateTimeField()),
+            ],
+        ),
+    ]
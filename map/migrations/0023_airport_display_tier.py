@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:41
+
+from django.db import migrations, models
+
+
+def set_display_tiers(apps, schema_editor):
+    '''Sets the display tier of the airports already imported, the same way Airport.save does.'''
+    Airport = apps.get_model('map', 'Airport')
+    Airport.objects.filter(type='large_airport').update(display_tier=0)
+    Airport.objects.filter(type='medium_airport', name__icontains='international').update(display_tier=0)
+    Airport.objects.filter(type__in=['medium_airport', 'heliport']).exclude(display_tier=0).update(display_tier=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('map', '0022_controllerdivision'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='airport',
+            name='display_tier',
+            field=models.PositiveSmallIntegerField(default=2),
+        ),
+        migrations.AddIndex(
+            model_name='airport',
+            index=models.Index(fields=['display_tier', 'latitude_deg', 'longitude_deg'], name='airport_tier_position_idx'),
+        ),
+        migrations.RunPython(set_display_tiers, migrations.RunPython.noop),
+    ]
@@ -17,6 +17,21 @@ class Airport(models.Model):
 
 from django.db import models
 
+# Map display tiers of airports, an airport is drawn once the map zooms past its tier's zoom level
+AIRPORT_TIER_MAJOR = 0  # large airports and international medium airports
+AIRPORT_TIER_MEDIUM = 1  # other medium airports and heliports
+AIRPORT_TIER_MINOR = 2  # everything else
+
+
+def airport_display_tier(airport_type, name):
+    '''Returns the display tier of an airport from its type and name.'''
+    if airport_type == 'large_airport' or (airport_type == 'medium_airport' and 'international' in name.lower()):
+        return AIRPORT_TIER_MAJOR
+    if airport_type in ('medium_airport', 'heliport'):
+        return AIRPORT_TIER_MEDIUM
+    return AIRPORT_TIER_MINOR
+
+
 class Airport(models.Model):
     ident = models.CharField(max_length=10, unique=True)
     type = models.CharField(max_length=50)
@@ -27,6 +42,18 @@ class Airport(models.Model):
     continent = models.CharField(max_length=2)
     iso_country = models.CharField(max_length=2)
     iso_region = models.CharField(max_length=7)
+    # Derived from type and name on save, see airport_display_tier
+    display_tier = models.PositiveSmallIntegerField(default=AIRPORT_TIER_MINOR)
+
+    class Meta:
+        indexes = [
+            # Viewport queries filter on the tier first, then the position
+            models.Index(fields=['display_tier', 'latitude_deg', 'longitude_deg'], name='airport_tier_position_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.display_tier = airport_display_tier(self.type, self.name)
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.name} ({self.ident})"
@@ -52,6 +79,24 @@ class Controller(models.Model):
         self.name = '{}_{}'.format(self.ident, self.type)
         super(Controller, self).save(*args, **kwargs)
 
+class ControllerDivision(models.Model):
+    vatsim_id = models.IntegerField(unique=True)
+    division = models.CharField(max_length=10, null=True, blank=True)
+    updated_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.vatsim_id} ({self.division})"
+
+
+class DataVersion(models.Model):
+    '''Version counter of a table whose serialized responses are cached, shared by every worker process.'''
+    name = models.CharField(max_length=50, unique=True)
+    version = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} ({self.version})"
+
+
 class Waypoint(models.Model):
     ident = models.CharField(max_length=10)
     latitude_deg = models.FloatField()
@@ -0,0 +1,453 @@
+import io
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import ijson
+import requests
+from django.conf import settings
+
+from map.airportUtility import get_airport_positions
+from map.conversionUtility import flight_level_to_feet, speed_to_knots
+from map.feedUtility import FeedSnapshot, Pilot, feed_version, remember_snapshot
+from map.geometryUtility import fleet_progress
+from map.streamUtility import publish_update
+
+# Initial headers setup
+user_agent = 'SimTrail/1.0 (SimTrail; https://simtrail.com/)'
+headers = {
+    'User-Agent': user_agent
+}
+
+# Upstream locations for every utility module, from settings so they can point at a replay server
+VATSIM_DATA_URL = settings.VATSIM_DATA_URL
+VATSIM_API_URL = settings.VATSIM_API_URL
+IVAO_WHAZZUP_URL = settings.IVAO_WHAZZUP_URL
+AVIATIONWEATHER_URL = settings.AVIATIONWEATHER_URL
+
+# Consecutive upstream failures that open a circuit, and seconds it stays open before a trial request is let through
+CIRCUIT_FAILURE_THRESHOLD = 3
+CIRCUIT_RESET_SECONDS = 60
+# Seconds a request waits for the very first download of a feed, later requests never wait on upstream
+FIRST_FETCH_WAIT_SECONDS = 5
+
+# Leading bytes of the VATSIM feed read up front, the general block always comes first and is far smaller
+FEED_HEAD_BYTES = 16384
+
+# Streaming only pays off with ijson's C backend, the pure Python ones parse the feed an order of magnitude slower than json.loads
+STREAM_VATSIM_FEED = ijson.backend == 'yajl2_c'
+if not STREAM_VATSIM_FEED:
+    print(f"ijson is using its {ijson.backend} backend, the VATSIM feed will be parsed whole with json.loads. Install yajl to stream it.")
+
+
+def vatsim_pilot(raw):
+    '''Normalises a pilot from the VATSIM data feed into a Pilot record.'''
+    flight_plan = raw.get('flight_plan') or {}
+    return Pilot(
+        'vatsim',
+        raw.get('cid'),
+        callsign=raw.get('callsign'),
+        name=raw.get('name'),
+        latitude=raw.get('latitude'),
+        longitude=raw.get('longitude'),
+        altitude=raw.get('altitude'),
+        groundspeed=raw.get('groundspeed'),
+        heading=raw.get('heading'),
+        transponder=raw.get('transponder'),
+        has_flight_plan=bool(flight_plan),
+        aircraft_short=flight_plan.get('aircraft_short'),
+        departure=flight_plan.get('departure'),
+        arrival=flight_plan.get('arrival'),
+        alternate=flight_plan.get('alternate'),
+        cruise_tas=flight_plan.get('cruise_tas'),
+        planned_altitude=flight_plan.get('altitude'),
+        deptime=flight_plan.get('deptime'),
+        enroute_time=flight_plan.get('enroute_time'),
+        route=flight_plan.get('route'),
+        revision_id=flight_plan.get('revision_id'),
+    )
+
+
+def ivao_pilot(raw):
+    '''Normalises a pilot from the IVAO whazzup document into a Pilot record.'''
+    last_track = raw.get('lastTrack') if isinstance(raw.get('lastTrack'), dict) else {}
+    flight_plan = raw.get('flightPlan') if isinstance(raw.get('flightPlan'), dict) else {}
+    level = flight_plan.get('level')
+    speed = flight_plan.get('speed')
+    return Pilot(
+        'ivao',
+        raw.get('userId'),
+        callsign=raw.get('callsign') or '',
+        latitude=last_track.get('latitude'),
+        longitude=last_track.get('longitude'),
+        altitude=last_track.get('altitude'),
+        groundspeed=last_track.get('groundSpeed'),
+        heading=last_track.get('heading'),
+        has_flight_plan=bool(flight_plan),
+        aircraft_short=flight_plan.get('aircraftId'),
+        departure=flight_plan.get('departureId'),
+        arrival=flight_plan.get('arrivalId'),
+        cruise_tas=speed_to_knots(speed) if speed else None,
+        planned_altitude=flight_level_to_feet(level) if level else None,
+        route=flight_plan.get('route'),
+    )
+
+
+class CircuitOpen(Exception):
+    '''Raised instead of calling an upstream whose circuit is open.'''
+
+
+class CircuitBreaker:
+    '''
+    Stops calling an upstream after repeated failures or timeouts.
+
+    Once open, a single trial call is let through every reset_seconds, and the first
+    success closes the circuit again.
+    '''
+
+    def __init__(self, name, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_seconds=CIRCUIT_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        return 'half-open' if time.time() - self.opened_at >= self.reset_seconds else 'open'
+
+    def allow(self):
+        '''Returns True if a call may go upstream now.'''
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.time() - self.opened_at >= self.reset_seconds:
+                # Let this call through as the trial, the next one waits for another period
+                self.opened_at = time.time()
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            if self.opened_at is not None:
+                print(f"{self.name} is reachable again, closing its circuit.")
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    print(f"{self.name} failed {self.failures} times in a row, opening its circuit for {self.reset_seconds} seconds.")
+                self.opened_at = time.time()
+
+    def call(self, function, *args, **kwargs):
+        '''Calls function through the breaker, raising CircuitOpen without calling it while the circuit is open.'''
+        if not self.allow():
+            raise CircuitOpen(f"{self.name} circuit is open")
+        try:
+            result = function(*args, **kwargs)
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+
+class PrefixedStream:
+    '''Read-only file-like object that replays bytes already read from a stream before the rest of it.'''
+
+    def __init__(self, prefix, stream):
+        self.prefix = prefix
+        self.stream = stream
+
+    def read(self, size=-1):
+        if not self.prefix:
+            return self.stream.read(size)
+        if size is None or size < 0:
+            chunk, self.prefix = self.prefix + self.stream.read(), b''
+        else:
+            chunk, self.prefix = self.prefix[:size], self.prefix[size:]
+        return chunk
+
+
+def parse_vatsim_feed(stream, skip_update_timestamp=None):
+    '''
+    Parses the VATSIM data feed incrementally from a binary stream into its general block and a list of Pilot records.
+
+    Returns None without reading the pilots when the feed's update_timestamp equals skip_update_timestamp.
+    The feed's controllers, atis and other arrays are skipped. Controllers are read from the
+    ATC online API by fetch_vatsim_controllers, which carries the fields the map needs, so
+    building them here too would only cost time. Streaming keeps peak memory to one pilot
+    at a time and overlaps parsing with the download. Without ijson's C backend the body
+    is read whole and parsed with json.loads instead, see measure_feed_parse.
+    '''
+    if not STREAM_VATSIM_FEED:
+        feed = json.loads(stream.read())
+        general = feed.get('general') or {}
+        update_timestamp = general.get('update_timestamp')
+        if update_timestamp is not None and update_timestamp == skip_update_timestamp:
+            return None
+        return general, [vatsim_pilot(pilot) for pilot in feed.get('pilots') or []]
+
+    head = stream.read(FEED_HEAD_BYTES)
+    try:
+        general = next(ijson.items(io.BytesIO(head), 'general'), None) or {}
+    except ijson.JSONError:
+        # general did not fit in the head, the pilots are still usable without it
+        general = {}
+    update_timestamp = general.get('update_timestamp')
+    if update_timestamp is not None and update_timestamp == skip_update_timestamp:
+        return None
+
+    # Pilots are built one at a time and normalised straight away, the raw feed is never held in memory
+    pilots = [vatsim_pilot(pilot) for pilot in ijson.items(PrefixedStream(head, stream), 'pilots.item', use_float=True)]
+    return general, pilots
+
+
+class NetworkProvider:
+    '''
+    Downloads one network's feed and keeps its pilots as a shared FeedSnapshot of Pilot records.
+
+    Every view reads the network through snapshot(), so each feed is fetched once per
+    update no matter how many views use it. Views are always answered from the last good
+    snapshot, refreshing happens in the background behind a circuit breaker.
+    Subclasses implement download and pilot_json.
+    '''
+    name = None
+    update_interval = 15
+
+    def __init__(self):
+        self.state = {
+            'snapshot': None,
+            'history': OrderedDict(),
+            'version': 0,
+            'update_timestamp': None,
+            'last_checked': 0,
+            'fetched_at': None,  # Last time upstream answered, with a new feed or an unchanged one
+            'last_error': None,
+            'parse_ms': None,
+            'update_interval': self.update_interval,
+        }
+        # Only one thread at a time may talk to the upstream feed
+        self.lock = threading.Lock()
+        self.breaker = CircuitBreaker(f'{self.name} feed')
+        self.refresh_thread = None
+
+    def download(self):
+        '''Returns (update_timestamp, metadata, pilots) for a new feed, or None if it has not changed since the last one.'''
+        raise NotImplementedError
+
+    def pilot_json(self, pilot):
+        '''Returns a Pilot record in the JSON shape this network's endpoint has always served.'''
+        raise NotImplementedError
+
+    def refresh(self):
+        '''Downloads the feed and stores a new snapshot if it changed. Returns True when a new snapshot was stored.'''
+        with self.lock:
+            self.state['last_checked'] = time.time()
+            refresh_start = time.perf_counter()
+            feed = self.breaker.call(self.download)
+            self.state['fetched_at'] = time.time()
+            self.state['last_error'] = None
+            if feed is None:
+                return False
+            update_timestamp, metadata, pilots = feed
+            # Includes waiting on the socket, streaming parsers overlap it with the download
+            self.state['parse_ms'] = round((time.perf_counter() - refresh_start) * 1000, 1)
+
+            self.state['version'] = feed_version(update_timestamp, self.state['version'])
+            # Versions are the feed's publish time, so ETAs are counted from when the positions were reported
+            fleet_progress(pilots, get_airport_positions(), self.state['version'])
+            remember_snapshot(self.state, FeedSnapshot(self.state['version'], pilots, metadata))
+            self.state['update_timestamp'] = update_timestamp
+        publish_update(self.name)
+        return True
+
+    def try_refresh(self):
+        '''Refreshes the feed, logging failures instead of raising them. Returns True when a new snapshot was stored.'''
+        try:
+            return self.refresh()
+        except CircuitOpen:
+            return False
+        except Exception as e:
+            self.state['last_error'] = str(e)
+            print(f"Error refreshing {self.name} feed: {e}")
+            return False
+
+    def refresh_in_background(self):
+        '''Starts a refresh on its own thread unless one is already running, returns that thread.'''
+        with self.breaker.lock:
+            if self.refresh_thread is None or not self.refresh_thread.is_alive():
+                self.refresh_thread = threading.Thread(target=self.try_refresh, daemon=True)
+                self.refresh_thread.start()
+            return self.refresh_thread
+
+    def snapshot(self):
+        '''
+        Returns the last good FeedSnapshot without waiting on upstream.
+
+        A stale snapshot is still returned while a background refresh runs, only the very
+        first request of a process waits, for at most FIRST_FETCH_WAIT_SECONDS.
+        '''
+        if self.state['snapshot'] is None:
+            self.refresh_in_background().join(FIRST_FETCH_WAIT_SECONDS)
+        elif (time.time() - self.state['last_checked']) > 2 * self.state['update_interval']:
+            # The scheduler refreshes every update_interval, it has stalled if we get here
+            self.refresh_in_background()
+        return self.state['snapshot']
+
+    def status(self):
+        '''Returns how fresh the current snapshot is and the state of the upstream circuit.'''
+        fetched_at = self.state['fetched_at']
+        age = time.time() - fetched_at if fetched_at is not None else None
+        return {
+            'version': self.state['version'],
+            'age': round(age, 1) if age is not None else None,
+            'stale': age is None or age > 2 * self.state['update_interval'],
+            'circuit': self.breaker.state,
+            'last_error': self.state['last_error'],
+        }
+
+    def status_headers(self):
+        '''Returns the staleness metadata as response headers.'''
+        status = self.status()
+        return {
+            'X-Data-Age': '' if status['age'] is None else str(status['age']),
+            'X-Data-Stale': 'true' if status['stale'] else 'false',
+            'X-Upstream-Circuit': status['circuit'],
+        }
+
+    def payload_json(self, payload):
+        '''Returns a delta_payload with its Pilot records converted to this network's JSON shape.'''
+        pilots = [self.pilot_json(pilot) for pilot in payload['pilots']]
+        for pilot, cluster_count in zip(pilots, payload.get('cluster_counts', ())):
+            pilot['cluster_count'] = cluster_count
+        return {**{key: value for key, value in payload.items() if key != 'cluster_counts'}, 'pilots': pilots}
+
+
+class VatsimProvider(NetworkProvider):
+    '''VATSIM data feed, downloaded with conditional GETs and parsed while it streams in.'''
+    name = 'vatsim'
+    update_interval = 15  # VATSIM publishes a new feed every 15 seconds
+
+    def __init__(self):
+        super().__init__()
+        self.state['etag'] = None
+        self.state['last_modified'] = None
+
+    def download(self):
+        request_headers = dict(headers)
+        # Conditional GET so unchanged feeds cost a 304 instead of a multi-megabyte download
+        if self.state['etag']:
+            request_headers['If-None-Match'] = self.state['etag']
+        if self.state['last_modified']:
+            request_headers['If-Modified-Since'] = self.state['last_modified']
+
+        # Streamed so the feed is parsed while it downloads instead of being buffered whole first
+        with requests.get(VATSIM_DATA_URL, headers=request_headers, timeout=10, stream=True) as response:
+            if response.status_code == 304:
+                return None
+            response.raise_for_status()
+
+            self.state['etag'] = response.headers.get('ETag')
+            self.state['last_modified'] = response.headers.get('Last-Modified')
+
+            response.raw.decode_content = True
+            # The CDN sometimes serves the same feed with new validators, skip it if VATSIM has not published a new one
+            feed = parse_vatsim_feed(response.raw, skip_update_timestamp=self.state['update_timestamp'])
+            if feed is None:
+                return None
+
+        general, pilots = feed
+        return general.get('update_timestamp'), {'general': general}, pilots
+
+    def pilot_json(self, pilot):
+        flight_plan = None
+        if pilot.has_flight_plan:
+            flight_plan = {
+                'aircraft_short': pilot.aircraft_short,
+                'departure': pilot.departure,
+                'arrival': pilot.arrival,
+                'alternate': pilot.alternate,
+                'cruise_tas': pilot.cruise_tas,
+                'altitude': pilot.planned_altitude,
+                'deptime': pilot.deptime,
+                'enroute_time': pilot.enroute_time,
+                'route': pilot.route,
+                'revision_id': pilot.revision_id,
+            }
+        return {
+            'cid': pilot.id,
+            'name': pilot.name,
+            'callsign': pilot.callsign,
+            'latitude': pilot.latitude,
+            'longitude': pilot.longitude,
+            'altitude': pilot.altitude,
+            'groundspeed': pilot.groundspeed,
+            'transponder': pilot.transponder,
+            'heading': pilot.heading,
+            'flight_plan': flight_plan,
+            'progress': pilot.progress,
+        }
+
+
+class IvaoProvider(NetworkProvider):
+    '''IVAO whazzup document, one download feeds the map, routes and airport boards.'''
+    name = 'ivao'
+    update_interval = 15
+
+    def download(self):
+        response = requests.get(IVAO_WHAZZUP_URL, headers=headers, timeout=10)
+        response.raise_for_status()
+        data = response.json()
+
+        update_timestamp = data.get('updatedAt')
+        if update_timestamp is not None and update_timestamp == self.state['update_timestamp']:
+            return None
+        pilots = [ivao_pilot(pilot) for pilot in (data.get('clients') or {}).get('pilots') or [] if pilot]
+        return update_timestamp, {'updatedAt': update_timestamp}, pilots
+
+    def pilot_json(self, pilot):
+        return {
+            'userId': pilot.id,
+            'callsign': pilot.callsign,
+            'latitude': pilot.latitude,
+            'longitude': pilot.longitude,
+            'heading': pilot.heading,
+            'altitude': pilot.altitude,
+            'speed': pilot.groundspeed,
+            'departure': pilot.departure,
+            'route': pilot.route,
+            'arrival': pilot.arrival,
+            'progress': pilot.progress,
+        }
+
+
+# One provider per network, shared by every view in the process
+vatsim_provider = VatsimProvider()
+ivao_provider = IvaoProvider()
+network_providers = {
+    provider.name: provider for provider in (vatsim_provider, ivao_provider)
+}
+
+
+def get_vatsim_snapshot():
+    '''Returns the current VATSIM FeedSnapshot.'''
+    return vatsim_provider.snapshot()
+
+
+def get_ivao_snapshot():
+    '''Returns the current IVAO FeedSnapshot.'''
+    return ivao_provider.snapshot()
+
+
+def refresh_network_snapshots():
+    '''Refreshes every network provider, one failing network does not hold back the others.'''
+    for provider in network_providers.values():
+        provider.try_refresh()
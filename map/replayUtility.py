@@ -0,0 +1,203 @@
+import json
+import math
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+
+from map.networkUtility import AVIATIONWEATHER_URL, IVAO_WHAZZUP_URL, VATSIM_API_URL, VATSIM_DATA_URL, headers
+
+# Recorded upstream responses and the index describing them live here by default
+FIXTURES_DIR = os.path.join(settings.BASE_DIR, 'fixtures', 'feeds')
+FIXTURE_INDEX = 'index.json'
+
+# Feeds whose pilots the replay server moves along their heading between ticks
+VATSIM_FEED_PATH = '/v3/vatsim-data.json'
+IVAO_FEED_PATH = '/v2/tracker/whazzup'
+# Seconds between feed updates on the replay server, the real feeds update about every 15 seconds
+REPLAY_TICK_SECONDS = 15
+
+
+
+def upstream_urls():
+    '''Returns the upstream URLs worth recording, all relative to the configured base URLs.'''
+    return [
+        VATSIM_DATA_URL,
+        IVAO_WHAZZUP_URL,
+        f'{VATSIM_API_URL}/v2/atc/online',
+        f'{VATSIM_API_URL}/v2/members/online',
+        f'{AVIATIONWEATHER_URL}/data/cache/metars.cache.csv.gz',
+        f'{AVIATIONWEATHER_URL}/data/cache/tafs.cache.csv.gz',
+    ]
+
+
+def fixture_name(path):
+    '''Returns the file name a response for path is recorded under.'''
+    return path.strip('/').replace('/', '_') or 'root'
+
+
+def record_fixtures(fixtures_dir=FIXTURES_DIR, flightplans=20):
+    '''
+    Downloads the upstream feeds once and stores them as replay fixtures.
+
+    Also records the member flight plans of the first flightplans pilots in the VATSIM feed.
+    Responses are keyed by URL path, so every upstream can be replayed from one server.
+    Returns the index of recorded paths.
+    '''
+    os.makedirs(fixtures_dir, exist_ok=True)
+    urls = upstream_urls()
+    index = {}
+
+    def record(url):
+        path = urlsplit(url).path
+        try:
+            response = requests.get(url, headers=headers, timeout=30)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            print(f"Skipping {url}: {e}")
+            return None
+        name = fixture_name(path)
+        with open(os.path.join(fixtures_dir, name), 'wb') as fixture:
+            fixture.write(response.content)
+        index[path] = {
+            'file': name,
+            'content_type': response.headers.get('Content-Type', 'application/octet-stream'),
+            'recorded_at': time.time(),
+        }
+        print(f"Recorded {url} ({len(response.content)} bytes)")
+        return response
+
+    for url in urls:
+        response = record(url)
+        if url == VATSIM_DATA_URL and response is not None:
+            # Flight plans are per member, so only a sample of the pilots in the feed is kept
+            for pilot in response.json().get('pilots', [])[:flightplans]:
+                record(f"{VATSIM_API_URL}/v2/members/{pilot['cid']}/flightplans")
+
+    with open(os.path.join(fixtures_dir, FIXTURE_INDEX), 'w') as index_file:
+        json.dump(index, index_file, indent=2)
+    return index
+
+
+def advance_position(latitude, longitude, heading, groundspeed, seconds):
+    '''Returns the position reached after flying seconds at groundspeed knots on heading, by dead reckoning.'''
+    distance_nm = (groundspeed or 0) * seconds / 3600
+    track = math.radians(heading or 0)
+    latitude = latitude + distance_nm * math.cos(track) / 60
+    latitude = max(-89.9, min(89.9, latitude))
+    longitude = longitude + distance_nm * math.sin(track) / (60 * max(math.cos(math.radians(latitude)), 0.01))
+    longitude = (longitude + 180) % 360 - 180
+    return round(latitude, 5), round(longitude, 5)
+
+
+class ReplayFeeds:
+    '''
+    The recorded fixtures, with the network feeds re-rendered every tick so pilots keep moving.
+
+    Ticks are counted from the moment the server started, every request within one tick
+    gets the same body and ETag, the same way the real feeds behave between updates.
+    '''
+
+    def __init__(self, fixtures_dir=FIXTURES_DIR, tick_seconds=REPLAY_TICK_SECONDS):
+        with open(os.path.join(fixtures_dir, FIXTURE_INDEX)) as index_file:
+            self.index = json.load(index_file)
+        self.bodies = {}
+        for path, fixture in self.index.items():
+            with open(os.path.join(fixtures_dir, fixture['file']), 'rb') as body:
+                self.bodies[path] = body.read()
+        self.feeds = {path: json.loads(self.bodies[path]) for path in (VATSIM_FEED_PATH, IVAO_FEED_PATH) if path in self.bodies}
+        self.tick_seconds = tick_seconds
+        self.started = time.time()
+        self.rendered = {}  # path -> (tick, body)
+        self.lock = threading.Lock()
+
+    def tick(self):
+        return int((time.time() - self.started) // self.tick_seconds)
+
+    def render(self, path, tick):
+        '''Returns the feed at path as it looks tick updates after the recording.'''
+        feed = json.loads(json.dumps(self.feeds[path]))
+        seconds = tick * self.tick_seconds
+        updated = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(self.started + seconds))
+        if path == VATSIM_FEED_PATH:
+            general = feed.setdefault('general', {})
+            general['update_timestamp'] = f'{updated}.0000000Z'
+            general['update'] = updated.replace('-', '').replace('T', '').replace(':', '')
+            for pilot in feed.get('pilots', []):
+                if isinstance(pilot, dict) and pilot.get('latitude') is not None and pilot.get('longitude') is not None:
+                    pilot['latitude'], pilot['longitude'] = advance_position(
+                        pilot['latitude'], pilot['longitude'], pilot.get('heading'), pilot.get('groundspeed'), seconds)
+        else:
+            feed['updatedAt'] = f'{updated}.000Z'
+            for pilot in feed.get('clients', {}).get('pilots', []):
+                # Recorded feeds hold pilots without a track yet, they stay where they are
+                track = pilot.get('lastTrack') if isinstance(pilot, dict) else None
+                if isinstance(track, dict) and track.get('latitude') is not None and track.get('longitude') is not None:
+                    track['latitude'], track['longitude'] = advance_position(
+                        track['latitude'], track['longitude'], track.get('heading'), track.get('groundSpeed'), seconds)
+        return json.dumps(feed, separators=(',', ':')).encode('utf-8')
+
+    def response(self, path):
+        '''Returns (body, content type, etag) for path, or None if nothing was recorded for it.'''
+        if path not in self.index:
+            return None
+        if path not in self.feeds:
+            return self.bodies[path], self.index[path]['content_type'], None
+        tick = self.tick()
+        with self.lock:
+            rendered = self.rendered.get(path)
+            if rendered is None or rendered[0] != tick:
+                rendered = self.rendered[path] = (tick, self.render(path, tick))
+        return rendered[1], 'application/json', f'"{fixture_name(path)}-{tick}"'
+
+
+def replay_handler(feeds, latency_ms=0, jitter_ms=0, error_rate=0.0, seed=None):
+    '''Returns a request handler class serving feeds with the given latency, jitter and share of failed requests.'''
+    rng = random.Random(seed)
+    rng_lock = threading.Lock()
+
+    class ReplayHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            with rng_lock:
+                delay = max(0, latency_ms + rng.uniform(-jitter_ms, jitter_ms)) / 1000
+                fail = rng.random() < error_rate
+            time.sleep(delay)
+            if fail:
+                return self.reply(503, b'Injected failure', 'text/plain')
+
+            found = feeds.response(urlsplit(self.path).path)
+            if found is None:
+                return self.reply(404, b'Not recorded', 'text/plain')
+            body, content_type, etag = found
+            if etag is not None and etag in self.headers.get('If-None-Match', ''):
+                return self.reply(304, b'', content_type, etag)
+            self.reply(200, body, content_type, etag)
+
+        def reply(self, status, body, content_type, etag=None):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            if etag is not None:
+                self.send_header('ETag', etag)
+            self.end_headers()
+            if status != 304:
+                self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # One line per request would drown out the benchmark output
+            pass
+
+    return ReplayHandler
+
+
+def replay_server(port=8765, fixtures_dir=FIXTURES_DIR, tick_seconds=REPLAY_TICK_SECONDS, **options):
+    '''Returns a threaded HTTP server replaying the recorded fixtures on localhost, call serve_forever on it.'''
+    feeds = ReplayFeeds(fixtures_dir, tick_seconds)
+    return ThreadingHTTPServer(('127.0.0.1', port), replay_handler(feeds, **options))
@@ -1,14 +1,45 @@
-import csv
-import math
+import re
+import threading
+from collections import OrderedDict, namedtuple
 
 from django.http import JsonResponse
-from map.ivaoUtility import fetch_ivao_map_data
+from map.airportUtility import get_airport_positions
 from map.mathUtility import haversine
-import os
-from django.conf import settings
-import concurrent.futures
-from map.models import Airport, Waypoint
-from map.vatsimUtility import fetch_flightplan_from_vatsim, find_pilot_by_cid
+from map.models import VATSIMFlight, Waypoint
+from map.geometryUtility import display_path
+from map.networkUtility import get_ivao_snapshot, get_vatsim_snapshot
+from map.waypointUtility import expand_airways, get_waypoint_index, nearest_chain
+from map.wireUtility import encode_json, prepared_response
+
+# Resolved routes kept, keyed by departure, arrival and normalized route
+ROUTE_CACHE_SIZE = 4096
+# Fixes further than this many kilometers from the previous one are left out of drawn routes
+ROUTE_FIX_MAX_KM = 1000
+# Network IDs one batch route request may ask for
+ROUTE_BATCH_LIMIT = 50
+route_cache = OrderedDict()
+route_cache_lock = threading.Lock()
+route_cache_stats = {'hits': 0, 'misses': 0}
+# Drawn route paths are kept per resolved route and zoom level, deeper zooms share the last level
+ROUTE_PATH_MAX_ZOOM = 12
+ROUTE_PATH_DEFAULT_ZOOM = 5
+route_path_cache = OrderedDict()
+
+# One meaningful token of an ICAO flight plan route (item 15).
+# kind is 'fix', 'airway', 'coordinate' or 'procedure', position is set for coordinates only.
+RouteToken = namedtuple('RouteToken', ['kind', 'text', 'position'])
+
+# Tokens that carry no position
+ROUTE_KEYWORDS = {'DCT', 'IFR', 'VFR', 'SID', 'STAR', 'T', 'OAT', 'GAT', 'IFPSTOP', 'IFPSTART'}
+# Speed and level groups, N0450F350, M082F350, K0830S1130, N0450VFR or a bare speed
+SPEED_LEVEL_RE = re.compile(r'^(?:[NK]\d{4}|M\d{3})(?:[FASM]\d{3,4}|VFR)?$')
+# ICAO coordinates in whole degrees or degrees and minutes, 46N078W or 4620N07805W
+COORDINATE_RE = re.compile(r'^(\d{2})(\d{2})?([NS])(\d{3})(\d{2})?([EW])$')
+# ARINC 424 half-degree-free short forms, 5020N is 50N 020W and 50N20 is 50N 120W
+ARINC_COORDINATE_RE = re.compile(r'^(\d{2})(\d{2})([NESW])$|^(\d{2})([NESW])(\d{2})$')
+ARINC_HEMISPHERES = {'N': (1, -1), 'E': (1, 1), 'S': (-1, 1), 'W': (-1, -1)}
+# SID and STAR names are the fix they start or end at followed by a number and an optional letter, WYNDE3 or BOSOX4A
+PROCEDURE_RE = re.compile(r'^([A-Z]{2,5})\d[A-Z]?$')
 
 def waypoint_coordinates(request, name):
     '''Returns the latitude and longitude of a waypoint with the given name.'''
@@ -27,218 +58,333 @@ def waypoint_coordinates(request, name):
         # Handle the case where conversion to float fails
         return JsonResponse({'error': 'Invalid latitude or longitude'}, status=400)
 
-    filepath = os.path.join(settings.STATIC_ROOT, 'data', 'waypoint_data.csv')
-    closest_distance = None
-    closest_waypoint = None
-
-    with open(filepath, newline='') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            if row['name'] == name:
-                waypoint_lat = float(row['latitude'])
-                waypoint_lon = float(row['longitude'])
-                distance = math.sqrt((lat - waypoint_lat) ** 2 + (lon - waypoint_lon) ** 2)
-
-                if closest_distance is None or distance < closest_distance:
-                    closest_distance = distance
-                    closest_waypoint = row
-
-    if closest_waypoint:
-        return JsonResponse({
-            'name': closest_waypoint['name'],
-            'latitude': float(closest_waypoint['latitude']),
-            'longitude': float(closest_waypoint['longitude'])
-        })
+    # Of the waypoints sharing the name, the one closest to the given position
+    index = get_waypoint_index()
+    closest_waypoint = index.nearest(name, lat, lon)
+
+    if closest_waypoint is not None:
+        return JsonResponse(index.point(closest_waypoint))
     else:
         return JsonResponse({'error': 'Waypoint not found'}, status=404)
     
 
-def should_skip_waypoint(current, next_waypoint, previous=None, threshold=10):
-    """
-    Determines if a waypoint should be skipped based on its distance
-    from the previous and next waypoints.
-    
-    Args:
-        current: The current waypoint (latitude, longitude).
-        next_waypoint: The next waypoint (latitude, longitude).
-        previous: The previous waypoint (latitude, longitude), if any.
-        threshold: The distance threshold for skipping waypoints.
-    
-    Returns:
-        A boolean indicating whether the waypoint should be skipped.
-    """
-    # Calculate distance to next waypoint
-    distance_to_next = haversine(current[0], current[1], next_waypoint[0], next_waypoint[1])
-    
-    # If there's no previous waypoint, only consider the distance to the next waypoint
-    if not previous:
-        return distance_to_next > threshold
-    
-    # Calculate distance from previous waypoint
-    distance_from_previous = haversine(previous[0], previous[1], current[0], current[1])
-    
-    # Check if the waypoint is far from both the previous and next waypoints
-    return distance_to_next > threshold and distance_from_previous > threshold
-
-def extract_waypoints_from_route(route):
-    """Extracts waypoint identifiers from a flight plan route string."""
-    return route.split() 
-
+def parse_route_coordinate(text):
+    '''Returns the (latitude, longitude) of an ICAO or ARINC 424 coordinate token, or None if text is not one.'''
+    match = COORDINATE_RE.match(text)
+    if match:
+        lat_deg, lat_min, lat_hem, lon_deg, lon_min, lon_hem = match.groups()
+        latitude = int(lat_deg) + int(lat_min or 0) / 60
+        longitude = int(lon_deg) + int(lon_min or 0) / 60
+        if latitude > 90 or longitude > 180:
+            return None
+        return (-latitude if lat_hem == 'S' else latitude, -longitude if lon_hem == 'W' else longitude)
+    match = ARINC_COORDINATE_RE.match(text)
+    if match:
+        if match.group(1):
+            latitude, longitude, hemisphere = int(match.group(1)), int(match.group(2)), match.group(3)
+        else:
+            # The letter in the middle marks longitudes of 100 and more
+            latitude, hemisphere, longitude = int(match.group(4)), match.group(5), 100 + int(match.group(6))
+        lat_sign, lon_sign = ARINC_HEMISPHERES[hemisphere]
+        if latitude > 90 or longitude > 180:
+            return None
+        return (lat_sign * latitude, lon_sign * longitude)
+    return None
+
+
+def tokenize_route(route):
+    '''
+    Splits an ICAO flight plan route into the tokens that say where the flight goes.
+
+    DCT, flight rule changes and speed/level groups are dropped, a fix with a speed/level
+    change (FIX/N0450F350) or a cruise climb (C/FIX/...) keeps only the fix. SID and STAR names become procedures
+    when they are the first or last token and the waypoint data does not know them as a fix.
+    '''
+    index = get_waypoint_index()
+    words = []
+    for word in (route or '').upper().split():
+        parts = word.split('/')
+        # Cruise climbs (C/point/speed levels) name the point second
+        words.append(parts[1] if parts[0] == 'C' and len(parts) > 1 else parts[0])
+    words = [word for word in words if word and word not in ROUTE_KEYWORDS and not SPEED_LEVEL_RE.match(word)]
+
+    tokens = []
+    for position, word in enumerate(words):
+        coordinate = parse_route_coordinate(word)
+        if coordinate is not None:
+            tokens.append(RouteToken('coordinate', word, coordinate))
+        elif word in index.airways and 0 < position < len(words) - 1:
+            tokens.append(RouteToken('airway', word, None))
+        elif position in (0, len(words) - 1) and PROCEDURE_RE.match(word) and len(index.candidates(word)) == 0:
+            tokens.append(RouteToken('procedure', word, None))
+        elif word.isalnum():
+            tokens.append(RouteToken('fix', word, None))
+    return tokens
+
+
+def resolve_route_waypoints(tokens, start=None):
+    '''
+    Returns the fixes of a tokenized route in order as dicts with ident, latitude_deg and longitude_deg.
+
+    Airways are expanded into the fixes they pass, which take their positions from the
+    airway data, and coordinates are placed where they say. Every other fix may exist in
+    several places, its candidates come from the Waypoint table and the waypoint file, and
+    the one closest to the fix before it is used, starting from start (latitude, longitude).
+    A SID or STAR stands for the fix it is named after. Unknown identifiers are dropped.
+    '''
+    index = get_waypoint_index()
+    coordinates = {token.text: token.position for token in tokens if token.kind == 'coordinate'}
+    identifiers = []
+    for position, token in enumerate(tokens):
+        if token.kind == 'procedure':
+            fix = PROCEDURE_RE.match(token.text).group(1)
+            # The route usually names the fix right after the SID or right before the STAR as well
+            neighbour = tokens[position + 1] if position == 0 and len(tokens) > 1 else tokens[position - 1] if position > 0 else None
+            if neighbour is None or neighbour.text != fix:
+                identifiers.append(fix)
+        else:
+            identifiers.append(token.text)
+    expanded = expand_airways(identifiers)
+
+    db_candidates = {}
+    for ident, latitude, longitude in Waypoint.objects.filter(
+        ident__in={ident for ident, point in expanded if point is None and ident not in coordinates}
+    ).values_list('ident', 'latitude_deg', 'longitude_deg'):
+        db_candidates.setdefault(ident, []).append((latitude, longitude))
+
+    idents, latitudes, longitudes, counts = [], [], [], []
+    for ident, point in expanded:
+        if ident in coordinates and point is None:
+            idents.append(ident)
+            latitudes.append(coordinates[ident][0])
+            longitudes.append(coordinates[ident][1])
+            counts.append(1)
+            continue
+        points = [point] if point is not None else index.candidates(ident)
+        candidates = db_candidates.get(ident, []) if point is None else []
+        if len(points) == 0 and not candidates:
+            continue
+        idents.append(ident)
+        latitudes.extend(index.latitude[points])
+        longitudes.extend(index.longitude[points])
+        latitudes.extend(latitude for latitude, _ in candidates)
+        longitudes.extend(longitude for _, longitude in candidates)
+        counts.append(len(points) + len(candidates))
+
+    chosen = nearest_chain(latitudes, longitudes, counts, start)
+    return [{
+        'ident': ident,
+        'latitude_deg': float(latitudes[candidate]),
+        'longitude_deg': float(longitudes[candidate])
+    } for ident, candidate in zip(idents, chosen)]
+
+
+def route_key(departure, arrival, tokens):
+    '''Returns the cache key of a route, its airports and tokenized route plus the waypoint file version.'''
+    # The index version makes a reloaded waypoint file miss instead of serving old positions
+    return (departure, arrival, ' '.join(token.text for token in tokens), get_waypoint_index().version)
+
+
+def resolve_route(departure, arrival, tokens):
+    '''
+    Returns the waypoints drawn for a flight, the departure airport, the fixes of its route and the arrival airport.
+
+    tokens is the route as tokenize_route returns it. Fixes further than ROUTE_FIX_MAX_KM from
+    the previous waypoint are left out. Results are kept in an LRU keyed by departure, arrival
+    and the tokens, so pilots filing the same route share one resolution, with hits and misses
+    counted in route_cache_stats. The returned tuple is shared, callers must not change it.
+    '''
+    key = route_key(departure, arrival, tokens)
+    with route_cache_lock:
+        waypoints = route_cache.get(key)
+        if waypoints is not None:
+            route_cache.move_to_end(key)
+            route_cache_stats['hits'] += 1
+            return waypoints
+        route_cache_stats['misses'] += 1
+
+    airports = get_airport_positions()
+    departure_position = airports.get(departure)
+    arrival_position = airports.get(arrival)
+
+    waypoints = [{
+        'ident': departure,
+        'latitude_deg': departure_position[0],
+        'longitude_deg': departure_position[1]
+    }] if departure_position else []
+
+    for waypoint in resolve_route_waypoints(tokens, departure_position):
+        if waypoints:
+            prev_wp = waypoints[-1]
+            distance = haversine(prev_wp['longitude_deg'], prev_wp['latitude_deg'], waypoint['longitude_deg'], waypoint['latitude_deg'])
+            if distance > ROUTE_FIX_MAX_KM:
+                continue
+        waypoints.append(waypoint)
+
+    if arrival_position:
+        waypoints.append({
+            'ident': arrival,
+            'latitude_deg': arrival_position[0],
+            'longitude_deg': arrival_position[1]
+        })
 
-def match_waypoints_in_db(waypoints):
-    """Fetches waypoints from the database and returns them in the order they appear in the waypoints list."""
-    waypoints_queryset = Waypoint.objects.filter(ident__in=waypoints)
-    # Create a dictionary of waypoints for fast lookup
-    waypoint_dict = {wp.ident: wp for wp in waypoints_queryset}
-    # Reorder waypoints based on the input list order
-    ordered_waypoints = [waypoint_dict[ident] for ident in waypoints if ident in waypoint_dict]
-    return ordered_waypoints
+    waypoints = tuple(waypoints)
+    with route_cache_lock:
+        route_cache[key] = waypoints
+        while len(route_cache) > ROUTE_CACHE_SIZE:
+            route_cache.popitem(last=False)
+    return waypoints
+
+
+def route_path(departure, arrival, tokens, zoom):
+    '''
+    Returns the [longitude, latitude] points to draw a resolved route with at a map zoom level.
+
+    The waypoints are joined along great circles and simplified for the zoom by display_path.
+    Paths are cached per route and whole zoom level like resolve_route caches waypoints, the
+    returned list is shared and callers must not change it.
+    '''
+    zoom = min(max(int(zoom), 0), ROUTE_PATH_MAX_ZOOM)
+    key = (route_key(departure, arrival, tokens), zoom)
+    with route_cache_lock:
+        path = route_path_cache.get(key)
+        if path is not None:
+            route_path_cache.move_to_end(key)
+            return path
+
+    waypoints = resolve_route(departure, arrival, tokens)
+    path = display_path([wp['latitude_deg'] for wp in waypoints], [wp['longitude_deg'] for wp in waypoints], zoom)
+    with route_cache_lock:
+        route_path_cache[key] = path
+        while len(route_path_cache) > ROUTE_CACHE_SIZE:
+            route_path_cache.popitem(last=False)
+    return path
+
+
+def requested_zoom(request):
+    '''Reads the map zoom level a route is drawn at from the zoom parameter, ROUTE_PATH_DEFAULT_ZOOM without one.'''
+    try:
+        return float(request.GET.get('zoom', ROUTE_PATH_DEFAULT_ZOOM))
+    except ValueError:
+        return ROUTE_PATH_DEFAULT_ZOOM
 
 
 def waypoints_view(request):
-    '''Returns a JSON response with all waypoints.'''
-    waypoints = []
-    seen_names = set()  # Set to keep track of names already seen
-
-    with open(os.path.join(settings.STATIC_ROOT, 'data', 'waypoint_data.csv'), newline='') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            name = row['name']
-            if name not in seen_names:  # Check if name has not been added yet
-                waypoints.append({
-                    'name': name,
-                    'latitude': float(row['latitude']),
-                    'longitude': float(row['longitude'])
-                })
-                seen_names.add(name)  # Add name to the set of seen names
-
-    return JsonResponse({'waypoints': waypoints})
+    '''Returns a JSON response with all waypoints, the first one listed under each name.'''
+    index = get_waypoint_index()
+    return prepared_response(request, 'waypoints', index.version, lambda: encode_json({
+        'waypoints': [index.point(point) for point in index.first_points]
+    }))
+
+
+def waypoint_tile(request, z, x, y):
+    '''
+    Returns a JSON response with the waypoints inside Web Mercator tile z/x/y, thinned by zoom level.
+
+    Every tile is built the first time it is asked for and kept until the waypoint file changes.
+    '''
+    if z > 22 or x >= 2 ** z or y >= 2 ** z:
+        return JsonResponse({'error': 'Tile out of range'}, status=404)
+    index = get_waypoint_index()
+    return prepared_response(request, 'waypoint_tile', index.version, lambda: encode_json({
+        'waypoints': [index.point(point) for point in index.tile(z, x, y)]
+    }), query=f'{z}/{x}/{y}')
+
+
+
+
+def flight_plan_routes(network_ids):
+    '''
+    Returns {network_id: (network, departure, arrival, route)} for the pilots whose flight plan could be found.
+
+    Plans are read from the VATSIM and IVAO snapshots already in memory. Pilots missing from
+    both fall back to the plans the inbound flight harvest saved, upstream is never called
+    while a request waits. Pilots without either are left out and reported as missing.
+    '''
+    vatsim_snapshot = get_vatsim_snapshot()
+    ivao_snapshot = get_ivao_snapshot()
+    routes = {}
+    misses = []
+    for network_id in network_ids:
+        for network, snapshot in (('VATSIM', vatsim_snapshot), ('IVAO', ivao_snapshot)):
+            pilot = snapshot.find_pilot(network_id) if snapshot is not None else None
+            if pilot is not None and pilot.has_flight_plan:
+                routes[network_id] = (network, pilot.departure or '', pilot.arrival or '', pilot.route or '')
+                break
+        else:
+            misses.append(network_id)
+
+    if misses:
+        for network_id, departure, arrival, route in VATSIMFlight.objects.filter(vatsim_id__in=misses).values_list(
+            'vatsim_id', 'departure', 'arrival', 'route'
+        ):
+            routes[network_id] = ('VATSIM', departure, arrival, route)
+    return routes
+
+
+def route_geometry(network, departure, arrival, route, zoom=ROUTE_PATH_DEFAULT_ZOOM):
+    '''
+    Returns the resolved route of a flight plan as the dict the route endpoints send, or None if an airport is unknown.
+
+    waypoints are the fixes to mark and path the line to draw between them at the map zoom level.
+    '''
+    # Flight plans can name airports missing from our table
+    airports = get_airport_positions()
+    if (departure and departure not in airports) or (arrival and arrival not in airports):
+        return None
+    tokens = tokenize_route(route)
+    return {
+        'network': network,
+        'departure': departure,
+        'arrival': arrival,
+        'waypoints': list(resolve_route(departure, arrival, tokens)),
+        'path': route_path(departure, arrival, tokens, zoom),
+    }
 
 
+def route_cache_headers():
+    '''Returns the route cache hit and miss counts as response headers.'''
+    return {
+        'X-Route-Cache-Hits': str(route_cache_stats['hits']),
+        'X-Route-Cache-Misses': str(route_cache_stats['misses']),
+    }
 
 
 def construct_route(request, network_id):
     """Constructs a route from VATSIM or IVAO flight plan's waypoints, including departure and arrival airports."""
-    flight_plan = fetch_flightplan_from_vatsim(network_id)
-    network = 'VATSIM'
+    flight_plan = flight_plan_routes([network_id]).get(network_id)
     if flight_plan is None:
-        network = "IVAO"
-        pilots_data = fetch_ivao_map_data()
-        # Access the specific pilot's data using the network_id as a key
-        pilot_data = pilots_data.get(int(network_id))  # Ensure network_id is in the correct format (str or int)
-        if pilot_data:
-            # Directly use the pilot_data dictionary if found
-            user_flight_plan = pilot_data
-        else:
-            # Handle the case where the pilot's data is not found
-            return JsonResponse({'error': 'Pilot data not found for the given network ID'}, status=404)
-    else:
-        dep_ident = flight_plan.get('dep', '')
-        arr_ident = flight_plan.get('arr', '')
-        route = flight_plan.get('route', '')
-
-    if network == 'VATSIM':
-        # If VATSIM, data is already set
-        pass
-    else:  # IVAO
-        dep_ident = user_flight_plan.get('departure')
-        arr_ident = user_flight_plan.get('arrival')
-        route = user_flight_plan.get('route')
-
-    response_data = {
-        'network': network,
-        'departure': dep_ident,
-        'arrival': arr_ident,
-        'route': route,
-        # include any other details you need
-    }
+        return JsonResponse({'error': 'Pilot data not found for the given network ID'}, status=404)
 
-    try:
-        departure_airport = Airport.objects.get(ident=dep_ident) if dep_ident else None
-        arrival_airport = Airport.objects.get(ident=arr_ident) if arr_ident else None
-    except Airport.DoesNotExist:
+    geometry = route_geometry(*flight_plan, zoom=requested_zoom(request))
+    if geometry is None:
         return JsonResponse({'error': 'Airport not found'}, status=404)
+    return JsonResponse({'waypoints': geometry['waypoints'], 'path': geometry['path']}, headers=route_cache_headers())
 
-    waypoint_identifiers = extract_waypoints_from_route(route)
-    ordered_waypoints = match_waypoints_in_db(waypoint_identifiers)
-
-    distance_threshold = 1000
-
-    waypoints_data = [{
-        'ident': departure_airport.ident,
-        'latitude_deg': departure_airport.latitude_deg,
-        'longitude_deg': departure_airport.longitude_deg
-    }] if departure_airport else []
-
-    for waypoint in ordered_waypoints:
-        prev_wp = waypoints_data[-1] if waypoints_data else {'latitude_deg': departure_airport.latitude_deg, 'longitude_deg': departure_airport.longitude_deg}
-        distance = haversine(prev_wp['latitude_deg'], prev_wp['longitude_deg'], waypoint.latitude_deg, waypoint.longitude_deg)
-
-        if distance <= distance_threshold:
-            waypoints_data.append({
-                'ident': waypoint.ident,
-                'latitude_deg': waypoint.latitude_deg,
-                'longitude_deg': waypoint.longitude_deg
-            })
-
-    if arrival_airport:  # Check if arrival airport info is available
-        waypoints_data.append({
-            'ident': arrival_airport.ident,
-            'latitude_deg': arrival_airport.latitude_deg,
-            'longitude_deg': arrival_airport.longitude_deg
-        })
-
-    return JsonResponse({'waypoints': waypoints_data})
-
-
-
-
-def get_remaining_distance(request, cid, vatsim_data):
-    '''Calculates the remaining distance for a pilot's flight based on their current position and flight plan.'''
-    if vatsim_data is None:
-        return JsonResponse({"error": "Could not fetch VATSIM data"}, status=500)
-
-    pilot_data = find_pilot_by_cid(cid, vatsim_data)
-    if pilot_data is None:
-        return JsonResponse({"error": "Pilot not found"}, status=404)
 
-    flight_plan = pilot_data.get('flight_plan', {})
-    route = flight_plan.get('route', '')
-    current_latitude = float(pilot_data.get('latitude', 0))
-    current_longitude = float(pilot_data.get('longitude', 0))
+def construct_routes(request):
+    '''
+    Constructs the routes of many pilots at once, for a comma separated ids parameter of network IDs.
 
-    waypoints_data = extract_waypoints_from_route(route)
-    ordered_waypoints = match_waypoints_in_db(waypoints_data)
-    # Parallelize total distance calculation
-
-
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        future_to_distance = {
-            executor.submit(haversine, ordered_waypoints[i].longitude_deg, ordered_waypoints[i].latitude_deg, ordered_waypoints[i + 1].longitude_deg, ordered_waypoints[i + 1].latitude_deg): i
-            for i in range(len(ordered_waypoints) - 1)
-        }
-        total_distance = sum(future.result() for future in concurrent.futures.as_completed(future_to_distance))
-
-
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        future_to_distance_wp = {
-            executor.submit(haversine, current_longitude, current_latitude, wp.longitude_deg, wp.latitude_deg): wp
-            for wp in ordered_waypoints
-        }
-        nearest_wp, nearest_distance = min(
-            ((wp, future.result()) for future, wp in future_to_distance_wp.items()),
-            key=lambda x: x[1]
-        )
-
-    # Calculate remaining distance from nearest waypoint
-    remaining_distance = sum(
-        haversine(wp.longitude_deg, wp.latitude_deg, ordered_waypoints[j].longitude_deg, ordered_waypoints[j].latitude_deg)
-        for j, wp in enumerate(ordered_waypoints) if j >= ordered_waypoints.index(nearest_wp)
-    )
-    if ordered_waypoints.index(nearest_wp) > 0:
-        remaining_distance += nearest_distance
-
-    remaining_percentage = (remaining_distance / total_distance) * 100 if total_distance > 0 else 0
-
-    print("Finished calculating distance for ", cid)
-    return remaining_percentage
\ No newline at end of file
+    Returns the resolved routes by network ID, and the IDs without a flight plan or with
+    an unknown airport under missing. At most ROUTE_BATCH_LIMIT IDs are read per request,
+    zoom is the map zoom level the paths are simplified for.
+    '''
+    try:
+        network_ids = list(dict.fromkeys(int(network_id) for network_id in request.GET.get('ids', '').split(',') if network_id.strip()))
+    except ValueError:
+        return JsonResponse({'error': 'ids must be comma separated network IDs'}, status=400)
+    if len(network_ids) > ROUTE_BATCH_LIMIT:
+        return JsonResponse({'error': f'At most {ROUTE_BATCH_LIMIT} ids per request'}, status=400)
+
+    flight_plans = flight_plan_routes(network_ids)
+    zoom = requested_zoom(request)
+    routes = {}
+    missing = []
+    for network_id in network_ids:
+        geometry = route_geometry(*flight_plans[network_id], zoom=zoom) if network_id in flight_plans else None
+        if geometry is None:
+            missing.append(network_id)
+        else:
+            routes[network_id] = geometry
+    return JsonResponse({'routes': routes, 'missing': missing}, headers=route_cache_headers())
@@ -1,6 +1,6 @@
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.interval import IntervalTrigger
-from .task import vatsim_update, metar_update
+from .task import vatsim_update, network_feed_update, inbound_flights_update, metar_update
 def start_scheduler():
     scheduler = BackgroundScheduler()
     scheduler.add_job(
@@ -9,6 +9,18 @@ def start_scheduler():
         id='task_vatsim_id', 
         replace_existing=False, 
     )
+    scheduler.add_job(
+        network_feed_update,
+        trigger=IntervalTrigger(seconds=15),  # VATSIM and IVAO feed update cadence
+        id='task_network_feed_id',
+        replace_existing=False,
+    )
+    scheduler.add_job(
+        inbound_flights_update,
+        trigger=IntervalTrigger(seconds=300),  # 5 minutes
+        id='task_inbound_flights_id',
+        replace_existing=False,
+    )
     scheduler.add_job(
         metar_update,
         trigger=IntervalTrigger(seconds=1800),  # 30 minutes
@@ -0,0 +1,77 @@
+import asyncio
+import threading
+
+# Seconds between keepalive comments on an idle live stream, keeps proxies from closing it
+STREAM_KEEPALIVE_SECONDS = 20
+# Milliseconds the browser waits before reconnecting a dropped stream
+STREAM_RETRY_MS = 5000
+
+# Live stream clients connected to this process
+stream_subscribers = set()
+stream_subscribers_lock = threading.Lock()
+
+
+class StreamSubscriber:
+    '''
+    One connected live stream client and the topics that changed since it last sent them.
+
+    Updates are coalesced, a client that falls behind only sends the latest version of each topic.
+    '''
+
+    def __init__(self, topics):
+        self.loop = asyncio.get_running_loop()
+        self.topics = frozenset(topics)
+        # Every topic is sent once when the client connects
+        self.pending = set(self.topics)
+        self.event = asyncio.Event()
+        self.event.set()
+
+    def notify(self, topic):
+        '''Marks topic as changed, must run on the subscriber's event loop.'''
+        if topic in self.topics:
+            self.pending.add(topic)
+            self.event.set()
+
+    async def wait(self, timeout):
+        '''Waits until a topic changed, returns False if nothing did within timeout seconds.'''
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def take(self):
+        '''Returns the changed topics and clears them.'''
+        topics, self.pending = self.pending, set()
+        self.event.clear()
+        return topics
+
+
+def subscribe(topics):
+    '''Registers a live stream client for the given topics, must be called from its event loop.'''
+    subscriber = StreamSubscriber(topics)
+    with stream_subscribers_lock:
+        stream_subscribers.add(subscriber)
+    return subscriber
+
+
+def unsubscribe(subscriber):
+    with stream_subscribers_lock:
+        stream_subscribers.discard(subscriber)
+
+
+def publish_update(topic):
+    '''Tells every live stream client following topic that it changed. Safe to call from any thread.'''
+    with stream_subscribers_lock:
+        subscribers = list(stream_subscribers)
+    for subscriber in subscribers:
+        try:
+            subscriber.loop.call_soon_threadsafe(subscriber.notify, topic)
+        except RuntimeError:
+            # The client's event loop has already shut down
+            unsubscribe(subscriber)
+
+
+def stream_event(topic, version, body):
+    '''Formats a JSON body as one server-sent event.'''
+    return b'event: %s\nid: %d\ndata: %s\n\n' % (topic.encode('ascii'), version, body)
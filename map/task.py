@@ -1,6 +1,7 @@
 from celery import shared_task
-from .views import update_vatsim_controllers
+from map.vatsimUtility import fetch_vatsim_controllers, reconcile_vatsim_controllers, refresh_controller_divisions, run_inbound_flight_harvest
 from map.weatherUtility import fetch_metars
+from map.networkUtility import refresh_network_snapshots
 from datetime import datetime, timedelta
 
 
@@ -8,9 +9,27 @@ from datetime import datetime, timedelta
 @shared_task
 def vatsim_update():
     current_time = datetime.now()
-    update_vatsim_controllers(request=None)
+    stats = reconcile_vatsim_controllers()
+    # Resolve divisions for newly seen controllers once the sync has committed
+    looked_up = refresh_controller_divisions(controller['id'] for controller in fetch_vatsim_controllers())
+    if looked_up:
+        print(f"Resolved divisions for {looked_up} VATSIM controllers.")
     nextUpdateTime = current_time + timedelta(minutes=1)
-    print("Updated VATSIM data. Next update at: ", nextUpdateTime.strftime("%H:%M:%S"))
+    print(f"Updated VATSIM data: {stats['updated']} updated, {stats['created']} created in {stats['duration_ms']} ms. Next update at: ", nextUpdateTime.strftime("%H:%M:%S"))
+
+@shared_task
+def network_feed_update():
+    refresh_network_snapshots()
+
+@shared_task
+def inbound_flights_update():
+    try:
+        stats = run_inbound_flight_harvest()
+    except Exception as e:
+        print(f"Error harvesting inbound flight plans: {e}")
+        return
+    if stats:
+        print(f"Harvested flight plans: {stats['fetched']} fetched, {stats['skipped']} unchanged, {stats['failed']} failed in {stats['duration_ms']} ms.")
 
 @shared_task
 def metar_update():
@@ -1,3 +1,832 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import json
+import math
+import os
+import tempfile
+from collections import OrderedDict
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.db.models import F
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from map.airportUtility import AirportIndex, airport_table_state, visible_tier
+from map.feedUtility import FeedSnapshot, Pilot, Viewport, decimate_pilots, delta_payload, remember_snapshot
+from map.models import (
+    AIRPORT_TIER_MAJOR, AIRPORT_TIER_MEDIUM, AIRPORT_TIER_MINOR, Airport, Controller, ControllerDivision, DataVersion, Waypoint,
+)
+from map.networkUtility import CircuitBreaker, CircuitOpen, IvaoProvider, VatsimProvider
+from map.routeUtility import (
+    RouteToken, parse_route_coordinate, resolve_route, resolve_route_waypoints, route_cache, route_cache_stats, tokenize_route,
+)
+from map.streamUtility import publish_update, stream_subscribers
+from map.vatsimUtility import CONTROLLERS_VERSION, controllers_version, reconcile_vatsim_controllers, refresh_controller_divisions
+from map.views import live_events
+from map.waypointUtility import TILE_BUCKETS, TILE_FULL_ZOOM, WaypointIndex, expand_airways, get_waypoint_index, nearest_chain, waypoint_index_state
+from map.wireUtility import FLAG_DECIMATED, columnar_body, pack_positions, prepared_response
+
+
+def pilot(pilot_id, latitude, longitude, callsign):
+    return Pilot('vatsim', pilot_id, callsign=callsign, name=f'Pilot {pilot_id}', latitude=latitude, longitude=longitude, heading=90, altitude=35000, groundspeed=450)
+
+
+def string_table(body):
+    '''Returns the string table of a body in the binary position format.'''
+    # The string table closes the body, its length is the last header value
+    strings_length = int(np.frombuffer(body[:24], dtype='<u4')[5])
+    return json.loads(body[len(body) - strings_length:])
+
+
+def columns(body):
+    '''Returns the columns of a body in the binary position format by name, read the way vatsimWorker.js reads them.'''
+    _, _, flags, count, removed_count, _ = np.frombuffer(body[:24], dtype='<u4')
+    layout = [
+        ('ids', '<u4', count), ('altitude', '<i4', count), ('latitude', '<f4', count), ('longitude', '<f4', count),
+        ('removed', '<u4', removed_count), ('remaining_km', '<i4', count), ('eta', '<u4', count),
+        ('cluster_counts', '<u4', count if flags & FLAG_DECIMATED else 0),
+        ('heading', '<i2', count), ('groundspeed', '<i2', count), ('percent_complete', '<i2', count),
+    ]
+    decoded = {}
+    offset = 24
+    for name, dtype, length in layout:
+        decoded[name] = np.frombuffer(body, dtype=dtype, count=length, offset=offset)
+        offset += decoded[name].nbytes
+    return decoded
+
+
+class ColumnarProgressTests(SimpleTestCase):
+    def test_progress_round_trips(self):
+        flying = pilot(1, 5, 5, 'AAL1')
+        flying.progress = {'remaining_km': 1234, 'percent_complete': 56.7, 'eta': 1700000000}
+        parked = pilot(2, 5, 6, 'BAW2')
+        parked.progress = {'remaining_km': 5500, 'percent_complete': 0.0, 'eta': None}
+        unknown = pilot(3, 5, 7, 'DLH3')
+
+        body = pack_positions({'version': 1, 'full': True, 'pilots': [flying, parked, unknown]})
+        decoded = columns(body)
+        self.assertEqual(decoded['remaining_km'].tolist(), [1234, 5500, -1])
+        self.assertEqual(decoded['percent_complete'].tolist(), [567, 0, -1])
+        self.assertEqual(decoded['eta'].tolist(), [1700000000, 0, 0])
+        self.assertEqual(string_table(body), {'1': ['AAL1', 'Pilot 1'], '2': ['BAW2', 'Pilot 2'], '3': ['DLH3', 'Pilot 3']})
+
+
+class ColumnarViewportDeltaTests(SimpleTestCase):
+    viewport = Viewport(north=10, south=0, east=10, west=0, zoom=8)
+
+    def setUp(self):
+        self.state = {'history': OrderedDict(), 'snapshot': None}
+
+    def delta_body(self, pilots_before, pilots_after):
+        remember_snapshot(self.state, FeedSnapshot(1, pilots_before))
+        snapshot = FeedSnapshot(2, pilots_after)
+        remember_snapshot(self.state, snapshot)
+        payload = delta_payload(self.state, snapshot, 1, self.viewport)
+        return payload, columnar_body(self.state, payload, self.viewport)
+
+    def test_pilot_entering_viewport_gets_its_strings(self):
+        # Pilot 2 keeps its callsign while the view comes over it
+        payload, body = self.delta_body(
+            [pilot(1, 5, 5, 'AAL1'), pilot(2, 5, 20, 'BAW2')],
+            [pilot(1, 5, 5.1, 'AAL1'), pilot(2, 5, 9, 'BAW2')],
+        )
+        self.assertEqual(sorted(int(p.id) for p in payload['pilots']), [1, 2])
+        self.assertEqual(string_table(body), {'2': ['BAW2', 'Pilot 2']})
+
+    def test_pilot_leaving_viewport_keeps_its_strings(self):
+        payload, body = self.delta_body(
+            [pilot(1, 5, 5, 'AAL1'), pilot(2, 5, 9, 'BAW2'), pilot(3, 5, 8, 'DLH3')],
+            [pilot(1, 5, 5, 'AAL1'), pilot(2, 5, 20, 'BAW2')],
+        )
+        self.assertEqual(sorted(payload['removed']), [2, 3])
+        self.assertEqual(payload['offline'], [3])
+        # Only the pilot that went offline has its strings dropped
+        self.assertEqual(string_table(body), {'3': None})
+
+
+class ColumnarDecimatedTests(SimpleTestCase):
+    def test_cluster_counts_round_trip(self):
+        # Three pilots share a bucket at zoom 2, the fourth is alone
+        snapshot = FeedSnapshot(1, [pilot(1, 5, 5, 'AAL1'), pilot(2, 5.1, 5.1, 'BAW2'), pilot(3, 5.2, 5.2, 'DLH3'), pilot(4, -40, 100, 'QFA4')])
+        state = {'history': OrderedDict(), 'snapshot': None}
+        remember_snapshot(state, snapshot)
+        viewport = Viewport(north=60, south=-60, east=179, west=-179, zoom=2)
+        payload = delta_payload(state, snapshot, 0, viewport)
+        self.assertTrue(payload['decimated'])
+
+        decoded = columns(columnar_body(state, payload, viewport))
+        self.assertEqual(dict(zip(decoded['ids'].tolist(), decoded['cluster_counts'].tolist())), {1: 3, 4: 1})
+        self.assertEqual(
+            dict(zip(decoded['ids'].tolist(), decoded['cluster_counts'].tolist())),
+            {int(kept.id): count for kept, count in zip(*decimate_pilots(snapshot.pilots, viewport.zoom))},
+        )
+
+
+class FeedResponse:
+    '''Stands in for the streamed requests response of a feed download.'''
+
+    def __init__(self, status_code, body=b'', headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.raw = io.BytesIO(body)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f'HTTP {self.status_code}')
+
+    def json(self):
+        return json.loads(self.raw.getvalue())
+
+
+def vatsim_feed(update_timestamp, *pilots):
+    '''Returns a VATSIM data feed body holding pilots given as (cid, callsign, latitude, longitude).'''
+    return json.dumps({
+        'general': {'update_timestamp': update_timestamp},
+        'pilots': [
+            {'cid': cid, 'callsign': callsign, 'name': f'Pilot {cid}', 'latitude': latitude, 'longitude': longitude, 'flight_plan': None}
+            for cid, callsign, latitude, longitude in pilots
+        ],
+        'controllers': [],
+    }).encode('utf-8')
+
+
+@mock.patch('map.networkUtility.get_airport_positions', return_value={})
+class VatsimSnapshotTests(SimpleTestCase):
+    def setUp(self):
+        self.provider = VatsimProvider()
+
+    def refresh(self, response):
+        with mock.patch('map.networkUtility.requests.get', return_value=response) as get:
+            refreshed = self.provider.refresh()
+        return refreshed, get.call_args.kwargs['headers']
+
+    def test_new_feed_is_stored_with_its_validators(self, _):
+        body = vatsim_feed('2024-05-01T12:00:00.0000000Z', (1, 'AAL1', 5, 5), (2, 'BAW2', 6, 6))
+        refreshed, headers = self.refresh(FeedResponse(200, body, {'ETag': '"a"', 'Last-Modified': 'Wed, 01 May 2024 12:00:00 GMT'}))
+
+        self.assertTrue(refreshed)
+        self.assertNotIn('If-None-Match', headers)
+        snapshot = self.provider.snapshot()
+        self.assertEqual(snapshot.version, 1714564800)
+        self.assertEqual(sorted(pilot.callsign for pilot in snapshot.pilots), ['AAL1', 'BAW2'])
+        self.assertEqual(self.provider.state['etag'], '"a"')
+
+    def test_unchanged_feed_is_a_conditional_get(self, _):
+        self.refresh(FeedResponse(200, vatsim_feed('2024-05-01T12:00:00Z', (1, 'AAL1', 5, 5)), {'ETag': '"a"', 'Last-Modified': 'then'}))
+        snapshot = self.provider.snapshot()
+
+        refreshed, headers = self.refresh(FeedResponse(304))
+        self.assertFalse(refreshed)
+        self.assertEqual(headers['If-None-Match'], '"a"')
+        self.assertEqual(headers['If-Modified-Since'], 'then')
+        self.assertIs(self.provider.snapshot(), snapshot)
+
+    def test_same_update_timestamp_with_new_validators_is_skipped(self, _):
+        self.refresh(FeedResponse(200, vatsim_feed('2024-05-01T12:00:00Z', (1, 'AAL1', 5, 5)), {'ETag': '"a"'}))
+        snapshot = self.provider.snapshot()
+
+        refreshed, _ = self.refresh(FeedResponse(200, vatsim_feed('2024-05-01T12:00:00Z', (1, 'AAL1', 7, 7)), {'ETag': '"b"'}))
+        self.assertFalse(refreshed)
+        self.assertIs(self.provider.snapshot(), snapshot)
+        self.assertEqual(snapshot.find_pilot(1).latitude, 5)
+
+
+def online_controller(vatsim_id, callsign, frequency=118.5):
+    return {'id': vatsim_id, 'callsign': callsign, 'frequency': frequency}
+
+
+class ControllerReconcileTests(TestCase):
+    def setUp(self):
+        self.heathrow = Controller.objects.create(ident='EGLL', type='TWR', latitude_deg=51.5, longitude_deg=-0.5, vatsim_id=0)
+        self.heathrow_duplicate = Controller.objects.create(ident='EGLL', type='TWR', latitude_deg=51.5, longitude_deg=-0.5, vatsim_id=0)
+        self.kennedy = Controller.objects.create(ident='KJFK', type='GND', latitude_deg=40.6, longitude_deg=-73.8, vatsim_id=5, is_online=True)
+
+    def reconcile(self, controllers):
+        with mock.patch('map.vatsimUtility.fetch_vatsim_controllers', return_value=controllers):
+            with self.captureOnCommitCallbacks(execute=True):
+                return reconcile_vatsim_controllers()
+
+    def test_rows_are_reconciled_in_bulk(self):
+        version = controllers_version()
+        # Reads, one bulk update, one bulk create and the version bump, not a query per row
+        with self.assertNumQueries(7):
+            stats = self.reconcile([online_controller(10, 'EGLL_TWR'), online_controller(11, 'LFPG_1_APP')])
+
+        self.assertEqual((stats['processed'], stats['online'], stats['updated'], stats['created']), (2, 2, 2, 1))
+        self.heathrow.refresh_from_db()
+        self.assertEqual((self.heathrow.vatsim_id, self.heathrow.is_online, self.heathrow.frequency), (10, True, 118.5))
+        # Only the first row with a name takes the online position
+        self.heathrow_duplicate.refresh_from_db()
+        self.assertFalse(self.heathrow_duplicate.is_online)
+        self.kennedy.refresh_from_db()
+        self.assertFalse(self.kennedy.is_online)
+        created = Controller.objects.get(name='LFPG_APP')
+        self.assertEqual((created.ident, created.vatsim_id, created.is_online), ('LFPG', 11, True))
+        self.assertEqual(Controller.objects.count(), 4)
+        self.assertGreater(controllers_version(), version)
+
+    def test_unchanged_controllers_are_not_written(self):
+        online = [online_controller(10, 'EGLL_TWR'), online_controller(11, 'LFPG_1_APP')]
+        self.reconcile(online)
+        version = controllers_version()
+
+        stats = self.reconcile(online)
+        self.assertEqual((stats['updated'], stats['created']), (0, 0))
+        self.assertEqual(Controller.objects.filter(is_online=True).count(), 2)
+        self.assertEqual(controllers_version(), version)
+
+
+class ControllerDivisionTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        ControllerDivision.objects.create(vatsim_id=10, division='EUD', updated_at=now)
+        ControllerDivision.objects.create(vatsim_id=11, division='USA', updated_at=now - timedelta(days=2))
+        for vatsim_id in (10, 11, 12):
+            Controller.objects.create(ident='EGLL', type='TWR', latitude_deg=0, longitude_deg=0, vatsim_id=vatsim_id, is_online=True)
+        self.looked_up = []
+
+    async def fetch_divisions(self, vatsim_ids):
+        self.looked_up.append(list(vatsim_ids))
+        # 11 moved division, 12 has none and the lookup of 13 fails
+        return [{11: (11, 'CAN'), 12: (12, None)}.get(vatsim_id) for vatsim_id in vatsim_ids]
+
+    def test_only_unknown_and_expired_divisions_are_looked_up(self):
+        with mock.patch('map.vatsimUtility.fetch_divisions', self.fetch_divisions):
+            self.assertEqual(refresh_controller_divisions([10, 11, 12, 13]), 3)
+            # Members without a division are remembered, failed lookups are retried
+            self.assertEqual(refresh_controller_divisions([10, 11, 12, 13]), 1)
+        self.assertEqual(self.looked_up, [[11, 12, 13], [13]])
+
+        self.assertEqual(dict(ControllerDivision.objects.values_list('vatsim_id', 'division')), {10: 'EUD', 11: 'CAN', 12: None})
+        self.assertEqual(dict(Controller.objects.values_list('vatsim_id', 'division')), {10: 'EUD', 11: 'CAN', 12: None})
+
+    def test_stored_division_is_served_without_upstream(self):
+        with mock.patch('map.vatsimUtility.requests.get') as get:
+            response = self.client.get(reverse('fetch_controller_divisions', args=[10]))
+        get.assert_not_called()
+        self.assertEqual(response.content, b'E,L,U')
+
+
+def ivao_whazzup(updated_at, *pilots):
+    '''Returns an IVAO whazzup body holding the given raw pilots.'''
+    return json.dumps({'updatedAt': updated_at, 'clients': {'pilots': list(pilots)}}).encode('utf-8')
+
+
+@mock.patch('map.networkUtility.get_airport_positions', return_value={})
+class IvaoProviderTests(SimpleTestCase):
+    pilot = {
+        'userId': 700,
+        'callsign': 'IVA700',
+        'lastTrack': {'latitude': 48.1, 'longitude': 11.5, 'altitude': 36000, 'groundSpeed': 460, 'heading': 270},
+        'flightPlan': {'aircraftId': 'A320', 'departureId': 'EDDM', 'arrivalId': 'LEMD', 'speed': 'N0450', 'level': 'F360', 'route': 'DCT'},
+    }
+
+    def setUp(self):
+        self.provider = IvaoProvider()
+
+    def test_pilots_are_normalised_into_records(self, _):
+        with mock.patch('map.networkUtility.requests.get', return_value=FeedResponse(200, ivao_whazzup('2024-05-01T12:00:00Z', self.pilot))):
+            self.provider.refresh()
+
+        pilot = self.provider.snapshot().find_pilot(700)
+        self.assertEqual((pilot.network, pilot.latitude, pilot.groundspeed, pilot.heading), ('ivao', 48.1, 460, 270))
+        self.assertEqual((pilot.departure, pilot.arrival, pilot.cruise_tas, pilot.planned_altitude), ('EDDM', 'LEMD', 450, 36000))
+        self.assertEqual(self.provider.pilot_json(pilot), {
+            'userId': 700, 'callsign': 'IVA700', 'latitude': 48.1, 'longitude': 11.5, 'heading': 270, 'altitude': 36000,
+            'speed': 460, 'departure': 'EDDM', 'route': 'DCT', 'arrival': 'LEMD', 'progress': None,
+        })
+
+    def test_one_download_serves_every_reader(self, _):
+        with mock.patch('map.networkUtility.requests.get', return_value=FeedResponse(200, ivao_whazzup('2024-05-01T12:00:00Z', self.pilot))) as get:
+            self.provider.refresh()
+            snapshots = {id(self.provider.snapshot()) for _ in range(5)}
+        self.assertEqual(get.call_count, 1)
+        self.assertEqual(len(snapshots), 1)
+
+    def test_payload_json_carries_cluster_counts(self, _):
+        with mock.patch('map.networkUtility.requests.get', return_value=FeedResponse(200, ivao_whazzup('2024-05-01T12:00:00Z', self.pilot))):
+            self.provider.refresh()
+        snapshot = self.provider.snapshot()
+
+        payload = self.provider.payload_json({'version': snapshot.version, 'full': True, 'decimated': True, 'pilots': snapshot.pilots, 'cluster_counts': [4]})
+        self.assertNotIn('cluster_counts', payload)
+        self.assertEqual([(pilot['userId'], pilot['cluster_count']) for pilot in payload['pilots']], [(700, 4)])
+
+
+class PreparedResponseTests(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.build = mock.Mock(return_value=json.dumps({'pilots': ['AAL1'] * 200}).encode('utf-8'))
+        # Cached bodies are shared by the process, every test gets endpoints of its own
+        self.name = f'test_endpoint_{self._testMethodName}'
+
+    def respond(self, version, query=None, **headers):
+        request = self.factory.get('/endpoint/', query or {}, **headers)
+        return prepared_response(request, self.name, version, self.build, headers={'X-Data-Age': '3'})
+
+    def test_matching_etag_is_not_modified(self):
+        etag = self.respond(1)['ETag']
+
+        response = self.respond(1, HTTP_IF_NONE_MATCH=f'"other", {etag}')
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response['X-Data-Age'], '3')
+        self.assertEqual(self.build.call_count, 1)
+
+    def test_body_is_built_once_per_version(self):
+        first = self.respond(1)
+        self.respond(1)
+        self.assertEqual(self.build.call_count, 1)
+
+        newer = self.respond(2, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(newer.status_code, 200)
+        self.assertNotEqual(newer['ETag'], first['ETag'])
+        self.assertEqual(self.build.call_count, 2)
+
+    def test_queries_and_encodings_have_their_own_etags(self):
+        plain = self.respond(1)
+        viewport = self.respond(1, {'zoom': 5})
+        compressed = self.respond(1, HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertEqual(len({plain['ETag'], viewport['ETag'], compressed['ETag']}), 3)
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(compressed.content), plain.content)
+
+
+class ControllersVersionTests(TestCase):
+    def test_change_in_another_process_is_served(self):
+        url = reverse('controllers_data')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # Another worker reconciled, this process only sees the shared row move
+        DataVersion.objects.filter(name=CONTROLLERS_VERSION).update(version=F('version') + 1)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_edit_is_served(self):
+        url = reverse('controllers_data')
+        etag = self.client.get(url)['ETag']
+        Controller.objects.create(ident='EGLL', type='TWR', latitude_deg=51.5, longitude_deg=-0.5, vatsim_id=10, is_online=True)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([controller['ident'] for controller in json.loads(response.content)['controllers']], ['EGLL'])
+
+
+def parse_event(chunk):
+    '''Returns (topic, version, data) of one server-sent event.'''
+    fields = dict(line.split(': ', 1) for line in chunk.decode('utf-8').strip().split('\n'))
+    return fields['event'], int(fields['id']), json.loads(fields['data'])
+
+
+class LiveStreamTests(SimpleTestCase):
+    def setUp(self):
+        self.provider = VatsimProvider()
+        # Versions no other test uses, live bodies are cached per version
+        remember_snapshot(self.provider.state, FeedSnapshot(9001, [pilot(1, 5, 5, 'AAL1'), pilot(2, 6, 6, 'BAW2')]))
+        patcher = mock.patch.dict('map.views.network_providers', {'vatsim': self.provider}, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_stream_sends_full_payload_then_deltas(self):
+        events = live_events(['vatsim'], None, '')
+        try:
+            self.assertEqual(await events.__anext__(), b'retry: 5000\n\n')
+            topic, version, data = parse_event(await events.__anext__())
+            self.assertEqual((topic, version, data['full']), ('vatsim', 9001, True))
+            self.assertEqual(sorted(pilot['cid'] for pilot in data['pilots']), [1, 2])
+
+            remember_snapshot(self.provider.state, FeedSnapshot(9002, [pilot(1, 5, 5, 'AAL1'), pilot(2, 6, 7, 'BAW2')]))
+            publish_update('vatsim')
+            topic, version, data = parse_event(await events.__anext__())
+            self.assertEqual((version, data['full'], data['since']), (9002, False, 9001))
+            self.assertEqual([pilot['cid'] for pilot in data['pilots']], [2])
+
+            # A topic published again at the same version sends nothing, only the keepalive follows
+            publish_update('vatsim')
+            with mock.patch('map.views.STREAM_KEEPALIVE_SECONDS', 0.05):
+                self.assertEqual(await events.__anext__(), b': keepalive\n\n')
+        finally:
+            await events.aclose()
+        self.assertEqual(len(stream_subscribers), 0)
+
+    def test_wsgi_clients_fall_back_to_polling(self):
+        self.assertEqual(self.client.get(reverse('live_stream')).status_code, 204)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker('test feed', failure_threshold=3, reset_seconds=60)
+        self.failing = mock.Mock(side_effect=ConnectionError('timed out'))
+
+    def open_circuit(self):
+        for _ in range(3):
+            with self.assertRaises(ConnectionError):
+                self.breaker.call(self.failing)
+
+    def test_repeated_failures_open_the_circuit(self):
+        self.open_circuit()
+        self.assertEqual(self.breaker.state, 'open')
+        with self.assertRaises(CircuitOpen):
+            self.breaker.call(self.failing)
+        self.assertEqual(self.failing.call_count, 3)
+
+    def test_half_open_trial_success_closes_the_circuit(self):
+        self.open_circuit()
+        self.breaker.opened_at -= 60
+        self.assertEqual(self.breaker.state, 'half-open')
+
+        self.assertEqual(self.breaker.call(lambda: 'feed'), 'feed')
+        self.assertEqual(self.breaker.state, 'closed')
+        self.assertEqual(self.breaker.failures, 0)
+
+    def test_half_open_trial_failure_opens_it_again(self):
+        self.open_circuit()
+        self.breaker.opened_at -= 60
+        with self.assertRaises(ConnectionError):
+            self.breaker.call(self.failing)
+        self.assertEqual(self.breaker.state, 'open')
+        # Only one trial per reset period
+        with self.assertRaises(CircuitOpen):
+            self.breaker.call(self.failing)
+        self.assertEqual(self.failing.call_count, 4)
+
+
+class StaleSnapshotTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch('map.networkUtility.get_airport_positions', return_value={})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.provider = VatsimProvider()
+        with mock.patch('map.networkUtility.requests.get', return_value=FeedResponse(200, vatsim_feed('2024-05-01T12:00:00Z', (1, 'AAL1', 5, 5)))):
+            self.provider.refresh()
+        self.snapshot = self.provider.state['snapshot']
+
+    def test_failing_upstream_serves_the_last_snapshot(self):
+        with mock.patch('map.networkUtility.requests.get', side_effect=ConnectionError('timed out')) as get:
+            for _ in range(5):
+                self.assertFalse(self.provider.try_refresh())
+        # The circuit opened after three failures, the last two refreshes never went upstream
+        self.assertEqual(get.call_count, 3)
+        self.assertIs(self.provider.snapshot(), self.snapshot)
+        self.assertEqual(self.provider.state['last_error'], 'timed out')
+
+        self.provider.state['fetched_at'] -= 60
+        headers = self.provider.status_headers()
+        self.assertEqual((headers['X-Data-Stale'], headers['X-Upstream-Circuit']), ('true', 'open'))
+
+    def test_stalled_refresh_does_not_block_readers(self):
+        self.provider.state['last_checked'] -= 60
+        with mock.patch.object(self.provider, 'refresh_in_background') as refresh_in_background:
+            self.assertIs(self.provider.snapshot(), self.snapshot)
+        refresh_in_background.assert_called_once_with()
+
+
+# (airway, sequence, name, latitude, longitude) rows of a small waypoint file.
+# DELTA is on two airways, ALPHA exists in two places.
+WAYPOINT_ROWS = [
+    ('A1', '001', 'ALPHA', 10, 10),
+    ('A1', '002', 'BRAVO', 10, 11),
+    ('A1', '003', 'CHARL', 10, 12),
+    ('A1', '004', 'DELTA', 10, 13),
+    ('B2', '001', 'DELTA', 10, 13),
+    ('B2', '002', 'ECHOO', 11, 13),
+    ('Z9', '001', 'ALPHA', -30, 100),
+    ('Z9', '002', 'FOXTR', -30, 101),
+]
+
+
+def write_waypoint_file(path, rows):
+    with open(path, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(['rand1', 'rand2', 'name', 'latitude', 'longitude'])
+        writer.writerows(rows)
+
+
+def use_waypoint_file(test, rows=WAYPOINT_ROWS):
+    '''Writes rows to a waypoint file that get_waypoint_index serves for the rest of the test, returns its index.'''
+    directory = tempfile.TemporaryDirectory()
+    test.addCleanup(directory.cleanup)
+    path = os.path.join(directory.name, 'waypoint_data.csv')
+    write_waypoint_file(path, rows)
+    index = WaypointIndex(path)
+    for module in ('map.waypointUtility', 'map.routeUtility'):
+        patcher = mock.patch(f'{module}.get_waypoint_index', return_value=index)
+        patcher.start()
+        test.addCleanup(patcher.stop)
+    return index
+
+
+def names(index, points):
+    return sorted(index.names[point] for point in points)
+
+
+class WaypointIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = use_waypoint_file(self)
+
+    def test_points_are_distinct_names_and_positions(self):
+        self.assertEqual(len(self.index), 7)
+        self.assertEqual(len(self.index.candidates('ALPHA')), 2)
+        self.assertEqual(len(self.index.candidates('DELTA')), 1)
+        self.assertEqual(len(self.index.candidates('ZULU')), 0)
+
+    def test_nearest_candidate_is_picked(self):
+        self.assertEqual(self.index.point(self.index.nearest('ALPHA', -29, 99)), {'name': 'ALPHA', 'latitude': -30.0, 'longitude': 100.0})
+        self.assertEqual(self.index.point(self.index.nearest('ALPHA', 12, 8)), {'name': 'ALPHA', 'latitude': 10.0, 'longitude': 10.0})
+        self.assertIsNone(self.index.nearest('ZULU', 0, 0))
+
+    def test_box_query_reads_only_its_points(self):
+        self.assertEqual(names(self.index, self.index.in_box(9, 9, 12, 12.5)), ['ALPHA', 'BRAVO', 'CHARL'])
+        self.assertEqual(names(self.index, self.index.in_box(-31, 99, -29, 102)), ['ALPHA', 'FOXTR'])
+        self.assertEqual(len(self.index.in_box(50, 50, 60, 60)), 0)
+
+
+class WaypointReloadTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'waypoint_data.csv')
+        write_waypoint_file(self.path, WAYPOINT_ROWS)
+        for patcher in (
+            mock.patch('map.waypointUtility.waypoint_data_path', return_value=self.path),
+            mock.patch.dict(waypoint_index_state, {'index': None, 'checked_at': 0}),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_changed_file_is_reloaded(self):
+        index = get_waypoint_index()
+        self.assertIs(get_waypoint_index(), index)
+
+        write_waypoint_file(self.path, WAYPOINT_ROWS[:2])
+        os.utime(self.path, (index.mtime + 10, index.mtime + 10))
+        # The file is only looked at again once the check interval passed
+        self.assertIs(get_waypoint_index(), index)
+        waypoint_index_state['checked_at'] = 0
+        self.assertEqual(len(get_waypoint_index()), 2)
+
+
+class AirwayExpansionTests(SimpleTestCase):
+    def setUp(self):
+        self.index = use_waypoint_file(self)
+
+    def expand(self, tokens):
+        '''Returns the expanded route as (ident, (latitude, longitude)) pairs, None for points left to the caller.'''
+        return [
+            (ident, None if point is None else (self.index.latitude[point], self.index.longitude[point]))
+            for ident, point in expand_airways(tokens)
+        ]
+
+    def test_airways_expand_into_their_fixes(self):
+        self.assertEqual(self.expand(['ALPHA', 'A1', 'DELTA', 'B2', 'ECHOO']), [
+            ('ALPHA', (10, 10)), ('BRAVO', (10, 11)), ('CHARL', (10, 12)), ('DELTA', (10, 13)), ('ECHOO', (11, 13)),
+        ])
+
+    def test_airways_are_flown_both_ways(self):
+        self.assertEqual([ident for ident, _ in self.expand(['DELTA', 'A1', 'BRAVO'])], ['DELTA', 'CHARL', 'BRAVO'])
+
+    def test_airway_places_an_ambiguous_entry_fix(self):
+        # The ALPHA on A1, not the one on Z9
+        self.assertEqual(self.expand(['ALPHA', 'A1', 'BRAVO'])[0], ('ALPHA', (10, 10)))
+
+    def test_unknown_segments_are_left_alone(self):
+        self.assertEqual(self.expand(['ALPHA', 'Q99', 'BRAVO']), [('ALPHA', None), ('Q99', None), ('BRAVO', None)])
+        # ECHOO is not on A1
+        self.assertEqual(self.expand(['ALPHA', 'A1', 'ECHOO']), [('ALPHA', None), ('A1', None), ('ECHOO', None)])
+
+
+class NearestChainTests(SimpleTestCase):
+    # Two candidates for the first position, one near each candidate for the second
+    latitude = [10, -30, -31, 11]
+    longitude = [10, 100, 101, 11]
+    counts = [2, 2]
+
+    def test_each_pick_is_closest_to_the_one_before(self):
+        self.assertEqual(nearest_chain(self.latitude, self.longitude, self.counts, start=(-29, 99)).tolist(), [1, 2])
+        self.assertEqual(nearest_chain(self.latitude, self.longitude, self.counts, start=(12, 9)).tolist(), [0, 3])
+
+    def test_without_start_the_first_candidate_leads(self):
+        self.assertEqual(nearest_chain(self.latitude, self.longitude, self.counts).tolist(), [0, 3])
+        self.assertEqual(nearest_chain([], [], []).tolist(), [])
+
+
+class RouteWaypointResolutionTests(TestCase):
+    def setUp(self):
+        use_waypoint_file(self)
+
+    def resolve(self, route, start):
+        return [
+            (waypoint['ident'], waypoint['latitude_deg'], waypoint['longitude_deg'])
+            for waypoint in resolve_route_waypoints(tokenize_route(route), start)
+        ]
+
+    def test_ambiguous_fix_resolves_near_the_departure(self):
+        self.assertEqual(self.resolve('ALPHA FOXTR', (-29, 99)), [('ALPHA', -30, 100), ('FOXTR', -30, 101)])
+        self.assertEqual(self.resolve('ALPHA BRAVO', (11, 9)), [('ALPHA', 10, 10), ('BRAVO', 10, 11)])
+
+    def test_waypoint_table_candidates_join_the_chain(self):
+        Waypoint.objects.create(ident='GOLFF', latitude_deg=50, longitude_deg=50)
+        Waypoint.objects.create(ident='GOLFF', latitude_deg=10, longitude_deg=14)
+        self.assertEqual(self.resolve('BRAVO A1 DELTA GOLFF UNKNW', (10, 10)), [
+            ('BRAVO', 10, 11), ('CHARL', 10, 12), ('DELTA', 10, 13), ('GOLFF', 10, 14),
+        ])
+
+
+class RouteTokenizerTests(SimpleTestCase):
+    def setUp(self):
+        use_waypoint_file(self)
+
+    def test_route_is_tokenized(self):
+        tokens = tokenize_route('N0450F350 WYNDE3 ALPHA A1 DELTA/N0460F360 DCT 46N078W 4620N07805W 5020N 50N20 C/BRAVO/N0450F370 IFR STAR1A')
+        self.assertEqual([(token.kind, token.text) for token in tokens], [
+            ('procedure', 'WYNDE3'), ('fix', 'ALPHA'), ('airway', 'A1'), ('fix', 'DELTA'),
+            ('coordinate', '46N078W'), ('coordinate', '4620N07805W'), ('coordinate', '5020N'), ('coordinate', '50N20'),
+            ('fix', 'BRAVO'), ('procedure', 'STAR1A'),
+        ])
+        self.assertEqual([token.position for token in tokens if token.kind == 'coordinate'], [
+            (46, -78), (46 + 20 / 60, -(78 + 5 / 60)), (50, -20), (50, -120),
+        ])
+        # Tokens joined back into a route tokenize to themselves, which is what route_key relies on
+        self.assertEqual(tokenize_route(' '.join(token.text for token in tokens)), tokens)
+
+    def test_airways_and_procedures_need_their_place(self):
+        self.assertEqual(tokenize_route('A1 ALPHA'), [RouteToken('fix', 'A1', None), RouteToken('fix', 'ALPHA', None)])
+        # A known fix that looks like a procedure stays a fix
+        self.assertEqual(tokenize_route('ALPHA B2'), [RouteToken('fix', 'ALPHA', None), RouteToken('fix', 'B2', None)])
+
+    def test_coordinates_in_every_hemisphere(self):
+        self.assertEqual(parse_route_coordinate('4620S07805E'), (-(46 + 20 / 60), 78 + 5 / 60))
+        self.assertEqual(parse_route_coordinate('0530E'), (5, 30))
+        self.assertEqual(parse_route_coordinate('0530S'), (-5, 30))
+        self.assertEqual(parse_route_coordinate('05W30'), (-5, -130))
+        self.assertIsNone(parse_route_coordinate('9920N'))
+        self.assertIsNone(parse_route_coordinate('ALPHA'))
+
+
+class RouteCacheTests(TestCase):
+    def setUp(self):
+        use_waypoint_file(self)
+        for patcher in (
+            mock.patch('map.routeUtility.get_airport_positions', return_value={'AAAA': (10, 9), 'BBBB': (10, 14)}),
+            mock.patch.dict(route_cache, clear=True),
+            mock.patch.dict(route_cache_stats, {'hits': 0, 'misses': 0}),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_routes_filed_differently_share_a_resolution(self):
+        first = resolve_route('AAAA', 'BBBB', tokenize_route('N0450F350 ALPHA A1 DELTA'))
+        second = resolve_route('AAAA', 'BBBB', tokenize_route('ALPHA/N0460F360 DCT  A1 DELTA IFR'))
+
+        self.assertIs(second, first)
+        self.assertEqual(route_cache_stats, {'hits': 1, 'misses': 1})
+        self.assertEqual([waypoint['ident'] for waypoint in first], ['AAAA', 'ALPHA', 'BRAVO', 'CHARL', 'DELTA', 'BBBB'])
+
+    def test_other_airports_are_resolved_again(self):
+        resolve_route('AAAA', 'BBBB', tokenize_route('ALPHA A1 DELTA'))
+        resolve_route('BBBB', 'AAAA', tokenize_route('ALPHA A1 DELTA'))
+        self.assertEqual(route_cache_stats, {'hits': 0, 'misses': 2})
+
+    def test_batch_endpoint_reports_the_counters(self):
+        plans = {1: ('VATSIM', 'AAAA', 'BBBB', 'ALPHA A1 DELTA'), 2: ('VATSIM', 'AAAA', 'BBBB', 'ALPHA A1 DELTA')}
+        with mock.patch('map.routeUtility.flight_plan_routes', return_value=plans):
+            response = self.client.get(reverse('construct_routes'), {'ids': '1,2,3'})
+        self.assertEqual(json.loads(response.content)['missing'], [3])
+        # The first route misses once, its path and the second route are hits
+        self.assertEqual((response['X-Route-Cache-Hits'], response['X-Route-Cache-Misses']), ('2', '1'))
+
+
+def tile_of(latitude, longitude, z):
+    '''Returns the (x, y) of the Web Mercator tile holding a position at zoom level z.'''
+    tiles = 2 ** z
+    latitude = math.radians(latitude)
+    return int((longitude + 180) / 360 * tiles), int((1 - math.asinh(math.tan(latitude)) / math.pi) / 2 * tiles)
+
+
+class WaypointTileTests(TestCase):
+    def setUp(self):
+        self.index = use_waypoint_file(self)
+
+    def test_low_zoom_keeps_the_fix_on_most_airways(self):
+        # At zoom 0 CHARL, DELTA and ECHOO share a bucket, and so do the two Z9 fixes
+        kept = names(self.index, self.index.tile(0, 0, 0))
+        self.assertEqual(len(kept), 3)
+        self.assertIn('DELTA', kept)
+        self.assertNotIn('CHARL', kept)
+        self.assertNotIn('ECHOO', kept)
+
+    def test_full_zoom_keeps_every_fix(self):
+        x, y = tile_of(10.5, 11.5, 4)
+        self.assertEqual(names(self.index, self.index.tile(4, x, y)), ['ALPHA', 'BRAVO', 'CHARL', 'DELTA', 'ECHOO'])
+        x, y = tile_of(10, 10, TILE_FULL_ZOOM)
+        self.assertEqual(names(self.index, self.index.tile(TILE_FULL_ZOOM, x, y)), ['ALPHA'])
+
+    def test_tiles_are_bounded_however_dense_the_data(self):
+        rows = [('', '0', f'W{row}X{column}', -80 + row * 1.6, -180 + column * 3.6) for row in range(100) for column in range(100)]
+        index = use_waypoint_file(self, rows)
+        self.assertEqual(len(index), 10000)
+        self.assertLessEqual(len(index.tile(0, 0, 0)), TILE_BUCKETS ** 2)
+        self.assertLessEqual(len(index.tile(1, 1, 1)), TILE_BUCKETS ** 2)
+
+    # Tiles are cached per waypoint file version, a file written in the same second by another test has the same one
+    @mock.patch.dict('map.wireUtility.prepared_responses', clear=True)
+    def test_tile_endpoint_revalidates(self):
+        url = reverse('waypoint_tile', args=[0, 0, 0])
+        response = self.client.get(url)
+        self.assertEqual(len(json.loads(response.content)['waypoints']), 3)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(reverse('waypoint_tile', args=[1, 2, 0])).status_code, 404)
+
+
+# (ident, name, type, iso_region, latitude, longitude) of a few airports, two of them either side of the antimeridian
+AIRPORT_ROWS = [
+    ('EGLL', 'London Heathrow Airport', 'large_airport', 'GB-ENG', 51.47, -0.45),
+    ('EGKB', 'London Biggin Hill Airport', 'medium_airport', 'GB-ENG', 51.33, 0.03),
+    ('EG01', 'Redhill Strip', 'small_airport', 'GB-ENG', 51.21, -0.14),
+    ('NZAA', 'Auckland International Airport', 'medium_airport', 'NZ-AUK', -37.0, 174.79),
+    ('NFFN', 'Nadi International Airport', 'large_airport', 'FJ-W', -17.76, 177.44),
+    ('NSFA', 'Faleolo International Airport', 'medium_airport', 'WS-AA', -13.83, -172.01),
+]
+
+
+def create_airports():
+    for ident, name, airport_type, region, latitude, longitude in AIRPORT_ROWS:
+        Airport.objects.create(
+            ident=ident, name=name, type=airport_type, iso_region=region, latitude_deg=latitude, longitude_deg=longitude,
+            continent='EU', iso_country=region[:2],
+        )
+
+
+class AirportIndexTests(TestCase):
+    def setUp(self):
+        create_airports()
+        self.index = AirportIndex(Airport.objects.values_list(
+            'ident', 'name', 'type', 'iso_region', 'latitude_deg', 'longitude_deg', 'display_tier'
+        ))
+
+    def idents(self, viewport, max_tier):
+        return sorted(self.index.idents[airport] for airport in self.index.in_viewport(viewport, max_tier))
+
+    def test_display_tier_is_derived_on_save(self):
+        self.assertEqual(dict(Airport.objects.values_list('ident', 'display_tier')), {
+            'EGLL': AIRPORT_TIER_MAJOR, 'EGKB': AIRPORT_TIER_MEDIUM, 'EG01': AIRPORT_TIER_MINOR,
+            'NZAA': AIRPORT_TIER_MAJOR, 'NFFN': AIRPORT_TIER_MAJOR, 'NSFA': AIRPORT_TIER_MAJOR,
+        })
+
+    def test_viewport_query_by_tier(self):
+        london = Viewport(north=52, south=51, east=1, west=-1, zoom=9)
+        self.assertEqual(self.idents(london, AIRPORT_TIER_MAJOR), ['EGLL'])
+        self.assertEqual(self.idents(london, AIRPORT_TIER_MEDIUM), ['EGKB', 'EGLL'])
+        self.assertEqual(self.idents(london, AIRPORT_TIER_MINOR), ['EG01', 'EGKB', 'EGLL'])
+
+    def test_viewport_across_the_antimeridian(self):
+        pacific = Viewport(north=-10, south=-20, east=-170, west=175, zoom=6)
+        self.assertEqual(self.idents(pacific, AIRPORT_TIER_MINOR), ['NFFN', 'NSFA'])
+
+    def test_tiers_appear_with_zoom(self):
+        self.assertEqual([visible_tier(zoom) for zoom in (3, 5, 9, 11)], [None, AIRPORT_TIER_MAJOR, AIRPORT_TIER_MEDIUM, AIRPORT_TIER_MINOR])
+
+
+class AirportsViewTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.dict(airport_table_state, {'index': None, 'loaded_at': 0})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        create_airports()
+
+    def airports(self, zoom, **params):
+        response = self.client.get(reverse('airports'), {
+            'northBound': 52, 'southBound': 51, 'eastBound': 1, 'westBound': -1, 'zoom': zoom, **params,
+        })
+        return json.loads(response.content)
+
+    def test_markers_follow_the_zoom_level(self):
+        self.assertEqual(self.airports(3)['airports'], [])
+        self.assertEqual([airport['ident'] for airport in self.airports(6)['airports']], ['EGLL'])
+        self.assertEqual(sorted(airport['ident'] for airport in self.airports(11)['airports']), ['EG01', 'EGKB', 'EGLL'])
+
+    def test_search_finds_airports_of_every_tier(self):
+        data = self.airports(3, query='redhill')
+        self.assertEqual(data['airports'], [])
+        self.assertEqual([result['name'] for result in data['results']], ['Redhill Strip'])
+
+    def test_new_airport_is_served_after_save(self):
+        self.airports(6)
+        Airport.objects.create(
+            ident='EGLC', name='London City Airport', type='large_airport', iso_region='GB-ENG', latitude_deg=51.5, longitude_deg=0.05,
+            continent='EU', iso_country='GB',
+        )
+        self.assertEqual(sorted(airport['ident'] for airport in self.airports(6)['airports']), ['EGLC', 'EGLL'])
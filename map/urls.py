@@ -15,11 +15,12 @@ from .views import (
     fetch_vatsim_flight_data,
     user_location,
     which_network,
+    live_stream,
 )
 from map.ivaoUtility import fetch_ivao_network
 from map.vatsimUtility import fetch_vatsim_data
 from map.searchUtility import *
-from map.routeUtility import construct_route
+from map.routeUtility import construct_route, construct_routes, waypoint_tile
 
 from map.weatherUtility import fetch_metars, get_metar
 
@@ -41,8 +42,11 @@ urlpatterns = [
     path('api/which_network/<str:network_id>', which_network, name='which_network'),
     path('api/ivao_network/', fetch_ivao_network, name='ivao_network'),
     path('api/vatsim_network/',fetch_vatsim_data, name='vatsim_network'),
+    path('api/live/', live_stream, name='live_stream'),
     path('search_airports/', search_airports, name='search_airports'),
     path('api/construct_route/<int:network_id>/', construct_route, name='construct_route'),
+    path('api/construct_routes/', construct_routes, name='construct_routes'),
+    path('api/waypoints/<int:z>/<int:x>/<int:y>/', waypoint_tile, name='waypoint_tile'),
     path('api/fetch_metars/', fetch_metars, name='fetch_metars'),
     path('api/get_metar/<str:ident>/', get_metar, name='get_metar_info'),
 ]
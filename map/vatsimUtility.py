@@ -1,3 +1,7 @@
+import asyncio
+import threading
+from datetime import timedelta
+
 import aiohttp
 from django.http import HttpResponse, JsonResponse
 from django.shortcuts import redirect, render
@@ -5,15 +9,21 @@ from django.views.decorators.http import require_http_methods
 import requests
 import time
 from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
 from map.forms import ControllerForm
-from map.models import Controller, VATSIMFlight
+from map.feedUtility import delta_payload, parse_since, parse_viewport
+from map.models import Controller, ControllerDivision, DataVersion, VATSIMFlight
+from map.networkUtility import VATSIM_API_URL, CircuitBreaker, CircuitOpen, get_vatsim_snapshot, headers, vatsim_provider
+from map.streamUtility import publish_update
+from map.wireUtility import COLUMNAR_CONTENT_TYPE, columnar_body, encode_json, prepared_response, wants_columnar
 from asgiref.sync import sync_to_async
 
-# Initial headers setup
-user_agent = 'SimTrail/1.0 (SimTrail; https://simtrail.com/)'
-headers = {
-    'User-Agent': user_agent
-}
+
 
 
 # Cache setup
@@ -22,14 +32,54 @@ online_controllers_cache = {
     'last_updated': 0,
     'update_interval': 300  # Cache duration in seconds, e.g., 5 minutes
 }
-vatsim_data_cache = {
-    'last_updated': 0,
-    'data': None,
-    'update_interval': 180
-}
-# Initial setup for the division cache
-division_cache = {}
+# A failing VATSIM API is skipped for a while, callers keep the last good list meanwhile
+online_controllers_breaker = CircuitBreaker('VATSIM ATC list')
+# Controller divisions are kept in the ControllerDivision table for this long
 cache_update_interval = 86400  # 24 hours in seconds
+# Maximum number of division lookups in flight at once against the VATSIM API
+DIVISION_FETCH_CONCURRENCY = 8
+
+# Inbound flight plan harvester settings
+HARVEST_CONCURRENCY = 16
+HARVEST_MAX_RETRIES = 3
+HARVEST_BACKOFF_SECONDS = 1
+HARVEST_CHUNK_SIZE = 500
+harvest_state = {
+    'fingerprints': {},  # vatsim_id -> (callsign, route) at the last successful fetch
+    'last_run': None,
+}
+# Only one harvest may run at a time
+harvest_lock = threading.Lock()
+
+# Name of the DataVersion row versioning the Controller table
+CONTROLLERS_VERSION = 'controllers'
+
+
+def controllers_version():
+    '''
+    Returns the version of the Controller table, shared by every worker process through its DataVersion row.
+
+    The row starts from the clock, so versions are not reused after the table is recreated.
+    '''
+    version = DataVersion.objects.filter(name=CONTROLLERS_VERSION).values_list('version', flat=True).first()
+    if version is None:
+        version = DataVersion.objects.get_or_create(name=CONTROLLERS_VERSION, defaults={'version': int(time.time())})[0].version
+    return version
+
+
+def bump_controllers_version():
+    '''Marks the Controller table as changed, for this process and every other one.'''
+    changed = DataVersion.objects.filter(name=CONTROLLERS_VERSION).update(version=Greatest(F('version') + 1, Value(int(time.time()))))
+    if not changed:
+        DataVersion.objects.get_or_create(name=CONTROLLERS_VERSION, defaults={'version': int(time.time())})
+    publish_update('controllers')
+
+
+@receiver([post_save, post_delete], sender=Controller)
+def controller_changed(sender, **kwargs):
+    # Bulk writes do not send signals, the sync bumps the version itself
+    bump_controllers_version()
+
 
 # Division to region map
 DIVISION_TO_REGION_MAP = {
@@ -61,184 +111,198 @@ DIVISION_TO_REGION_MAP = {
 
 
 def fetch_vatsim_controllers():
+    '''
+    Returns the controllers online on VATSIM, cached for update_interval.
+
+    When the API fails or its circuit is open the last good list is returned, an empty
+    one would look like every controller logged off.
+    '''
     current_time = time.time()
     # Check if cached data is fresh
     if online_controllers_cache['data'] is not None and (current_time - online_controllers_cache['last_updated']) < online_controllers_cache['update_interval']:
         return online_controllers_cache['data']
-    else:
-        # Fetch new data if cache is stale
-
-        response = requests.get("https://api.vatsim.net/v2/atc/online", headers=headers)
-        if response.status_code == 200:
-            online_controllers_cache['data'] = response.json()
-            online_controllers_cache['last_updated'] = current_time
-            return online_controllers_cache['data']
-        else:
-            return [] 
 
+    def download():
+        response = requests.get(f"{VATSIM_API_URL}/v2/atc/online", headers=headers, timeout=10)
+        response.raise_for_status()
+        return response.json()
 
-# Initial cache setup
-flight_data_cache = {
-    'data': None,
-    'last_updated': 0,
-    'update_interval': 15 # Cache duration in seconds, e.g., 5 minutes
-}
+    try:
+        online_controllers_cache['data'] = online_controllers_breaker.call(download)
+        online_controllers_cache['last_updated'] = current_time
+    except CircuitOpen:
+        pass
+    except (requests.RequestException, ValueError) as e:
+        print(f"Error fetching VATSIM controllers, keeping the last known list: {e}")
+    return online_controllers_cache['data'] or []
 
 
 @require_http_methods(["GET"])
 def fetch_vatsim_data(request):
-    '''Fetches VATSIM data from the VATSIM Data API and returns it as a JSON response.'''
-    url = 'https://data.vatsim.net/v3/vatsim-data.json'
-    try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()  # Raises an HTTPError if the response status code is 4XX/5XX
-        data = response.json()
-
-        pilots_data = data.get('pilots', [])
-        return JsonResponse(data, safe=False)  # `safe=False` is necessary because we're returning a list
-    except requests.RequestException as e:
-        return JsonResponse({'error': 'Failed to fetch VATSIM data'}, status=500)
+    '''Returns the shared VATSIM feed snapshot, or only the pilots in the requested viewport or changed since the version in the since parameter.'''
+    snapshot = get_vatsim_snapshot()
+    if snapshot is None:
+        return JsonResponse({'error': 'Failed to fetch VATSIM data'}, status=503, headers=vatsim_provider.status_headers())
+
+    status_headers = vatsim_provider.status_headers()
+    since = parse_since(request)
+    viewport = parse_viewport(request)
+    if wants_columnar(request):
+        return prepared_response(request, 'vatsim_network', snapshot.version, lambda: columnar_body(
+            vatsim_provider.state, delta_payload(vatsim_provider.state, snapshot, since, viewport), viewport
+        ), COLUMNAR_CONTENT_TYPE, status_headers)
+    if since is not None or viewport is not None:
+        return prepared_response(request, 'vatsim_network', snapshot.version, lambda: encode_json(
+            vatsim_provider.payload_json(delta_payload(vatsim_provider.state, snapshot, since, viewport))
+        ), headers=status_headers)
+    return prepared_response(request, 'vatsim_network', snapshot.version, lambda: encode_json(vatsim_feed_json(snapshot)), headers=status_headers)
 
 
 @require_http_methods(["GET"])
 def search_vatsim_pilots(request):
     '''Searches VATSIM pilots by callsign, name, or CID and returns the results as a JSON response.'''
     search_query = request.GET.get('query', '').lower()
-    url = 'https://data.vatsim.net/v3/vatsim-data.json'
-    try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        data = response.json()
-
-        filtered_pilots = []
-        for pilot in data.get('pilots', []):
-            # Convert to lower case for case-insensitive search
-            if search_query in pilot.get('callsign', '').lower() or \
-               search_query in pilot.get('name', '').lower() or \
-               search_query in str(pilot.get('cid', '')).lower():
-                filtered_pilots.append(pilot)
-
-        return JsonResponse(filtered_pilots, safe=False)
-    except requests.RequestException as e:
+    snapshot = get_vatsim_snapshot()
+    if snapshot is None:
         return JsonResponse({'error': 'Failed to fetch VATSIM data'}, status=500)
+
+    filtered_pilots = []
+    for pilot in snapshot.pilots:
+        # Convert to lower case for case-insensitive search
+        if search_query in (pilot.callsign or '').lower() or \
+           search_query in (pilot.name or '').lower() or \
+           search_query in str(pilot.id or '').lower():
+            filtered_pilots.append(vatsim_provider.pilot_json(pilot))
+
+    return JsonResponse(filtered_pilots, safe=False)
     
-def get_vatsim_user_location(request, vatsim_id):
+def get_vatsim_user_location(request, vatsim_id, snapshot=None):
     '''Returns the latitude and longitude of a VATSIM user with the given VATSIM ID.'''
-    vatsim_data = fetch_flight_data()
-    for pilot in vatsim_data.get("pilots", []):
-        if str(pilot.get("cid", "")) == str(vatsim_id):
-            return pilot.get("latitude", 0), pilot.get("longitude", 0)
-        
-def fetch_flight_data():
-    '''Fetches VATSIM flight data from the VATSIM Data API and returns it as a JSON response.'''
-    current_time = time.time()
-    # Check if the cache is fresh
-    if flight_data_cache['data'] is not None and (current_time - flight_data_cache['last_updated']) < flight_data_cache['update_interval']:
-        return flight_data_cache['data']
-    else:
-        # Define custom headers with a non-generic User-Agent
-        response = requests.get("https://data.vatsim.net/v3/vatsim-data.json", headers=headers)
-        if response.status_code == 200:
-            # Update the cache with the new data
-            flight_data_cache['data'] = response.json()
-            flight_data_cache['last_updated'] = current_time
-            return flight_data_cache['data']
-        else:
-            # In case of an error, return None or consider returning stale data if critical
-            return None
+    snapshot = snapshot or get_vatsim_snapshot()
+    pilot = find_pilot_by_cid(vatsim_id, snapshot)
+    if pilot is None:
+        return None, None
+    return pilot.latitude or 0, pilot.longitude or 0
         
 
-def update_vatsim_controller_data_cache():
-    '''Updates the VATSIM controller data cache if it's stale.'''
-    current_time = time.time()
-    # Check if the cache needs to be updated
-    if current_time - vatsim_data_cache['last_updated'] > vatsim_data_cache['update_interval']:
-        try:
-            response = requests.get('https://api.vatsim.net/v2/atc/online')
-            if response.status_code == 200:
-                vatsim_data_cache['data'] = response.json()
-                vatsim_data_cache['last_updated'] = current_time
-            else:
-                print("Failed to fetch data from VATSIM")
-        except Exception as e:
-            print(f"Error updating VATSIM cache: {e}")
-
+def vatsim_feed_json(snapshot):
+    '''Returns a snapshot in the shape of the VATSIM data feed, holding the general block and pilots.'''
+    return {
+        'general': dict(snapshot.data.get('general', {})),
+        'pilots': [vatsim_provider.pilot_json(pilot) for pilot in snapshot.pilots],
+        'version': snapshot.version,
+        'full': True,
+    }
 
 
 def is_vatsim_controller_online(request, vatsim_id):
     """Check if a controller with the given VATSIM ID is online, using cached data."""
-    # Ensure the cache is up to date before checking
-    update_vatsim_controller_data_cache()
-    # Now check the cached data
-    if vatsim_data_cache['data'] is not None:
-        for controller in vatsim_data_cache['data']:
-            if controller['id'] == vatsim_id:
-                return True
+    for controller in fetch_vatsim_controllers():
+        if controller['id'] == vatsim_id:
+            return True
     return False
 
 
-def update_vatsim_controllers(request):
-    '''Fetches VATSIM controller data and updates the database with the latest information.'''
-    controllers = fetch_vatsim_controllers()
+def reconcile_vatsim_controllers():
+    '''
+    Brings the Controller table in line with the controllers currently online on VATSIM.
 
-    results = []
-    updated_controllers = 0
-    total_controllers = len(controllers)  # Get the total number of controllers
+    Online and offline sets are computed in memory and written with bulk_update and
+    bulk_create in one transaction. Returns counts of the rows touched and the time taken.
+    '''
+    start_time = time.perf_counter()
+    controllers = fetch_vatsim_controllers()
+    online_ids = {controller['id'] for controller in controllers}
 
-    online_count = 0
-    database_controllers = Controller.objects.all()
-    for index, controller in enumerate(database_controllers, start=1):
-        if is_vatsim_controller_online(request, controller.vatsim_id):
-            controller.is_online = True
-            online_count += 1
-            controller.save()
-        else:
-            controller.is_online = False
-            controller.save()
-
-    for index, controller in enumerate(controllers, start=1):
+    # Online positions keyed by backend name, the last callsign seen wins as it did before
+    online_by_name = {}
+    for controller in controllers:
         search_ident = controller['callsign'].split("_")[0]
         controller_type = controller['callsign'].split("_")[-1]
-        #division = fetch_controller_division(request, controller['id']).content.decode('utf-8')
-        vatsim_id = controller['id']
+        online_by_name[f'{search_ident}_{controller_type}'] = (search_ident, controller_type, controller)
 
-        backendName = f'{search_ident}_{controller_type}'
-        
-        existing_controller = Controller.objects.filter(name=backendName).first()
-        if existing_controller:
-            # If the controller exists, update without changing latitude and longitude
-            existing_controller.vatsim_id = vatsim_id
-            existing_controller.frequency = controller.get('frequency', 0)  # Temporary placeholder for frequency
-            existing_controller.type = controller_type
-            existing_controller.division = None
-            existing_controller.is_online = True
-            existing_controller.save()
-        else:
-            # If the controller does not exist, create a new one
-            Controller.objects.create(
-                name=backendName,
-                vatsim_id=vatsim_id,
+    changed_controllers = []
+    matched_names = set()
+    online_count = 0
+    update_fields = ['vatsim_id', 'frequency', 'type', 'division', 'is_online']
+
+    # Divisions resolved by refresh_controller_divisions, missing ones are filled in after the sync
+    known_divisions = dict(ControllerDivision.objects.filter(vatsim_id__in=online_ids).values_list('vatsim_id', 'division'))
+
+    with transaction.atomic():
+        database_controllers = Controller.objects.only('id', 'name', *update_fields).order_by('id')
+        for db_controller in database_controllers:
+            current = tuple(getattr(db_controller, field) for field in update_fields)
+
+            online_entry = online_by_name.get(db_controller.name)
+            if online_entry and db_controller.name not in matched_names:
+                # Only the first row with a given name takes the live position's details
+                matched_names.add(db_controller.name)
+                _, controller_type, controller = online_entry
+                db_controller.vatsim_id = controller['id']
+                db_controller.frequency = controller.get('frequency', 0)  # Temporary placeholder for frequency
+                db_controller.type = controller_type
+                db_controller.division = known_divisions.get(controller['id'])
+                db_controller.is_online = True
+            else:
+                db_controller.is_online = db_controller.vatsim_id in online_ids
+
+            if db_controller.is_online:
+                online_count += 1
+            if tuple(getattr(db_controller, field) for field in update_fields) != current:
+                changed_controllers.append(db_controller)
+
+        Controller.objects.bulk_update(changed_controllers, update_fields, batch_size=500)
+
+        # bulk_create skips Controller.save, so the name is set here the same way save would
+        new_controllers = [
+            Controller(
+                name=name,
+                vatsim_id=controller['id'],
                 ident=search_ident,
-                latitude_deg=0, 
+                latitude_deg=0,
                 longitude_deg=0,
                 frequency=controller.get('frequency', 0),  # Temporary placeholder for frequency
                 type=controller_type,
-                division=None,
+                division=known_divisions.get(controller['id']),
                 is_online=True,
                 airport=None,
-            )   
-        updated_controllers += 1
+            )
+            for name, (search_ident, controller_type, controller) in online_by_name.items()
+            if name not in matched_names
+        ]
+        Controller.objects.bulk_create(new_controllers, batch_size=500)
+
+    if changed_controllers or new_controllers:
+        transaction.on_commit(bump_controllers_version)
+    return {
+        'processed': len(controllers),
+        'online': online_count + len(new_controllers),
+        'updated': len(changed_controllers),
+        'created': len(new_controllers),
+        'duration_ms': round((time.perf_counter() - start_time) * 1000, 1),
+    }
 
-    return JsonResponse({'message': f'{updated_controllers} controllers processed.'})
-def controllers_data(request):
+
+def update_vatsim_controllers(request):
+    '''Fetches VATSIM controller data and updates the database with the latest information.'''
+    stats = reconcile_vatsim_controllers()
+    return JsonResponse({'message': f"{stats['processed']} controllers processed.", **stats})
+def controllers_body():
+    '''Returns the online controllers serialized as the controllers_data JSON body.'''
     controllers = Controller.objects.all().values(
         'ident', 'latitude_deg', 'longitude_deg', 'type', 'division', 'vatsim_id', 'airport_id', 'geoname'
     ).exclude(is_online=False)
-    return JsonResponse({'controllers': list(controllers)})
+    return encode_json({'controllers': list(controllers)})
+
+
+def controllers_data(request):
+    # The table is only read again once a sync or an edit in any process changed it
+    return prepared_response(request, 'controllers_data', controllers_version(), controllers_body)
 
 def fetch_flightplan_from_vatsim(vatsim_id):
     """Fetches the flight plan for a given VATSIM ID from the VATSIM API."""
-    url = f"https://api.vatsim.net/v2/members/{vatsim_id}/flightplans"
+    url = f"{VATSIM_API_URL}/v2/members/{vatsim_id}/flightplans"
     response = requests.get(url, headers=headers)
     if response.status_code == 200:
         flightplans = response.json()
@@ -247,27 +311,93 @@ def fetch_flightplan_from_vatsim(vatsim_id):
     return None
 
 
+async def fetch_division(session, semaphore, vatsim_id):
+    '''Fetches the division of a single VATSIM member, returning (vatsim_id, division) or None if the lookup failed.'''
+    async with semaphore:
+        try:
+            async with session.get(f'{VATSIM_API_URL}/api/ratings/{vatsim_id}') as response:
+                if response.status == 200:
+                    data = await response.json()
+                    return vatsim_id, data.get('division', None)
+                print(f"Failed to fetch division for VATSIM ID {vatsim_id}: {response.status}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Error fetching division for VATSIM ID {vatsim_id}: {e}")
+    return None
+
+
+async def fetch_divisions(vatsim_ids):
+    '''Fetches the divisions of many VATSIM members, with at most DIVISION_FETCH_CONCURRENCY requests in flight.'''
+    semaphore = asyncio.Semaphore(DIVISION_FETCH_CONCURRENCY)
+    timeout = aiohttp.ClientTimeout(total=30)
+    async with aiohttp.ClientSession(headers=headers, timeout=timeout) as session:
+        return await asyncio.gather(*(fetch_division(session, semaphore, vatsim_id) for vatsim_id in vatsim_ids))
+
+
+def store_divisions(resolved):
+    '''Upserts a {vatsim_id: division} mapping into the ControllerDivision table.'''
+    now = timezone.now()
+    ControllerDivision.objects.bulk_create(
+        [ControllerDivision(vatsim_id=vatsim_id, division=division, updated_at=now) for vatsim_id, division in resolved.items()],
+        update_conflicts=True,
+        unique_fields=['vatsim_id'],
+        update_fields=['division', 'updated_at'],
+        batch_size=500,
+    )
+
+
+def refresh_controller_divisions(vatsim_ids):
+    '''
+    Resolves divisions for controller CIDs that are unknown or older than the TTL, then copies
+    them onto the online Controller rows so controllers_data never has to call upstream.
+
+    Returns the number of CIDs that were looked up.
+    '''
+    vatsim_ids = set(vatsim_ids)
+    cutoff = timezone.now() - timedelta(seconds=cache_update_interval)
+    fresh_ids = set(ControllerDivision.objects.filter(vatsim_id__in=vatsim_ids, updated_at__gte=cutoff).values_list('vatsim_id', flat=True))
+    stale_ids = sorted(vatsim_ids - fresh_ids)
+
+    if stale_ids:
+        results = asyncio.run(fetch_divisions(stale_ids))
+        # Members without a division are stored too, so they are not looked up again until the TTL expires
+        store_divisions(dict(result for result in results if result is not None))
+
+    divisions = dict(ControllerDivision.objects.filter(vatsim_id__in=vatsim_ids).values_list('vatsim_id', 'division'))
+    changed_controllers = []
+    for controller in Controller.objects.filter(vatsim_id__in=vatsim_ids, is_online=True).only('id', 'vatsim_id', 'division'):
+        division = divisions.get(controller.vatsim_id)
+        if division is not None and controller.division != division:
+            controller.division = division
+            changed_controllers.append(controller)
+    Controller.objects.bulk_update(changed_controllers, ['division'], batch_size=500)
+    if changed_controllers:
+        bump_controllers_version()
+
+    return len(stale_ids)
+
+
 def fetch_controller_division(request, id):
-    current_time = time.time()
+    cutoff = timezone.now() - timedelta(seconds=cache_update_interval)
     
-    # Check if the division data is in the cache and is fresh
-    if id in division_cache and current_time - division_cache[id]['last_updated'] < cache_update_interval:
-        division = division_cache[id]['division']
+    # Check if the division is stored and still fresh
+    stored = ControllerDivision.objects.filter(vatsim_id=id, updated_at__gte=cutoff).first()
+    if stored is not None:
+        division = stored.division
+        if division is None:
+            return HttpResponse('Division not found', status=404)
     else:
         try:
             # Make an API request to the VATSIM API
-            response = requests.get(f'https://api.vatsim.net/api/ratings/{id}', headers=headers)
+            response = requests.get(f'{VATSIM_API_URL}/api/ratings/{id}', headers=headers, timeout=10)
             response.raise_for_status()  # Raise an error for bad responses
             
             # Extract the division from the response data
             data = response.json()
             division = data.get('division', None)
+            store_divisions({id: division})
             
             if division is None:
                 return HttpResponse('Division not found', status=404)
-            
-            # Update the cache with new data
-            division_cache[id] = {'division': division, 'last_updated': current_time}
         
         except requests.RequestException as e:
             # Handle any errors that occur during the API request
@@ -279,92 +409,211 @@ def fetch_controller_division(request, id):
     # Return the ICAO codes as a string in the HttpResponse
     return HttpResponse(','.join(icao_codes))
 
-async def fetch_flight_plan(session, vatsim_id, index, count_members):
-    flight_plan_url = f'https://api.vatsim.net/v2/members/{vatsim_id}/flightplans'
+async def fetch_flight_plan(session, semaphore, vatsim_id):
+    '''
+    Fetches the latest flight plan filed by a VATSIM member.
+
+    Rate limits, server errors and timeouts are retried with exponential backoff.
+    Returns (True, plan or None) once the member was read, also for members the API has no
+    plans for, or (False, None) if every attempt failed or the response was malformed.
+    '''
+    flight_plan_url = f'{VATSIM_API_URL}/v2/members/{vatsim_id}/flightplans'
+    async with semaphore:
+        for attempt in range(HARVEST_MAX_RETRIES + 1):
+            delay = HARVEST_BACKOFF_SECONDS * 2 ** attempt
+            try:
+                async with session.get(flight_plan_url) as response:
+                    if response.status == 429 or response.status >= 500:
+                        # Respect the upstream rate limiter when it tells us how long to wait
+                        retry_after = response.headers.get('Retry-After', '')
+                        if retry_after.isdigit():
+                            delay = int(retry_after)
+                    elif response.status == 200:
+                        flight_plans = await response.json()
+                        if not isinstance(flight_plans, list):
+                            print(f"Unexpected flight plan response for VATSIM ID {vatsim_id}: {flight_plans!r}")
+                            return False, None
+                        return True, (flight_plans[0] if flight_plans else None)
+                    else:
+                        # Unknown or hidden members have no flight plan to read, retrying will not change that
+                        return True, None
+            except (aiohttp.ClientError, aiohttp.ContentTypeError, asyncio.TimeoutError, ValueError) as e:
+                # Malformed JSON bodies raise ValueError
+                print(f"Error fetching flight plan for VATSIM ID {vatsim_id}: {e}")
+
+            if attempt < HARVEST_MAX_RETRIES:
+                await asyncio.sleep(delay)
+    return False, None
+
+
+async def fetch_flight_plans(vatsim_ids):
+    '''Fetches flight plans for many members over one pooled session with at most HARVEST_CONCURRENCY requests in flight.'''
+    semaphore = asyncio.Semaphore(HARVEST_CONCURRENCY)
+    connector = aiohttp.TCPConnector(limit=HARVEST_CONCURRENCY, ttl_dns_cache=300)
+    timeout = aiohttp.ClientTimeout(total=20)
+    async with aiohttp.ClientSession(headers=headers, connector=connector, timeout=timeout) as session:
+        return await asyncio.gather(*(fetch_flight_plan(session, semaphore, vatsim_id) for vatsim_id in vatsim_ids))
+
+
+def flight_plan_fields(plan):
+    '''Maps a members API flight plan onto VATSIMFlight fields.'''
+    return {
+        'vatsim_id': int(plan['vatsim_id']),
+        'callsign': plan['callsign'],
+        'departure': plan['dep'],
+        'arrival': plan['arr'],
+        'aircraft': plan['aircraft'],
+        'cruise_speed': int(plan['cruisespeed']) if 'cruisespeed' in plan and plan['cruisespeed'].isdigit() else 0,
+        'altitude': int(plan['altitude']) if 'altitude' in plan and plan['altitude'].isdigit() else 0,
+        'route': plan['route'],
+    }
+
+
+def save_flight_plans(plans):
+    '''Upserts flight plans into VATSIMFlight in chunks, updating each member's existing row or creating one.'''
+    # One plan per member, the last one wins
+    plans_by_member = {int(plan['vatsim_id']): plan for plan in plans}
+    member_ids = list(plans_by_member)
+    update_fields = ['callsign', 'departure', 'arrival', 'aircraft', 'cruise_speed', 'altitude', 'route']
+
+    for start in range(0, len(member_ids), HARVEST_CHUNK_SIZE):
+        chunk = member_ids[start:start + HARVEST_CHUNK_SIZE]
+        with transaction.atomic():
+            existing_rows = {}
+            for row_id, vatsim_id in VATSIMFlight.objects.filter(vatsim_id__in=chunk).order_by('id').values_list('id', 'vatsim_id'):
+                existing_rows.setdefault(vatsim_id, row_id)
+
+            to_update = []
+            to_create = []
+            for vatsim_id in chunk:
+                flight = VATSIMFlight(**flight_plan_fields(plans_by_member[vatsim_id]))
+                if vatsim_id in existing_rows:
+                    flight.pk = existing_rows[vatsim_id]
+                    to_update.append(flight)
+                else:
+                    to_create.append(flight)
+
+            VATSIMFlight.objects.bulk_update(to_update, update_fields)
+            VATSIMFlight.objects.bulk_create(to_create)
+
+    return len(member_ids)
+
+
+def run_inbound_flight_harvest():
+    '''
+    Fetches the flight plans of online VATSIM members and saves them to the database.
+
+    Members whose callsign and filed route are unchanged since the last run are skipped.
+    Returns the run statistics, or None if another harvest is already running.
+    '''
+    if not harvest_lock.acquire(blocking=False):
+        return None
     try:
-        async with session.get(flight_plan_url) as response:
-            if 'application/json' in response.headers.get('Content-Type', ''):
-                flight_plans = await response.json()
-                if flight_plans:
-                    return flight_plans[0]
-            else:
-                print(f"Non-JSON response for VATSIM ID {vatsim_id}: {response.status}, {response.headers.get('Content-Type')}")
-    except aiohttp.ContentTypeError as e:
-        print(f"JSON decode error for VATSIM ID {vatsim_id}: {e}")
-    return None
-
-async def save_flight_plan_to_db(plan):
-    '''Saves a flight plan to the database.'''
-    await sync_to_async(VATSIMFlight.objects.update_or_create, thread_sensitive=True)(
-        vatsim_id=plan['vatsim_id'],
-        defaults={
-            'callsign': plan['callsign'],
-            'departure': plan['dep'],
-            'arrival': plan['arr'],
-            'aircraft': plan['aircraft'],
-            'cruise_speed': int(plan['cruisespeed']) if 'cruisespeed' in plan and plan['cruisespeed'].isdigit() else 0,
-            'altitude': int(plan['altitude']) if 'altitude' in plan and plan['altitude'].isdigit() else 0,
-            'route': plan['route'],
+        start_time = time.perf_counter()
+        response = requests.get(f'{VATSIM_API_URL}/v2/members/online', headers=headers, timeout=15)
+        response.raise_for_status()
+        online_members = response.json()
+
+        # The data feed already tells us each member's current route, so unchanged plans need no request
+        snapshot = get_vatsim_snapshot()
+        fingerprints = {}
+        for member in online_members:
+            pilot = find_pilot_by_cid(member['id'], snapshot)
+            fingerprints[member['id']] = (member.get('callsign'), pilot.route if pilot is not None else None)
+
+        previous_fingerprints = harvest_state['fingerprints']
+        to_fetch = [vatsim_id for vatsim_id, fingerprint in fingerprints.items() if previous_fingerprints.get(vatsim_id) != fingerprint]
+        results = asyncio.run(fetch_flight_plans(to_fetch)) if to_fetch else []
+
+        # Members that failed keep no fingerprint so the next run retries them
+        next_fingerprints = {vatsim_id: fingerprint for vatsim_id, fingerprint in fingerprints.items() if previous_fingerprints.get(vatsim_id) == fingerprint}
+        plans = []
+        failed = 0
+        for vatsim_id, (ok, plan) in zip(to_fetch, results):
+            if not ok:
+                failed += 1
+                continue
+            next_fingerprints[vatsim_id] = fingerprints[vatsim_id]
+            if plan:
+                plans.append(plan)
+
+        saved = save_flight_plans(plans)
+        harvest_state['fingerprints'] = next_fingerprints
+
+        stats = {
+            'members': len(online_members),
+            'fetched': len(to_fetch) - failed,
+            'skipped': len(online_members) - len(to_fetch),
+            'failed': failed,
+            'saved': saved,
+            'duration_ms': round((time.perf_counter() - start_time) * 1000, 1),
         }
-    )
+        harvest_state['last_run'] = stats
+        return stats
+    finally:
+        harvest_lock.release()
+
+
+def start_inbound_flight_harvest():
+    '''Runs the inbound flight harvest in a background thread. Returns False if one is already running.'''
+    if harvest_lock.locked():
+        return False
+    threading.Thread(target=run_inbound_flight_harvest, daemon=True).start()
+    return True
 
 
 @require_http_methods(["GET"])
 def vatsim_flight_details(request):
     '''Fetches VATSIM flight data and returns it as a JSON response.'''
-    vatsim_data = fetch_flight_data()
+    snapshot = get_vatsim_snapshot()
 
-    if vatsim_data is not None:
-        processed_flights = process_flight_data(vatsim_data)
-        return JsonResponse({"pilots": processed_flights})
+    if snapshot is not None:
+        return prepared_response(request, 'vatsim_flight_details', snapshot.version, lambda: encode_json({"pilots": process_flight_data(snapshot.pilots)}),
+                                 headers=vatsim_provider.status_headers())
     else:
-        return JsonResponse({'error': 'Failed to fetch VATSIM data'}, status=500)
+        return JsonResponse({'error': 'Failed to fetch VATSIM data'}, status=503, headers=vatsim_provider.status_headers())
     
 
-def find_pilot_by_cid(cid, vatsim_data):
-    '''Finds a pilot by their VATSIM CID in the provided VATSIM data.'''
-    for pilot in vatsim_data.get("pilots", []):
-        if str(pilot.get("cid", "")) == str(cid):
-            return pilot
-    return None
+def find_pilot_by_cid(cid, snapshot):
+    '''Finds a pilot by their VATSIM CID in the provided VATSIM feed snapshot.'''
+    if snapshot is None:
+        return None
+    return snapshot.find_pilot(cid)
 
 
-def process_flight_data(data):
-    '''Processes the flight data for and returns a list of flight details.'''
+def process_flight_data(pilots):
+    '''Processes the Pilot records of a snapshot and returns a list of flight details.'''
     flights = []
     
-    for prefile in data.get('pilots', []):
-        
-        flight_plan = prefile.get('flight_plan')
-        
-        # Skip this prefile if flight_plan is None
-        if not flight_plan:
+    for pilot in pilots:
+        # Skip pilots without a flight plan
+        if not pilot.has_flight_plan:
             continue
 
-        if not flight_plan.get('arrival', '') or not flight_plan.get('departure', ''):  # Skip if no arrival or departure
+        if not pilot.arrival or not pilot.departure:  # Skip if no arrival or departure
             continue
         
         # Extract flight_plan details
         flight_details = {
-            'aircraft_short': flight_plan.get('aircraft_short', ''),
-            'departure': flight_plan.get('departure', ''),
-            'arrival': flight_plan.get('arrival', ''),
-            'alternate': flight_plan.get('alternate', ''),
-            'cruise_tas': flight_plan.get('cruise_tas', ''),
-            'altitude': flight_plan.get('altitude', ''),
-            'deptime': flight_plan.get('deptime', ''),
-            'enroute_time': flight_plan.get('enroute_time', ''),
-            'route': flight_plan.get('route', ''),
+            'aircraft_short': pilot.aircraft_short or '',
+            'departure': pilot.departure,
+            'arrival': pilot.arrival,
+            'alternate': pilot.alternate or '',
+            'cruise_tas': pilot.cruise_tas or '',
+            'altitude': pilot.planned_altitude or '',
+            'deptime': pilot.deptime or '',
+            'enroute_time': pilot.enroute_time or '',
+            'route': pilot.route or '',
         }
 
         # Add pilot details
         flight_details.update({
-            'name': prefile.get('name', ''),
-            'callsign': prefile.get('callsign', ''),
-            'transponder': prefile.get('transponder', ''),
-            'cid': prefile.get('cid', ''),
-            'latitude': prefile.get('latitude', ''),
-            'longitude': prefile.get('longitude', ''),
+            'name': pilot.name or '',
+            'callsign': pilot.callsign or '',
+            'transponder': pilot.transponder or '',
+            'cid': pilot.id or '',
+            'latitude': pilot.latitude if pilot.latitude is not None else '',
+            'longitude': pilot.longitude if pilot.longitude is not None else '',
         })
         
         flights.append(flight_details)
@@ -372,37 +621,13 @@ def process_flight_data(data):
     return flights
 
 
-def is_vatsim_id(request, network_id):
-    vatsim_data = fetch_flight_data()
-    for pilot in vatsim_data.get("pilots", []):
-        if str(pilot.get("cid", "")) == str(network_id):
-            return pilot
-    return None
-
-def find_pilot_by_cid(cid, vatsim_data):
-    
-    for pilot in vatsim_data.get("pilots", []):
-        if str(pilot.get("cid", "")) == str(cid):
-            return pilot
-    return None
+def is_vatsim_id(request, network_id, snapshot=None):
+    '''Returns the connected VATSIM pilot with the given CID, or None.'''
+    return find_pilot_by_cid(network_id, snapshot or get_vatsim_snapshot())
 
 def fetch_vatsim_flight_data(request):
-
-    cache_key = 'vatsim_data'
-    cache_time = 15  # time in seconds for cache to be valid
-
-    # Try to get cached data
-    data = cache.get(cache_key)
-    if data is not None:
-        return JsonResponse(data)  # Return cached data if available
-
-    # Fetch new data if not cached or cache is stale
-    url = 'https://data.vatsim.net/v3/vatsim-data.json'
-    try:
-        response = requests.get(url,headers=headers)
-        response.raise_for_status()
-        data = response.json()
-        cache.set(cache_key, data, cache_time)  # Update cache
-        return JsonResponse(data)
-    except requests.RequestException as e:
-        return JsonResponse({'error': 'Failed to fetch VATSIM data', 'details': str(e)}, status=500)
+    '''Returns the shared VATSIM feed snapshot as a JSON response.'''
+    snapshot = get_vatsim_snapshot()
+    if snapshot is None:
+        return JsonResponse({'error': 'Failed to fetch VATSIM data'}, status=500)
+    return JsonResponse(vatsim_feed_json(snapshot))
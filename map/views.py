@@ -1,13 +1,14 @@
 import csv
 from datetime import datetime, timedelta
 import json
+import time
 
 from xml.etree import ElementTree
 from django.http import HttpResponse, JsonResponse
 from django.shortcuts import  render
 from map.models import Airline
 from map.forms import ControllerForm
-from map.ivaoUtility import fetch_ivao_map_data, is_ivao_id
+from map.ivaoUtility import is_ivao_id
 from map.models import Airport, Controller
 from schedule.models import Flight
 
@@ -16,8 +17,28 @@ from django.views.decorators.csrf import csrf_exempt
 import asyncio
 import aiohttp
 from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Q
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.http import StreamingHttpResponse
 
 from map.vatsimUtility import *
+from map.airportUtility import get_airport_index, visible_tier
+from map.feedUtility import DECIMATE_BELOW_ZOOM, Viewport, delta_payload, parse_viewport
+from map.networkUtility import get_ivao_snapshot, network_providers
+from map.streamUtility import STREAM_KEEPALIVE_SECONDS, STREAM_RETRY_MS, publish_update, stream_event, subscribe, unsubscribe
+from map.wireUtility import encode_json, prepared_entry
+
+# Topics a live stream client can follow
+LIVE_TOPICS = ('vatsim', 'ivao', 'controllers', 'fleet')
+
+# Version of the active flights' telemetry, bumped whenever a Flight is saved in this process.
+# Saves in other worker processes are not seen here, clients keep a slow poll running for them (see liveStream.js).
+fleet_state = {
+    'version': int(time.time()),
+}
 
 @login_required
 def aircraft_card(request):
@@ -45,7 +66,8 @@ def aircraft_map(request):
         }
     return render(request, 'map/map.html', context)
 
-def aircraft_data(request):
+def active_flights_data():
+    '''Returns the telemetry of every active flight.'''
     # Query all active flights
     active_flights = Flight.objects.filter(is_active=True)
     
@@ -62,84 +84,150 @@ def aircraft_data(request):
             'flight_number': flight.flight_number,
         }
         flights_data.append(flight_data)
-    
+    return flights_data
+
+
+def aircraft_data(request):
     # Return all flights data as JSON
-    return JsonResponse({'flights': flights_data})
+    return JsonResponse({'flights': active_flights_data()})
+
+
+@receiver(post_save, sender=Flight)
+def flight_saved(sender, **kwargs):
+    # Telemetry arrives as Flight saves, live stream clients of this process get it without waiting for their poll
+    fleet_state['version'] = max(fleet_state['version'] + 1, int(time.time()))
+    publish_update('fleet')
+
+
+def live_event(topic, since, viewport, viewport_query):
+    '''
+    Returns (version, body) of the server-sent event for topic, or None if the client already has the current version.
+
+    Bodies are cached per version and viewport, so clients watching the same area share one serialization.
+    Deltas are only cached for versions still in the delta history, older clients get the shared full payload.
+    '''
+    if topic in network_providers:
+        provider = network_providers[topic]
+        snapshot = provider.state['snapshot']
+        if snapshot is None or snapshot.version == since:
+            return None
+        decimated = viewport is not None and viewport.zoom < DECIMATE_BELOW_ZOOM
+        if since in provider.state['history'] and not decimated:
+            # Only deltas against the recent history are worth a cache entry of their own
+            entry = prepared_entry(f'live_{topic}', f'since={since}&{viewport_query}', snapshot.version, lambda: encode_json(
+                provider.payload_json(delta_payload(provider.state, snapshot, since, viewport))
+            ))
+            return snapshot.version, entry[None]
+        # Every other client gets the full payload, so they all share one entry per viewport
+        entry = prepared_entry(f'live_{topic}', viewport_query, snapshot.version, lambda: encode_json(
+            provider.payload_json(delta_payload(provider.state, snapshot, None, viewport))
+        ))
+        return snapshot.version, entry[None]
+
+    if topic == 'controllers':
+        version = controllers_version()
+        if version == since:
+            return None
+        return version, prepared_entry('controllers_data', '', version, controllers_body)[None]
+
+    version = fleet_state['version']
+    if version == since:
+        return None
+    return version, prepared_entry('live_fleet', '', version, lambda: encode_json({'flights': active_flights_data()}))[None]
+
+
+async def live_events(topics, viewport, viewport_query):
+    '''Yields server-sent events for the topics as ingestion produces new versions of them, until the client disconnects.'''
+    subscriber = subscribe(topics)
+    versions = {}
+    try:
+        yield b'retry: %d\n\n' % STREAM_RETRY_MS
+        while True:
+            if not await subscriber.wait(STREAM_KEEPALIVE_SECONDS):
+                yield b': keepalive\n\n'
+                continue
+            for topic in subscriber.take():
+                event = await sync_to_async(live_event)(topic, versions.get(topic), viewport, viewport_query)
+                if event is not None:
+                    versions[topic], body = event
+                    yield stream_event(topic, versions[topic], body)
+    finally:
+        unsubscribe(subscriber)
+
+
+async def live_stream(request):
+    '''
+    Streams network pilots, online controllers and fleet telemetry as server-sent events whenever they change.
+
+    Takes the topics to follow and the same viewport parameters as the network endpoints.
+    Pilots are sent as deltas against what the stream already sent, in the JSON shape of the network endpoints.
+    '''
+    # Long-lived responses need the ASGI server, under WSGI the client falls back to polling
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+
+    topics = [topic for topic in request.GET.get('topics', ','.join(LIVE_TOPICS)).split(',') if topic in LIVE_TOPICS]
+    viewport = parse_viewport(request)
+    viewport_query = '&'.join(f'{key}={request.GET[key]}' for key in ('northBound', 'southBound', 'eastBound', 'westBound', 'zoom') if key in request.GET)
+
+    response = StreamingHttpResponse(live_events(topics, viewport, viewport_query), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stops nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 
 def airports_view(request):
-    # Extract viewport bounds and zoom level from request parameters
-    north_bound = float(request.GET.get('northBound', '90'))
-    south_bound = float(request.GET.get('southBound', '-90'))
-    east_bound = float(request.GET.get('eastBound', '180'))
-    west_bound = float(request.GET.get('westBound', '-180'))
-    zoom_level = float(request.GET.get('zoom', 10))
-
-    # Initialize lists to hold the filtered airports and search results
+    '''
+    Returns the airports the map draws in a viewport at a zoom level, with the same bounds parameters as the pilot endpoints.
+
+    Airports come from the in-memory grid of get_airport_index, only those of the display tiers
+    shown at the zoom level. A query parameter also searches the names of every airport in the
+    viewport, whatever their tier and the zoom level.
+    '''
+    viewport = parse_viewport(request)
+    if viewport is None:
+        try:
+            zoom = float(request.GET.get('zoom', 10))
+        except ValueError:
+            zoom = 10
+        viewport = Viewport(90, -90, 180, -180, zoom)
+
+    tier = visible_tier(viewport.zoom)
     airports = []
-    searchList = []
-
-    # Query the database for all airports that are within the viewport bounds
-    queryset = Airport.objects.filter(
-        latitude_deg__lte=north_bound,
-        latitude_deg__gte=south_bound,
-        longitude_deg__lte=east_bound,
-        longitude_deg__gte=west_bound,
-    )
-
-    for airport in queryset:
-        include_airport = False
-        coordinates = f"{airport.longitude_deg}, {airport.latitude_deg}"
-
-        # Adjust airport inclusion based on zoom level and airport type
-        if zoom_level > 10:
-            include_airport = True
-        elif zoom_level > 8.1 and airport.type in ['large_airport', 'medium_airport', 'heliport']:
-            include_airport = True
-        elif zoom_level > 4.5 and (airport.type == 'large_airport' or (airport.type == 'medium_airport' and 'international' in airport.name.lower())):
-            include_airport = True
-
-        if include_airport:
-            airports.append({
-                'name': airport.name,
-                'type': airport.type,
-                'coordinates': coordinates,
-                'municipality': airport.iso_region,  # Assuming iso_region is used in place of municipality
-                'ident': airport.ident,
-            })
+    if tier is not None:
+        index = get_airport_index()
+        airports = [index.marker(airport) for airport in index.in_viewport(viewport, tier)]
 
-        # Assuming you want to add all queried airports to searchList regardless of the zoom level
-        searchList.append({
-            'name': airport.name,
-            'type': airport.type,
-            'coordinates': coordinates,
-            'municipality': airport.iso_region,
-        })
-
-    # Handle the search query
-    query = request.GET.get('query', '').lower()
     results = []
-
+    query = request.GET.get('query', '')
     if query:
-        # Filter the already filtered queryset for names containing the query
-        search_results = queryset.filter(name__icontains=query)
-        for airport in search_results:
+        if viewport.west <= viewport.east:
+            longitude_filter = Q(longitude_deg__gte=viewport.west, longitude_deg__lte=viewport.east)
+        else:
+            longitude_filter = Q(longitude_deg__gte=viewport.west) | Q(longitude_deg__lte=viewport.east)
+        search_results = Airport.objects.filter(
+            longitude_filter,
+            latitude_deg__gte=viewport.south,
+            latitude_deg__lte=viewport.north,
+            name__icontains=query,
+        ).values_list('name', 'type', 'latitude_deg', 'longitude_deg', 'iso_region')
+        for name, airport_type, latitude, longitude, region in search_results:
             results.append({
-                'name': airport.name,
-                'type': airport.type,
-                'coordinates': f"{airport.longitude_deg}, {airport.latitude_deg}",
-                'municipality': airport.iso_region,
+                'name': name,
+                'type': airport_type,
+                'coordinates': f"{longitude}, {latitude}",
+                'municipality': region,
             })
 
-    # Return both the filtered list of airports and the search results
-    return JsonResponse({'airports': airports, 'searchList': searchList, 'results': results}, safe=False)
+    return JsonResponse({'airports': airports, 'results': results})
 
 
 
 from map.timeUtility import get_local_time_from_ident, get_standard_time_of_arrival, convert_to_normal_time
 
-def process_flight(flight, airport_ident, source_type):
-    '''Processes a single flight and returns its details if it is relevant to the specified airport.'''
+def process_flight(pilot, airport_ident):
+    '''Processes a single Pilot record and returns its details if it is relevant to the specified airport.'''
     # Initialize common variables; some might need adjustments based on the source type
     vatsimID = None
     departureTime = None  # Placeholder, calculate based on available data
@@ -147,48 +235,52 @@ def process_flight(flight, airport_ident, source_type):
     arrivalTime = None  # Placeholder, calculate based on available data
     airline = "N/A"  # Default value, adjust as necessary
 
-    if source_type == 'vatsim':
-        from django.core.exceptions import ObjectDoesNotExist
+    from django.core.exceptions import ObjectDoesNotExist
 
-        if flight['arrival'] == airport_ident or flight['departure'] == airport_ident:
-            vatsimID = flight['cid']
-            departureTime = convert_to_normal_time(flight['deptime'])
-            enrouteTime = flight['enroute_time']
-            arrivalTime = get_standard_time_of_arrival(flight['deptime'], flight['enroute_time'])
+    if pilot.network == 'vatsim':
+        if pilot.arrival == airport_ident or pilot.departure == airport_ident:
+            vatsimID = pilot.id
+            departureTime = convert_to_normal_time(pilot.deptime or '')
+            enrouteTime = pilot.enroute_time or ''
+            arrivalTime = get_standard_time_of_arrival(pilot.deptime or '', pilot.enroute_time or '')
             try:
-                airline_query = Airline.objects.filter(icao=flight['callsign'][:3]).only('name')
+                airline_query = Airline.objects.filter(icao=(pilot.callsign or '')[:3]).only('name')
                 airline = airline_query.first().name if airline_query.exists() else "N/A"
             except ObjectDoesNotExist:
                 airline = "N/A"
             # Airline logic remains the same as in your original function
             # Add additional VATSIM-specific processing here
-    elif source_type == 'ivao':
-        if flight['arrival'] == airport_ident or flight['departure'] == airport_ident:
+    elif pilot.network == 'ivao':
+        if pilot.arrival == airport_ident or pilot.departure == airport_ident:
             departureTime = "Unknown"  # This would need your logic to determine or convert
             enrouteTime = "Unknown"  # Depending on whether you can calculate or have equivalent data
-            arrivalTime = "Unknown"  # Similar to departureTime, requires conversion or calculation
+            # IVAO has no filed times, the groundspeed ETA is the best estimate
+            arrivalTime = time.strftime("%I:%M %p", time.gmtime(pilot.progress['eta'])) if pilot.progress and pilot.progress['eta'] else "Unknown"
             try:
-                airline_query = Airline.objects.filter(icao=flight['callsign'][:3]).only('name')
+                airline_query = Airline.objects.filter(icao=(pilot.callsign or '')[:3]).only('name')
                 airline = airline_query.first().name if airline_query.exists() else "N/A"
             except ObjectDoesNotExist:
                 airline = "N/A"
 
     # Common processing continues here, assuming you can normalize some data between the two sources
     flight_info = {
-            'callsign': flight['callsign'],
-            'departure': flight['departure'],
-            'arrival': flight['arrival'],
-            'aircraft': flight['aircraft_short'],
-            'cruise_speed': flight['cruise_tas'],
-            'altitude': flight['altitude'],
-            'route': flight['route'],  
+            'callsign': pilot.callsign,
+            'departure': pilot.departure,
+            'arrival': pilot.arrival,
+            'aircraft': pilot.aircraft_short,
+            'cruise_speed': pilot.cruise_tas,
+            'altitude': pilot.planned_altitude,
+            'route': pilot.route,  
             'departureTime': departureTime,
             'enrouteTime': enrouteTime,
             'arrivalTime': arrivalTime,
             'airline': airline,
-            'latitude': flight['latitude'],
-            'longitude': flight['longitude'],
-            'distanceRemaining': 10 # This assumes distanceRemaining is meaningful for both arrivals and departures
+            'latitude': pilot.latitude,
+            'longitude': pilot.longitude,
+            # Percent of the great-circle distance still to fly, computed with the snapshot
+            'distanceRemaining': round(100 - pilot.progress['percent_complete'], 1) if pilot.progress else None,
+            'remainingKm': pilot.progress['remaining_km'] if pilot.progress else None,
+            'eta': pilot.progress['eta'] if pilot.progress else None,
     }
     return flight_info if flight_info['departure'] == airport_ident or flight_info['arrival'] == airport_ident else None
 
@@ -196,10 +288,11 @@ def process_flight(flight, airport_ident, source_type):
 
 def airport_details(request, airport_ident):
     '''Returns details of the specified airport, including arrivals and departures from VATSIM and IVAO.'''
-    vatsim_data = fetch_flight_data()  # Make sure this fetches VATSIM flight data
-    ivao_data = fetch_ivao_map_data()  # Make sure this fetches IVAO flight data
+    # One snapshot per network for the whole request
+    vatsim_snapshot = get_vatsim_snapshot()
+    ivao_snapshot = get_ivao_snapshot()
 
-    if vatsim_data is None and ivao_data is None:
+    if vatsim_snapshot is None and ivao_snapshot is None:
         return JsonResponse({'error': 'Failed to fetch flight data'}, status=500)
 
     all_flights = []
@@ -207,9 +300,9 @@ def airport_details(request, airport_ident):
     vatsim_arrivals = vatsim_departures = ivao_arrivals = ivao_departures = 0
 
     # Process VATSIM flights if available
-    if vatsim_data is not None:
+    if vatsim_snapshot is not None:
         with ThreadPoolExecutor(max_workers=25) as executor:
-            futures = [executor.submit(process_flight, flight, airport_ident, 'vatsim') for flight in process_flight_data(vatsim_data)]
+            futures = [executor.submit(process_flight, pilot, airport_ident) for pilot in vatsim_snapshot.pilots if pilot.has_flight_plan]
             for future in futures:
                 result = future.result()
                 if result:
@@ -220,9 +313,9 @@ def airport_details(request, airport_ident):
                     all_flights.append(result)
 
     # Process IVAO flights if available
-    if ivao_data is not None:
+    if ivao_snapshot is not None:
         with ThreadPoolExecutor(max_workers=25) as executor:
-            futures = [executor.submit(process_flight, flight_details, airport_ident, 'ivao') for flight_details in ivao_data.values()]
+            futures = [executor.submit(process_flight, pilot, airport_ident) for pilot in ivao_snapshot.pilots]
             for future in futures:
                 result = future.result()
                 if result:
@@ -264,15 +357,17 @@ def user_location(request, type):
     '''Returns the latitude and longitude of a user based on their network ID.'''
     identifier = request.GET.get('identifier', '')
     
+    # Read every lookup in this request from the same feed snapshot
+    snapshot = get_vatsim_snapshot()
     # Assuming which_network() correctly identifies the network based on the identifier
-    network = which_network(request, identifier)
+    network = which_network(request, identifier, snapshot)
 
     if network == 'IVAO':
         # Handle IVAO case (not implemented here)
         return JsonResponse({'error': 'IVAO not supported'}, status=400)
 
     elif network == 'VATSIM':
-        latitude, longitude = get_vatsim_user_location(request=request, vatsim_id=identifier)
+        latitude, longitude = get_vatsim_user_location(request=request, vatsim_id=identifier, snapshot=snapshot)
         if latitude is not None and longitude is not None:
             # Found the VATSIM user's location
             location_data = {
@@ -290,34 +385,20 @@ def user_location(request, type):
         # Handle case where network is neither IVAO nor VATSIM
         return JsonResponse({'error': 'Unknown network'}, status=400)
     
-async def fetch_and_save_inbound_flights():
-    '''Fetches flight plans of online VATSIM members and saves them to the database.'''
-    online_members_url = 'https://api.vatsim.net/v2/members/online'
-    async with aiohttp.ClientSession() as session:
-        async with session.get(online_members_url) as response:
-            if response.status == 200:
-                online_members = await response.json()
-
-                count_members = len(online_members)
-                tasks = [fetch_flight_plan(session, member['id'], index + 1, count_members) for index, member in enumerate(online_members)]
-
-                flight_plans = await asyncio.gather(*tasks)
-
-                for plan in flight_plans:
-                    if plan:
-                        await save_flight_plan_to_db(plan)
-                print("Flight plans updated in the database.")
-
 def inbound_flights(request):
-    asyncio.run(fetch_and_save_inbound_flights())
-    return JsonResponse({'status': 'Flight plans updated in the database.'})
+    '''Starts a background harvest of inbound flight plans and returns the statistics of the last completed run.'''
+    started = start_inbound_flight_harvest()
+    return JsonResponse({
+        'status': 'Flight plan harvest started.' if started else 'Flight plan harvest already running.',
+        'last_run': harvest_state['last_run'],
+    }, status=202)
 
 
-def which_network(request, network_id):
+def which_network(request, network_id, snapshot=None, ivao_snapshot=None):
     network_id = int(network_id)
-    if is_vatsim_id(request, network_id):
+    if is_vatsim_id(request, network_id, snapshot):
         return 'VATSIM'
-    elif is_ivao_id(request, network_id):
+    elif is_ivao_id(request, network_id, ivao_snapshot):
         return 'IVAO'
     else:
         return JsonResponse({'error': 'Invalid network ID'}, status=400)
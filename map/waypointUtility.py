@@ -0,0 +1,323 @@
+import csv
+import math
+import os
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+EARTH_RADIUS_KM = 6371
+# Size in degrees of the buckets of the spatial waypoint grid
+WAYPOINT_GRID_DEG = 1
+# Seconds between checks of the waypoint file for changes
+WAYPOINT_RELOAD_CHECK_SECONDS = 5
+# Below this zoom level tiles are thinned to one fix per bucket of a TILE_BUCKETS x TILE_BUCKETS raster
+TILE_FULL_ZOOM = 9
+TILE_BUCKETS = 32
+# Web Mercator tiles stop short of the poles
+TILE_MAX_LATITUDE = 85.0511287798
+
+waypoint_index_state = {
+    'index': None,
+    'checked_at': 0,
+}
+# Only one thread at a time loads the waypoint file
+waypoint_index_lock = threading.Lock()
+
+
+def waypoint_data_path():
+    return os.path.join(settings.STATIC_ROOT, 'data', 'waypoint_data.csv')
+
+
+def unit_vectors(latitude, longitude):
+    '''Returns positions in degrees as unit vectors on the sphere, one row per position.'''
+    latitude = np.radians(latitude)
+    longitude = np.radians(longitude)
+    cos_latitude = np.cos(latitude)
+    return np.column_stack((cos_latitude * np.cos(longitude), cos_latitude * np.sin(longitude), np.sin(latitude)))
+
+
+def wrap_column(column):
+    '''Wraps grid bucket columns across the antimeridian, so longitude 180 shares a bucket with -180.'''
+    buckets = 360 // WAYPOINT_GRID_DEG
+    return (column + buckets // 2) % buckets - buckets // 2
+
+
+def tile_longitude(x, tiles):
+    '''Returns the western longitude of tile column x out of tiles columns.'''
+    return x / tiles * 360 - 180
+
+
+def tile_latitude(y, tiles):
+    '''Returns the northern latitude of tile row y out of tiles rows.'''
+    return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / tiles))))
+
+
+def mercator_y(latitude):
+    '''Returns the Web Mercator y of latitudes in degrees, in radians.'''
+    latitude = np.radians(np.clip(latitude, -TILE_MAX_LATITUDE, TILE_MAX_LATITUDE))
+    return np.log(np.tan(np.pi / 4 + latitude / 2))
+
+
+class WaypointIndex:
+    '''
+    The waypoints of waypoint_data.csv held in memory as numpy columns.
+
+    The file lists a fix once per airway it is on, points are the distinct (name, position)
+    pairs among those rows. Points are looked up by name through a name -> point indexes
+    map, and by position through a grid whose buckets are contiguous slices of the points,
+    sorted by bucket. Distances are great-circle distances on the unit vectors.
+
+    The rows also make up the airway graph. Every airway's fixes are stored in sequence
+    order as one slice of airway_points, with (airway, name) -> offsets for the entry and
+    exit fixes, so expanding a segment is two dict lookups and a slice.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+        self.version = int(self.mtime)
+
+        point_ids = {}
+        names = []
+        latitudes = []
+        longitudes = []
+        airway_rows = []  # (airway, sequence, point) for every row
+        with open(path, newline='') as csvfile:
+            for row in csv.DictReader(csvfile):
+                key = (row['name'], row['latitude'], row['longitude'])
+                if key not in point_ids:
+                    point_ids[key] = len(names)
+                    names.append(row['name'])
+                    latitudes.append(float(row['latitude']))
+                    longitudes.append(float(row['longitude']))
+                # rand1 and rand2 hold the airway designator and the fix's sequence number along it
+                airway_rows.append((row['rand1'], int(row['rand2']), point_ids[key]))
+
+        latitude = np.array(latitudes)
+        longitude = np.array(longitudes)
+        rows = np.floor(latitude / WAYPOINT_GRID_DEG).astype(np.int32)
+        columns = wrap_column(np.floor(longitude / WAYPOINT_GRID_DEG).astype(np.int32))
+        # Points sorted by grid bucket, so every bucket is one slice of the columns
+        order = np.lexsort((columns, rows))
+        self.names = np.array(names, dtype=object)[order]
+        self.latitude = latitude[order]
+        self.longitude = longitude[order]
+        self.vectors = unit_vectors(self.latitude, self.longitude)
+
+        cells = np.column_stack((rows[order], columns[order]))
+        starts = np.flatnonzero(np.any(np.diff(cells, axis=0) != 0, axis=1)) + 1
+        bounds = np.concatenate(([0], starts, [len(order)]))
+        self.grid = {
+            (int(cells[start][0]), int(cells[start][1])): (int(start), int(stop))
+            for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start
+        }
+
+        by_name = {}
+        for point, name in enumerate(self.names):
+            by_name.setdefault(name, []).append(point)
+        self.by_name = {name: np.array(points, dtype=np.int64) for name, points in by_name.items()}
+
+        # The first point listed under each name, in file order, for the all-waypoints endpoint
+        sorted_position = np.empty_like(order)
+        sorted_position[order] = np.arange(len(order))
+        first_points = {}
+        for point, name in enumerate(names):
+            first_points.setdefault(name, int(sorted_position[point]))
+        self.first_points = list(first_points.values())
+
+        airway_rows.sort()
+        self.airway_points = sorted_position[np.array([point for _, _, point in airway_rows], dtype=np.int64)].astype(np.int32)
+        # Fixes on more airways matter more and win when a tile is thinned
+        self.airway_counts = np.bincount(self.airway_points, minlength=len(order))
+        self.airways = {}  # airway -> (start, stop) in airway_points
+        self.airway_fixes = {}  # (airway, name) -> offsets in airway_points
+        for offset, (airway, _, point) in enumerate(airway_rows):
+            start, _ = self.airways.get(airway, (offset, offset))
+            self.airways[airway] = (start, offset + 1)
+            self.airway_fixes.setdefault((airway, names[point]), []).append(offset)
+
+    def __len__(self):
+        return len(self.names)
+
+    def point(self, index):
+        '''Returns one point as the dict the waypoint endpoints send.'''
+        return {'name': self.names[index], 'latitude': float(self.latitude[index]), 'longitude': float(self.longitude[index])}
+
+    def candidates(self, name):
+        '''Returns the indexes of every point with the given name.'''
+        return self.by_name.get(name, np.empty(0, dtype=np.int64))
+
+    def nearest(self, name, latitude, longitude):
+        '''Returns the index of the point with the given name closest to a position, or None if there is none.'''
+        points = self.candidates(name)
+        if len(points) == 0:
+            return None
+        if len(points) == 1:
+            return int(points[0])
+        # The closest point on the sphere has the largest dot product with the reference
+        target = unit_vectors(latitude, longitude)[0]
+        return int(points[np.argmax(self.vectors[points] @ target)])
+
+    def airway_segment(self, airway, entry, exit):
+        '''
+        Returns the point indexes flown along airway from the entry fix to the exit fix, both included.
+
+        Returns None if the airway is unknown or does not pass both fixes. Airways that pass
+        a fix twice use the shortest stretch between the two.
+        '''
+        entries = self.airway_fixes.get((airway, entry))
+        exits = self.airway_fixes.get((airway, exit))
+        if not entries or not exits:
+            return None
+        start, stop = min(((start, stop) for start in entries for stop in exits if start != stop), key=lambda pair: abs(pair[0] - pair[1]), default=(None, None))
+        if start is None:
+            return None
+        if start < stop:
+            return self.airway_points[start:stop + 1]
+        return self.airway_points[stop:start + 1][::-1]
+
+    def in_box(self, south, west, north, east):
+        '''Returns the indexes of the points inside a latitude and longitude box, with -180 <= west < east <= 180.'''
+        rows = range(int(math.floor(south / WAYPOINT_GRID_DEG)), int(math.floor(north / WAYPOINT_GRID_DEG)) + 1)
+        columns = range(int(math.floor(west / WAYPOINT_GRID_DEG)), int(math.floor(east / WAYPOINT_GRID_DEG)) + 1)
+        slices = [self.grid[(row, column)] for row in rows for column in columns if (row, column) in self.grid]
+        if not slices:
+            return np.empty(0, dtype=np.int64)
+        points = np.concatenate([np.arange(start, stop) for start, stop in slices])
+        latitude = self.latitude[points]
+        # Longitude 180 is kept in the -180 buckets, see wrap_column
+        longitude = self.longitude[points]
+        longitude = np.where(longitude >= 180, longitude - 360, longitude)
+        return points[(latitude >= south) & (latitude < north) & (longitude >= west) & (longitude < east)]
+
+    def tile(self, z, x, y):
+        '''
+        Returns the indexes of the points inside Web Mercator tile z/x/y, thinned by zoom level.
+
+        Up to TILE_FULL_ZOOM the tile is split into TILE_BUCKETS x TILE_BUCKETS buckets and
+        only the fix on the most airways kept in each, so a tile never holds more than
+        TILE_BUCKETS ** 2 fixes however much of the world it covers. From there every fix is kept.
+        '''
+        tiles = 2 ** z
+        west, east = tile_longitude(x, tiles), tile_longitude(x + 1, tiles)
+        north, south = tile_latitude(y, tiles), tile_latitude(y + 1, tiles)
+        # The first and last rows of tiles take in the polar caps Mercator leaves out
+        if y == tiles - 1:
+            south = -90.0
+        if y == 0:
+            north = 90.0
+        points = self.in_box(south, west, north, east)
+        if z >= TILE_FULL_ZOOM or len(points) <= 1:
+            return points
+
+        # Buckets split the tile evenly in longitude and in Mercator y, the way it is drawn
+        mercator = mercator_y(self.latitude[points])
+        top, bottom = mercator_y(np.array([min(north, TILE_MAX_LATITUDE), max(south, -TILE_MAX_LATITUDE)]))
+        row = np.clip(((top - mercator) / (top - bottom) * TILE_BUCKETS).astype(np.int64), 0, TILE_BUCKETS - 1)
+        column = np.clip(((self.longitude[points] - west) / (east - west) * TILE_BUCKETS).astype(np.int64), 0, TILE_BUCKETS - 1)
+        bucket = row * TILE_BUCKETS + column
+        order = np.lexsort((-self.airway_counts[points], bucket))
+        _, first = np.unique(bucket[order], return_index=True)
+        return points[order[first]]
+
+
+def nearest_chain(latitude, longitude, counts, start=None):
+    '''
+    Picks one candidate per route position, each the candidate closest to the one picked before it.
+
+    The candidates of all positions come as flat latitude and longitude arrays, counts
+    tells how many belong to each position in route order. start is the (latitude, longitude)
+    the route leaves from, without it the first position takes its first candidate.
+    Every pair of candidates at consecutive positions is scored in one batched computation
+    and each candidate's closest successor kept, so walking the chain is only index lookups.
+    Returns the flat index of the candidate picked for every position.
+    '''
+    counts = np.asarray(counts, dtype=np.int64)
+    latitude = np.asarray(latitude, dtype=float)
+    longitude = np.asarray(longitude, dtype=float)
+    if start is not None:
+        # The start becomes a first position with a single candidate
+        counts = np.concatenate(([1], counts))
+        latitude = np.concatenate(([start[0]], latitude))
+        longitude = np.concatenate(([start[1]], longitude))
+    if len(counts) == 0:
+        return np.empty(0, dtype=np.int64)
+
+    vectors = unit_vectors(latitude, longitude)
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+    position = np.repeat(np.arange(len(counts)), counts)
+
+    # Every candidate paired with every candidate of the next position
+    left = np.flatnonzero(position < len(counts) - 1)
+    successors = counts[position[left] + 1]
+    left = np.repeat(left, successors)
+    first_pair = np.repeat(np.cumsum(successors) - successors, successors)
+    right = offsets[position[left] + 1] + np.arange(len(left)) - first_pair
+    # The closest successor on the sphere has the largest dot product
+    scores = np.einsum('ij,ij->i', vectors[left], vectors[right])
+    order = np.lexsort((-scores, left))
+    _, best = np.unique(left[order], return_index=True)
+    best_next = np.full(len(position), -1, dtype=np.int64)
+    best_next[left[order][best]] = right[order][best]
+
+    chosen = np.empty(len(counts), dtype=np.int64)
+    chosen[0] = 0
+    for route_position in range(1, len(counts)):
+        chosen[route_position] = best_next[chosen[route_position - 1]]
+    if start is not None:
+        return chosen[1:] - 1
+    return chosen
+
+
+def expand_airways(tokens):
+    '''
+    Replaces every airway between two fixes in a list of route tokens with the fixes flown along it.
+
+    Returns (ident, point) pairs in route order. point is the WaypointIndex index of fixes
+    placed by an airway and None for tokens the airway graph says nothing about, which
+    are left for the caller to resolve.
+    '''
+    index = get_waypoint_index()
+    expanded = []
+    skip_exit = False
+    for position, token in enumerate(tokens):
+        if skip_exit:
+            skip_exit = False
+            continue
+        segment = None
+        if 0 < position < len(tokens) - 1 and token in index.airways:
+            segment = index.airway_segment(token, tokens[position - 1], tokens[position + 1])
+        if segment is None:
+            expanded.append((token, None))
+            continue
+        # The entry fix is already in the list, the airway tells which of the fixes with that name it is
+        if expanded and expanded[-1][0] == tokens[position - 1]:
+            expanded[-1] = (tokens[position - 1], int(segment[0]))
+        expanded.extend((index.names[point], int(point)) for point in segment[1:])
+        # The exit fix was added with the segment
+        skip_exit = True
+    return expanded
+
+
+def get_waypoint_index():
+    '''
+    Returns the shared WaypointIndex, loading it on first use.
+
+    The file's modification time is checked at most every WAYPOINT_RELOAD_CHECK_SECONDS
+    and the index rebuilt when it changed, so a new waypoint file is picked up without a restart.
+    '''
+    index = waypoint_index_state['index']
+    if index is not None and time.time() - waypoint_index_state['checked_at'] < WAYPOINT_RELOAD_CHECK_SECONDS:
+        return index
+
+    with waypoint_index_lock:
+        index = waypoint_index_state['index']
+        path = waypoint_data_path()
+        if index is None or index.path != path or os.path.getmtime(path) != index.mtime:
+            load_start = time.perf_counter()
+            index = waypoint_index_state['index'] = WaypointIndex(path)
+            print(f"Loaded {len(index)} waypoints in {(time.perf_counter() - load_start) * 1000:.0f} ms.")
+        waypoint_index_state['checked_at'] = time.time()
+    return index
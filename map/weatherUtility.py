@@ -7,15 +7,11 @@ import shutil
 from django.http import HttpResponse, JsonResponse
 from map.mathUtility import haversine, convert_inhg_to_mb
 from map.models import Airport
-# Initial headers setup
-user_agent = 'SimTrail/1.0 (SimTrail; https://simtrail.com/)'
-headers = {
-    'User-Agent': user_agent
-}
+from map.networkUtility import AVIATIONWEATHER_URL, headers
 
 def fetch_metars(request):
     # Get the METAR data from the Aviation Weather Center
-    zip_file_url = 'https://aviationweather.gov/data/cache/metars.cache.csv.gz'
+    zip_file_url = f'{AVIATIONWEATHER_URL}/data/cache/metars.cache.csv.gz'
     temp_zip_path = 'temp_metars.zip'
     file_path_metars = os.path.join(settings.STATIC_ROOT, 'data', 'metars.csv')
     try:
@@ -36,7 +32,7 @@ def fetch_metars(request):
         os.remove(temp_zip_path)
 
         # Get Tafs from the same source
-        zip_file_url = 'https://aviationweather.gov/data/cache/tafs.cache.csv.gz'
+        zip_file_url = f'{AVIATIONWEATHER_URL}/data/cache/tafs.cache.csv.gz'
         temp_zip_path = 'temp_tafs.zip'
         file_path_tafs = os.path.join(settings.STATIC_ROOT, 'data', 'tafs.csv')
 
@@ -0,0 +1,208 @@
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, HttpResponseNotModified
+
+from map.feedUtility import viewport_contains
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, clients are served gzip without it
+    brotli = None
+try:
+    import orjson
+except ImportError:  # orjson is optional, the standard library encoder is used without it
+    orjson = None
+
+# Compact binary encoding of pilot positions for the map's 15 second refresh.
+#
+# All values are little-endian. After a 24 byte header of six uint32 values
+# (magic, version, flags, pilot count, removed count, string table length)
+# come the columns, widest first so every typed array view stays aligned:
+#   ids uint32, altitude int32, latitude float32, longitude float32,
+#   removed ids uint32, remaining km int32, ETA uint32, cluster counts uint32,
+#   heading int16, groundspeed int16, percent complete int16 in tenths,
+# followed by a UTF-8 JSON string table {id: [callsign, name]} that only
+# holds pilots the client has not seen with their current callsign, and
+# {id: null} for removed pilots that went offline rather than out of view.
+# Pilots without a progress have remaining km and percent complete -1, and
+# an ETA of 0 when they have no ETA. Cluster counts, the number of pilots
+# each pilot stands for, are only present in decimated payloads.
+COLUMNAR_MAGIC = 0x534F5053  # 'SPOS'
+COLUMNAR_CONTENT_TYPE = 'application/octet-stream'
+
+FLAG_FULL = 1
+FLAG_DECIMATED = 2
+
+# Serialized snapshot responses kept per (endpoint, query string), an entry is reused while its version is current
+PREPARED_RESPONSE_LIMIT = 256
+# Bodies smaller than this are not worth compressing
+COMPRESS_MIN_BYTES = 512
+prepared_responses = OrderedDict()
+prepared_responses_lock = threading.Lock()
+
+
+def wants_columnar(request):
+    '''Returns True if the client opted in to the binary position format.'''
+    return request.GET.get('format') == 'columnar'
+
+
+def pack_positions(payload, base=None):
+    '''
+    Packs a payload of Pilot records from delta_payload into the binary position format.
+
+    base holds the fingerprints the client already has for a delta, so callsigns
+    and names are only sent for pilots that are new or changed callsign.
+    '''
+    kept = [index for index, pilot in enumerate(payload['pilots']) if pilot.id is not None]
+    pilots = [payload['pilots'][index] for index in kept]
+    removed = payload.get('removed', [])
+
+    ids = np.fromiter((int(pilot.id) for pilot in pilots), dtype='<u4', count=len(pilots))
+    altitude = np.fromiter((pilot.altitude or 0 for pilot in pilots), dtype='<i4', count=len(pilots))
+    latitude = np.array([pilot.latitude for pilot in pilots], dtype='<f4')
+    longitude = np.array([pilot.longitude for pilot in pilots], dtype='<f4')
+    heading = np.fromiter((pilot.heading or 0 for pilot in pilots), dtype='<i2', count=len(pilots))
+    groundspeed = np.fromiter((pilot.groundspeed or 0 for pilot in pilots), dtype='<i2', count=len(pilots))
+    remaining_km = np.fromiter((pilot.progress['remaining_km'] if pilot.progress else -1 for pilot in pilots), dtype='<i4', count=len(pilots))
+    eta = np.fromiter(((pilot.progress['eta'] or 0) if pilot.progress else 0 for pilot in pilots), dtype='<u4', count=len(pilots))
+    percent_complete = np.fromiter(
+        (round(pilot.progress['percent_complete'] * 10) if pilot.progress else -1 for pilot in pilots), dtype='<i2', count=len(pilots)
+    )
+    # Decimated payloads tell how many pilots each kept pilot stands for
+    cluster_counts = np.array([payload['cluster_counts'][index] for index in kept] if payload.get('decimated') else [], dtype='<u4')
+
+    strings = {}
+    for pilot in pilots:
+        pilot_id = int(pilot.id)
+        known = base.get(pilot_id) if base is not None else None
+        # Fingerprints carry the callsign right after the position
+        if known is None or known[2] != pilot.callsign:
+            strings[pilot_id] = [pilot.callsign or '', pilot.name or '']
+    # Pilots that only left the viewport keep their strings, the client may see them again
+    for pilot_id in payload.get('offline', []):
+        strings[pilot_id] = None
+    string_table = json.dumps(strings, separators=(',', ':')).encode('utf-8')
+
+    flags = (FLAG_FULL if payload['full'] else 0) | (FLAG_DECIMATED if payload.get('decimated') else 0)
+    header = np.array([COLUMNAR_MAGIC, payload['version'], flags, len(pilots), len(removed), len(string_table)], dtype='<u4')
+
+    return b''.join((
+        header.tobytes(),
+        ids.tobytes(),
+        altitude.tobytes(),
+        latitude.tobytes(),
+        longitude.tobytes(),
+        np.array(removed, dtype='<u4').tobytes(),
+        remaining_km.tobytes(),
+        eta.tobytes(),
+        cluster_counts.tobytes(),
+        heading.tobytes(),
+        groundspeed.tobytes(),
+        percent_complete.tobytes(),
+        string_table,
+    ))
+
+
+def columnar_body(state, payload, viewport=None):
+    '''
+    Returns payload packed into the binary position format, sending names only for pilots the client does not know.
+
+    A client asking for a viewport only received the pilots inside it at since, so
+    pilots that were outside it then get their names like new pilots.
+    '''
+    base = state['history'].get(payload['since']) if not payload['full'] else None
+    if base is not None and viewport is not None:
+        base = {pilot_id: fingerprint for pilot_id, fingerprint in base.items() if viewport_contains(viewport, fingerprint[0], fingerprint[1])}
+    return pack_positions(payload, base)
+
+
+def encode_json(data):
+    '''Serializes data to compact UTF-8 JSON bytes, with orjson when it is installed.'''
+    if orjson is not None:
+        # Decimals, dates and the like are converted the same way JsonResponse converts them
+        return orjson.dumps(data, default=DjangoJSONEncoder().default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, separators=(',', ':'), cls=DjangoJSONEncoder).encode('utf-8')
+
+
+def preferred_encoding(request):
+    '''Returns 'br' or 'gzip' if the client accepts it, preferring brotli, or None for an uncompressed body.'''
+    accepted = request.headers.get('Accept-Encoding', '')
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+def compress(body, encoding):
+    '''Compresses a body with the given content encoding.'''
+    if encoding == 'br':
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+
+def prepared_entry(name, query, version, build):
+    '''
+    Returns the cached bodies of an endpoint for a query string at the given data version, keyed by content encoding.
+
+    build returns the uncompressed body as bytes, stored under None, and only runs when the version changed.
+    '''
+    key = (name, query)
+    with prepared_responses_lock:
+        entry = prepared_responses.get(key)
+    if entry is None or entry['version'] != version:
+        # Built outside the lock, two requests racing on a new version only cost a duplicate build
+        entry = {'version': version, None: build()}
+        with prepared_responses_lock:
+            prepared_responses[key] = entry
+            prepared_responses.move_to_end(key)
+            while len(prepared_responses) > PREPARED_RESPONSE_LIMIT:
+                prepared_responses.popitem(last=False)
+    return entry
+
+
+def prepared_response(request, name, version, build, content_type='application/json', headers=None, query=None):
+    '''
+    Returns the response of an endpoint for this request's query string at the given data version.
+
+    build returns the body as bytes and runs once per version and query, each compressed
+    variant is made the first time a client asks for it. The strong ETag is tied to the
+    version, so clients that already hold it get a 304 without anything being serialized.
+    headers are set per request on top of the cached body, for metadata that changes between versions.
+    query replaces the query string as the cache key, for endpoints whose parameters are in the path.
+    '''
+    if query is None:
+        query = request.GET.urlencode()
+    encoding = preferred_encoding(request)
+    etag = '"%s-%s-%s%s"' % (name, version, hashlib.md5(query.encode('utf-8')).hexdigest()[:12], f'-{encoding}' if encoding else '')
+
+    if etag in [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]:
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        for header, value in (headers or {}).items():
+            response[header] = value
+        return response
+
+    entry = prepared_entry(name, query, version, build)
+    if len(entry[None]) < COMPRESS_MIN_BYTES:
+        encoding = None
+    body = entry.get(encoding)
+    if body is None:
+        body = entry[encoding] = compress(entry[None], encoding)
+
+    response = HttpResponse(body, content_type=content_type)
+    response['ETag'] = etag
+    response['Vary'] = 'Accept-Encoding'
+    # Clients may keep the body but must check the ETag before reusing it
+    response['Cache-Control'] = 'no-cache'
+    if encoding:
+        response['Content-Encoding'] = encoding
+    for header, value in (headers or {}).items():
+        response[header] = value
+    return response
@@ -209,7 +209,11 @@ function continuouslyFollowAircraft() {
 // Update this to your existing interval, or create a new one
 setInterval(continuouslyFollowAircraft, 1000); 
 // Assuming `map` is your Mapbox GL JS map instance
-setInterval(updateAircraftPositions, 1000);
+// Telemetry is pushed by the live stream, poll every second while it is down and slowly while it is open
+setInterval(() => {
+  if (livePollDue('fleet')) updateAircraftPositions();
+}, 1000);
+onLiveUpdate('fleet', data => updateMarkers(data.flights));
 map.on('rotate', () => {
   Object.keys(aircraftMarkers).forEach(flight_number => {
     const markerObj = aircraftMarkers[flight_number];
@@ -105,7 +105,7 @@ function fetchAirportDetails(airportIdent) {
                               <small>${arrival.departureTime}</small>
                           </div>
                           <div class="flex-1 mx-4 bg-gray-200 rounded-full h-2.5">
-                              <div class="bg-blue-600 h-2.5 rounded-full" style="width: ${100 - arrival.distanceRemaining}%"></div>
+                              <div class="bg-blue-600 h-2.5 rounded-full" style="width: ${100 - (arrival.distanceRemaining ?? 100)}%"></div>
                           </div>
                           <div class="relative">
                               <small class="absolute top-[-10px]">${arrival.arrival}</small>
@@ -158,7 +158,7 @@ function fetchAirportDetails(airportIdent) {
                             <!-- Progress bar container -->
                             <div class="flex-1 mx-4 bg-gray-200 rounded-full h-2.5">
                                 <!-- Progress indicator -->
-                                <div class="bg-blue-600 h-2.5 rounded-full" style="width: ${100 - departure.distanceRemaining}%"></div>
+                                <div class="bg-blue-600 h-2.5 rounded-full" style="width: ${100 - (departure.distanceRemaining ?? 100)}%"></div>
                             </div>
                             <div class="relative">
                                 <small class="absolute top-[-10px]">${departure.arrival}</small>
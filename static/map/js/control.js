@@ -9,28 +9,36 @@ fetch(`${staticBaseUrl}layers/vatsim_atc.geojson`) // Adjust path as needed
 
 let activeControllers = []; // To track currently active controllers
 
-function fetchControllerData() {
-    fetch('/map/api/controllers/')
-        .then(response => response.json())
-        .then(data => {
-            const controllers = data.controllers;
-            const ctrControllers = controllers.filter(controller =>
-                controller.type === "CTR" || controller.type === "FSS");
+function applyControllerData(data) {
+    // The sector outlines may still be loading
+    if (!geojsonData) return;
 
-            // Prepare to filter features within the current map view
-            const viewportBounds = map.getBounds();
+    const controllers = data.controllers;
+    const ctrControllers = controllers.filter(controller =>
+        controller.type === "CTR" || controller.type === "FSS");
 
-            // Filter and update based on viewport
-            const filteredFeatures = geojsonData.features.filter(feature =>
-                ctrControllers.some(controller => controller.geoname ? controller.geoname === feature.properties.id :
-                    controller.ident === feature.properties.id));
+    // Prepare to filter features within the current map view
+    const viewportBounds = map.getBounds();
 
-            updateMapWithFilteredData(filteredFeatures, viewportBounds);
-            updateActiveControllersList(ctrControllers);
-        })
+    // Filter and update based on viewport
+    const filteredFeatures = geojsonData.features.filter(feature =>
+        ctrControllers.some(controller => controller.geoname ? controller.geoname === feature.properties.id :
+            controller.ident === feature.properties.id));
+
+    updateMapWithFilteredData(filteredFeatures, viewportBounds);
+    updateActiveControllersList(ctrControllers);
+}
+
+function fetchControllerData() {
+    fetch('/map/api/controllers/')
+        .then(response => response.json())
+        .then(applyControllerData)
         .catch(err => console.error('Error fetching ATC controller data:', err));
 }
 
+// Controller changes pushed by the live stream
+onLiveUpdate('controllers', applyControllerData);
+
 function isFeatureInView(feature, bounds) {
     // Assuming the feature is a Polygon or MultiPolygon
     let coordinates = [];
@@ -94,7 +102,10 @@ function updateMapWithFilteredData(filteredFeatures, viewportBounds) {
 
 map.on('load', function() {
     fetchControllerData(); // Initial fetch of controller data
-    setInterval(fetchControllerData, 10000); // Continuously update every 10 seconds
+    // Poll every 10 seconds while the live stream is down, slowly while it is open
+    setInterval(() => {
+        if (livePollDue('controllers')) fetchControllerData();
+    }, 10000);
 
     // Add a 'moveend' event listener to refresh data based on the new viewport
     map.on('moveend', function() {
@@ -0,0 +1,73 @@
+// One server-sent event stream per tab pushes pilots, controllers and fleet telemetry as soon as they change.
+// Layers register with onLiveUpdate and gate their polling timers on livePollDue: full rate while the stream
+// is down, and a slow poll while it is open, since a worker only pushes the changes it saw itself.
+
+// Milliseconds between the polls each layer keeps running while the stream is open
+const LIVE_FALLBACK_POLL_MS = 60000;
+
+const liveStream = {
+    source: null,
+    viewportQuery: null,
+    connected: false,
+    disabled: false, // Set when the server does not offer the stream, polling is used instead
+    listeners: {}, // topic -> callbacks
+    lastPolled: {} // layer -> time of its last poll
+};
+
+// Registers a callback for a topic ('vatsim', 'ivao', 'controllers' or 'fleet')
+function onLiveUpdate(topic, callback) {
+    if (!liveStream.listeners[topic]) {
+        liveStream.listeners[topic] = [];
+    }
+    liveStream.listeners[topic].push(callback);
+}
+
+// True when a layer's polling timer should fetch now, every tick while the stream is down and every LIVE_FALLBACK_POLL_MS while it is open
+function livePollDue(layer) {
+    const now = Date.now();
+    if (liveStream.connected && now - (liveStream.lastPolled[layer] || 0) < LIVE_FALLBACK_POLL_MS) {
+        return false;
+    }
+    liveStream.lastPolled[layer] = now;
+    return true;
+}
+
+// Opens the stream for the given viewport, reconnecting only when the viewport changed
+function connectLiveStream(viewportQuery) {
+    if (!window.EventSource || liveStream.disabled) {
+        return false;
+    }
+    if (liveStream.source && liveStream.viewportQuery === viewportQuery) {
+        return true;
+    }
+    if (liveStream.source) {
+        liveStream.source.close();
+    }
+
+    // A new connection starts from full payloads for the new viewport
+    const source = new EventSource(`/map/api/live/?topics=vatsim,ivao,controllers,fleet&${viewportQuery}`);
+    liveStream.source = source;
+    liveStream.viewportQuery = viewportQuery;
+
+    let opened = false;
+    source.onopen = function() {
+        opened = true;
+        liveStream.connected = true;
+    };
+    source.onerror = function() {
+        // The browser reconnects on its own unless the server turned the stream down
+        liveStream.connected = false;
+        if (source.readyState === EventSource.CLOSED) {
+            liveStream.source = null;
+            liveStream.disabled = !opened;
+        }
+    };
+    ['vatsim', 'ivao', 'controllers', 'fleet'].forEach(topic => {
+        source.addEventListener(topic, function(e) {
+            liveStream.connected = true;
+            const data = JSON.parse(e.data);
+            (liveStream.listeners[topic] || []).forEach(callback => callback(data));
+        });
+    });
+    return true;
+}
@@ -14,6 +14,10 @@ let currentSelectedPilotId = null; // Tracks the currently selected VATSIM user
 
 const vatsimWaypointMarkers = []; // Track waypoint markers for removal
 
+// Last snapshot version received from each network when fetching without the worker
+const pilotVersions = { vatsim: 0, ivao: 0 };
+let lastPilotViewportQuery = null;
+
 
 
 
@@ -41,18 +45,51 @@ function getCookie(name) {
 
 
 
+// Returns the visible map bounds and zoom in the shape the pilot endpoints expect
+function getPilotViewport() {
+    const bounds = map.getBounds();
+    return {
+        north: bounds.getNorth(),
+        south: bounds.getSouth(),
+        east: bounds.getEast(),
+        west: bounds.getWest(),
+        zoom: map.getZoom()
+    };
+}
+
+// Returns the viewport as the query string the pilot endpoints and the live stream take
+function pilotViewportQuery(viewport) {
+    return `northBound=${viewport.north}&southBound=${viewport.south}&eastBound=${viewport.east}&westBound=${viewport.west}&zoom=${viewport.zoom}`;
+}
+
 function fetchAndUpdatePilotsDirectly() {
+    const viewport = getPilotViewport();
+    const viewportQuery = pilotViewportQuery(viewport);
+    // Deltas are only valid for the viewport they were fetched for
+    if (viewportQuery !== lastPilotViewportQuery) {
+        pilotVersions.vatsim = 0;
+        pilotVersions.ivao = 0;
+        lastPilotViewportQuery = viewportQuery;
+    }
+
     // Define both fetch requests
-    const fetchVATSIM = fetch('/map/api/vatsim_network/').then(response => response.json());
-    const fetchIVAO = fetch('/map/api/ivao_network/').then(response => response.json());
+    const fetchVATSIM = fetch(`/map/api/vatsim_network/?since=${pilotVersions.vatsim}&${viewportQuery}`).then(response => response.json());
+    const fetchIVAO = fetch(`/map/api/ivao_network/?since=${pilotVersions.ivao}&${viewportQuery}`).then(response => response.json());
 
     // Use Promise.all to wait for both requests to complete
     Promise.all([fetchVATSIM, fetchIVAO])
         .then(data => {
+            pilotVersions.vatsim = data[0].version || 0;
+            pilotVersions.ivao = data[1].version || 0;
+
             // Combine the pilots data into a single object with vatsimPilots and ivaoPilots properties
             const combinedPilotsData = {
-                vatsimPilots: data[0].pilots,
-                ivaoPilots: data[1].pilots,
+                vatsimPilots: data[0].pilots || [],
+                ivaoPilots: data[1].pilots || [],
+                vatsimRemoved: data[0].removed || [],
+                ivaoRemoved: data[1].removed || [],
+                vatsimFull: data[0].full !== false,
+                ivaoFull: data[1].full !== false
             };
 
             // Update the map with the combined pilots data
@@ -61,8 +98,26 @@ function fetchAndUpdatePilotsDirectly() {
         .catch(err => console.error('Error fetching data from VATSIM or IVAO:', err));
 }
 
+// Removes every pilot of a network, used before applying a full payload
+function removeNetworkPilots(network) {
+    Object.keys(vatsimGeoJSON).forEach(pilotId => {
+        if (vatsimGeoJSON[pilotId].properties.network === network) {
+            delete vatsimGeoJSON[pilotId];
+        }
+    });
+}
+
 // Function to update the map with pilots' data
 function updateMapWithPilots(data) {
+    // A full payload replaces the network, a delta lists disconnected pilots as tombstones
+    if (data.vatsimFull) {
+        removeNetworkPilots('VATSIM');
+    }
+    if (data.ivaoFull) {
+        removeNetworkPilots('IVAO');
+    }
+    (data.vatsimRemoved || []).forEach(cid => delete vatsimGeoJSON[`pilot-${cid}`]);
+    (data.ivaoRemoved || []).forEach(userId => delete vatsimGeoJSON[`pilot-${userId}`]);
 
     // Process VATSIM pilots
     data.vatsimPilots.forEach(pilot => {
@@ -75,6 +130,9 @@ function updateMapWithPilots(data) {
         // Adapt for IVAO's different structure
         updatePilot(pilot, 'ivao');
     });
+
+    // Push the whole batch to the map source once
+    updateMapSource();
 }
 
 // Function to handle individual pilot update or addition
@@ -102,7 +160,11 @@ function updatePilot(pilot, source) {
             altitude: pilot.altitude,
             callsign: callsign,
             network: network,
-            heading: getTrueHeading(pilot.heading) // Assuming this function is defined elsewhere
+            heading: getTrueHeading(pilot.heading), // Assuming this function is defined elsewhere
+            // Computed by the server with each feed snapshot, absent without a known departure and arrival
+            percentComplete: pilot.progress ? pilot.progress.percent_complete : null,
+            remainingKm: pilot.progress ? pilot.progress.remaining_km : null,
+            eta: pilot.progress ? pilot.progress.eta : null
         }
     };
 
@@ -114,9 +176,15 @@ function updatePilot(pilot, source) {
 
     // Update or add the feature in vatsimGeoJSON object
     vatsimGeoJSON[pilotId] = feature;
+}
 
-    // Ensure the map source and layer are updated with the latest features
-    updateMapSource();
+// Returns the progress line of a pilot popup, empty when the server had no progress for the flight
+function progressPopupContent(properties) {
+    if (properties.percentComplete === null || properties.percentComplete === undefined) {
+        return '';
+    }
+    const eta = properties.eta ? ` · ETA ${new Date(properties.eta * 1000).toISOString().substring(11, 16)}Z` : '';
+    return `<p><strong>Progress:</strong> ${Math.round(properties.percentComplete)}% · ${properties.remainingKm} km to go${eta}</p>`;
 }
 
 // Ensure this function generates the popup content correctly
@@ -128,6 +196,7 @@ function generatePopupContent(properties) {
         <p><strong>Altitude:</strong> ${properties.altitude} feet</p>
         <p><strong>Groundspeed:</strong> ${properties.groundspeed} knots</p>
         <p><strong>Heading:</strong> ${properties.heading}°</p>
+        ${progressPopupContent(properties)}
         <hr>
         <p><strong>Network:</strong> ${properties.network}</p>
     `;
@@ -190,18 +259,42 @@ if (window.Worker) {
 
     // Modify updatePilots to send message to worker
     function updatePilots() {
-        let currentBounds = map.getBounds().toArray();
-        // Logic to expand the bounds and request updates goes here...
-        vatsimWorker.postMessage({ action: 'updatePilots', /* additional data */ });
+        const viewport = getPilotViewport();
+        // The live stream pushes pilots for the viewport, the worker polls at full rate only while it is down
+        connectLiveStream(pilotViewportQuery(viewport));
+        if (livePollDue('pilots')) {
+            vatsimWorker.postMessage({ action: 'updatePilots', mapBounds: viewport });
+        }
     }
 } else {
     console.log('Web Workers are not supported in your browser.');
     // Use the direct fetch and update method as a fallback
     function updatePilots() {
-        fetchAndUpdatePilotsDirectly();
+        connectLiveStream(pilotViewportQuery(getPilotViewport()));
+        if (livePollDue('pilots')) {
+            fetchAndUpdatePilotsDirectly();
+        }
     }
 }
 
+// Pilots pushed by the live stream, each event carries one network
+onLiveUpdate('vatsim', payload => updateMapWithPilots({
+    vatsimPilots: payload.pilots || [],
+    ivaoPilots: [],
+    vatsimRemoved: payload.removed || [],
+    ivaoRemoved: [],
+    vatsimFull: payload.full !== false,
+    ivaoFull: false
+}));
+onLiveUpdate('ivao', payload => updateMapWithPilots({
+    vatsimPilots: [],
+    ivaoPilots: payload.pilots || [],
+    vatsimRemoved: [],
+    ivaoRemoved: payload.removed || [],
+    vatsimFull: false,
+    ivaoFull: payload.full !== false
+}));
+
 
 const iconId = 'airplane-icon'; 
 const imageUrl = '/static/images/location-arrow-vatsim.png'; 
@@ -228,10 +321,10 @@ map.on('click', 'vatsim-markers', function(e) {
     const vatsimId = pilotId.replace('pilot-', ''); // Extract VATSIM ID from the pilot ID
 
     // Fetch flight plan waypoints for the clicked VATSIM player
-    fetch(`api/construct_route/${vatsimId}`)
+    fetch(`api/construct_route/${vatsimId}/?zoom=${Math.floor(map.getZoom())}`)
         .then(response => response.json())
         .then(data => {
-            drawFlightPlan(data.waypoints);
+            drawFlightPlan(data.waypoints, data.path);
         })
         .catch(error => console.error('Error fetching flight plan waypoints:', error));
 
@@ -270,13 +363,14 @@ function removeFlightRoute() {
 
 
 
-function drawFlightPlan(waypoints) {
+// path is the great-circle line the server simplified for the current zoom, the waypoints are joined directly without it
+function drawFlightPlan(waypoints, path) {
     const route = {
         'type': 'Feature',
         'properties': {},
         'geometry': {
             'type': 'LineString',
-            'coordinates': waypoints.map(wp => [wp.longitude_deg, wp.latitude_deg])
+            'coordinates': path || waypoints.map(wp => [wp.longitude_deg, wp.latitude_deg])
         }
     };
 
@@ -347,6 +441,7 @@ function generatePopupContent(pilot) {
         <p><strong>Altitude:</strong> ${pilot.altitude} feet</p>
         <p><strong>Groundspeed:</strong> ${pilot.groundspeed} knots</p>
         <p><strong>Heading:</strong> ${pilot.heading}°</p>
+        ${progressPopupContent(pilot)}
         <hr>
         <p><strong>Network:</strong> ${pilot.network}</p>
         
@@ -372,6 +467,13 @@ document.addEventListener('DOMContentLoaded', function() {
         // Update pilots every 15 seconds
         setInterval(updatePilots, 15000);
 
+        // Pilots are fetched for the visible area only, so refresh when the view changes
+        map.on('moveend', function() {
+            if (map.hasImage(iconId)) {
+                updatePilots();
+            }
+        });
+
 
 
         map.on('load', function() {
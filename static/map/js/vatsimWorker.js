@@ -1,25 +1,120 @@
+// Last snapshot version received from each network; the server only sends what changed since then
+const versions = { vatsim: 0, ivao: 0 };
+// Viewport the versions above were fetched for, deltas are only valid for the same viewport
+let lastViewportQuery = null;
+// Callsign and name per pilot ID, the binary position format only resends them when they change
+const stringTables = { vatsim: {}, ivao: {} };
+
+const COLUMNAR_MAGIC = 0x534F5053;
+const FLAG_FULL = 1;
+const FLAG_DECIMATED = 2;
+
+// Decodes the binary position format served with format=columnar (see map/wireUtility.py)
+function decodePositions(buffer, network) {
+    const [magic, version, flags, count, removedCount, stringsLength] = new Uint32Array(buffer, 0, 6);
+    if (magic !== COLUMNAR_MAGIC) {
+        throw new Error('Unexpected pilot position payload');
+    }
+
+    let offset = 24;
+    const ids = new Uint32Array(buffer, offset, count); offset += 4 * count;
+    const altitude = new Int32Array(buffer, offset, count); offset += 4 * count;
+    const latitude = new Float32Array(buffer, offset, count); offset += 4 * count;
+    const longitude = new Float32Array(buffer, offset, count); offset += 4 * count;
+    const removed = Array.from(new Uint32Array(buffer, offset, removedCount)); offset += 4 * removedCount;
+    const remainingKm = new Int32Array(buffer, offset, count); offset += 4 * count;
+    const eta = new Uint32Array(buffer, offset, count); offset += 4 * count;
+    const clusterCount = (flags & FLAG_DECIMATED) !== 0 ? count : 0;
+    const clusterCounts = new Uint32Array(buffer, offset, clusterCount); offset += 4 * clusterCount;
+    const heading = new Int16Array(buffer, offset, count); offset += 2 * count;
+    const groundspeed = new Int16Array(buffer, offset, count); offset += 2 * count;
+    const percentComplete = new Int16Array(buffer, offset, count); offset += 2 * count;
+    const strings = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, offset, stringsLength)));
+
+    const full = (flags & FLAG_FULL) !== 0;
+    if (full) {
+        stringTables[network] = {};
+    }
+    const table = stringTables[network];
+    // Removed pilots may only have left the view, the server nulls the strings of those that went offline
+    Object.entries(strings).forEach(([id, entry]) => {
+        if (entry === null) {
+            delete table[id];
+        } else {
+            table[id] = entry;
+        }
+    });
+
+    const pilots = [];
+    for (let i = 0; i < count; i++) {
+        const [callsign, name] = table[ids[i]] || ['', ''];
+        const pilot = {
+            latitude: latitude[i],
+            longitude: longitude[i],
+            heading: heading[i],
+            altitude: altitude[i],
+            callsign: callsign,
+            name: name,
+            // Same shape as the JSON endpoints, -1 marks a pilot without a progress
+            progress: remainingKm[i] < 0 ? null : {
+                remaining_km: remainingKm[i],
+                percent_complete: percentComplete[i] / 10,
+                eta: eta[i] || null
+            }
+        };
+        if (clusterCount) {
+            pilot.cluster_count = clusterCounts[i];
+        }
+        if (network === 'vatsim') {
+            pilot.cid = ids[i];
+            pilot.groundspeed = groundspeed[i];
+        } else {
+            pilot.userId = ids[i];
+            pilot.speed = groundspeed[i];
+        }
+        pilots.push(pilot);
+    }
+
+    return { version: version, full: full, pilots: pilots, removed: removed };
+}
+
 self.addEventListener('message', function(e) {
     const { action, mapBounds } = e.data;
     if (action === 'updatePilots') {
+        // Ask only for pilots inside the visible map, the server decimates them at low zoom
+        const viewportQuery = mapBounds
+            ? `northBound=${mapBounds.north}&southBound=${mapBounds.south}&eastBound=${mapBounds.east}&westBound=${mapBounds.west}&zoom=${mapBounds.zoom}`
+            : '';
+        if (viewportQuery !== lastViewportQuery) {
+            versions.vatsim = 0;
+            versions.ivao = 0;
+            lastViewportQuery = viewportQuery;
+        }
+
         // Define both fetch requests
-        const fetchVATSIM = fetch('/map/api/vatsim_network/').then(response => response.json());
-        const fetchIVAO = fetch('/map/api/ivao_network/').then(response => response.json());
+        const fetchVATSIM = fetch(`/map/api/vatsim_network/?format=columnar&since=${versions.vatsim}&${viewportQuery}`)
+            .then(response => response.arrayBuffer())
+            .then(buffer => decodePositions(buffer, 'vatsim'));
+        const fetchIVAO = fetch(`/map/api/ivao_network/?format=columnar&since=${versions.ivao}&${viewportQuery}`)
+            .then(response => response.arrayBuffer())
+            .then(buffer => decodePositions(buffer, 'ivao'));
 
         // Use Promise.all to wait for both requests to complete
         Promise.all([fetchVATSIM, fetchIVAO])
             .then(data => {
                 // data[0] contains the response from fetchVATSIM
                 // data[1] contains the response from fetchIVAO
+                versions.vatsim = data[0].version || 0;
+                versions.ivao = data[1].version || 0;
 
-                const pilotsVATSIM = data[0].pilots;
-                const pilotsIVAO = data[1].pilots;
-
-                // Process data here (e.g., filter by mapBounds, create SVGs)
-                // For simplicity, this example sends back the raw data
-                // Combine or process data as needed
+                // Full payloads replace every pilot of that network, deltas only carry changes and tombstones
                 const pilots = {
-                    vatsimPilots: pilotsVATSIM,
-                    ivaoPilots: pilotsIVAO
+                    vatsimPilots: data[0].pilots || [],
+                    ivaoPilots: data[1].pilots || [],
+                    vatsimRemoved: data[0].removed || [],
+                    ivaoRemoved: data[1].removed || [],
+                    vatsimFull: data[0].full !== false,
+                    ivaoFull: data[1].full !== false
                 };
 
                 self.postMessage({ pilots });
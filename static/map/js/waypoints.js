@@ -132,3 +132,101 @@ function drawWaypointsMarkers(waypoints) {
             .addTo(map);
     });
 }
+
+// Waypoint layer, loaded as z/x/y tiles for the part of the map in view.
+// Only the tiles in view are drawn and at most WAYPOINT_TILE_CACHE_SIZE are kept, so memory stays flat while panning.
+const WAYPOINT_MIN_ZOOM = 6; // Waypoints are hidden further out
+const WAYPOINT_TILE_MAX_ZOOM = 9; // The server sends every fix from this zoom, deeper tiles would only split them up
+const WAYPOINT_TILE_CACHE_SIZE = 64;
+const waypointTiles = new Map(); // 'z/x/y' -> GeoJSON features, in least recently used order
+
+/**
+ * Returns the 'z/x/y' keys of the tiles covering the map's current view.
+ * @returns {Array<String>} The tile keys.
+ */
+function visibleWaypointTiles() {
+    const z = Math.min(Math.floor(map.getZoom()), WAYPOINT_TILE_MAX_ZOOM);
+    const tiles = 2 ** z;
+    const bounds = map.getBounds();
+    const column = lng => Math.floor((lng + 180) / 360 * tiles);
+    const row = lat => {
+        const clamped = Math.max(-85.0511, Math.min(85.0511, lat)) * Math.PI / 180;
+        return Math.min(tiles - 1, Math.max(0, Math.floor((1 - Math.log(Math.tan(clamped) + 1 / Math.cos(clamped)) / Math.PI) / 2 * tiles)));
+    };
+    const keys = [];
+    // Columns wrap around the antimeridian when the view crosses it
+    const firstColumn = column(bounds.getWest());
+    const lastColumn = Math.min(column(bounds.getEast()), firstColumn + tiles - 1);
+    for (let x = firstColumn; x <= lastColumn; x++) {
+        for (let y = row(bounds.getNorth()); y <= row(bounds.getSouth()); y++) {
+            keys.push(`${z}/${((x % tiles) + tiles) % tiles}/${y}`);
+        }
+    }
+    return keys;
+}
+
+/**
+ * Fetches one waypoint tile, or returns it from the cache.
+ * @param {String} key - The tile key 'z/x/y'.
+ * @returns {Promise<Array>} A promise that resolves to the tile's GeoJSON features.
+ */
+function loadWaypointTile(key) {
+    if (waypointTiles.has(key)) {
+        const features = waypointTiles.get(key);
+        waypointTiles.delete(key);
+        waypointTiles.set(key, features);
+        return Promise.resolve(features);
+    }
+    return fetch(`/map/api/waypoints/${key}/`)
+        .then(response => response.json())
+        .then(data => {
+            const features = data.waypoints.map(wp => ({
+                type: 'Feature',
+                geometry: { type: 'Point', coordinates: [wp.longitude, wp.latitude] },
+                properties: { ident: wp.name }
+            }));
+            waypointTiles.set(key, features);
+            while (waypointTiles.size > WAYPOINT_TILE_CACHE_SIZE) {
+                waypointTiles.delete(waypointTiles.keys().next().value);
+            }
+            return features;
+        });
+}
+
+/**
+ * Draws the waypoints of the tiles in view, replacing the ones drawn before.
+ */
+function updateWaypointTiles() {
+    if (!map.getSource('waypoint-tiles')) {
+        return;
+    }
+    const keys = map.getZoom() >= WAYPOINT_MIN_ZOOM ? visibleWaypointTiles() : [];
+    Promise.all(keys.map(loadWaypointTile))
+        .then(tiles => {
+            map.getSource('waypoint-tiles').setData({ type: 'FeatureCollection', features: tiles.flat() });
+        })
+        .catch(error => console.error('Error fetching waypoint tiles:', error));
+}
+
+map.on('load', function() {
+    map.addSource('waypoint-tiles', {
+        type: 'geojson',
+        data: { type: 'FeatureCollection', features: [] }
+    });
+    map.addLayer({
+        id: 'waypoint-tiles',
+        type: 'symbol',
+        source: 'waypoint-tiles',
+        minzoom: WAYPOINT_MIN_ZOOM,
+        layout: {
+            'text-field': ['get', 'ident'],
+            'text-size': 10,
+            'text-allow-overlap': false
+        },
+        paint: {
+            'text-color': 'gray'
+        }
+    });
+    updateWaypointTiles();
+});
+map.on('moveend', updateWaypointTiles);